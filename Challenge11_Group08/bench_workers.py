@@ -0,0 +1,65 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+from benchmark import start_server, fetch
+
+# Requests per second against the pre-forked server for a range of worker
+# counts. Clients run in their own processes (several keep-alive connections
+# each) so the load generator is not limited to one core either:
+#   python bench_workers.py --workers 1 2 4 8 --clients 8 --duration 5
+
+def client(port, connections, duration, results):
+    socks = [socket.create_connection(('127.0.0.1', port)) for _ in range(connections)]
+    buffer = memoryview(bytearray(64 * 1024))
+    done = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for sock in socks:
+            fetch(sock, 'small.html', buffer)
+            done += 1
+    for sock in socks:
+        sock.close()
+    results.put(done)
+
+def measure(port, root, workers, clients, connections, duration):
+    server = start_server(port, root, '--workers', str(workers))
+    try:
+        time.sleep(0.5)  # let every worker come up
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=client, args=(port, connections, duration, results))
+                     for _ in range(clients)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        total = sum(results.get() for _ in processes)
+        elapsed = time.perf_counter() - start
+        for process in processes:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return total / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests per second by number of server workers")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 4, help="client processes")
+    parser.add_argument('--connections', type=int, default=4, help="connections per client process")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=8083)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} client processes x {args.connections} connections")
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, 'small.html'), 'wb') as f:
+            f.write(b'x' * 2048)
+        for workers in args.workers:
+            rate = measure(args.port, root, workers, args.clients, args.connections, args.duration)
+            print(f"{workers:3d} workers: {rate:10.0f} req/s")
+
+if __name__ == "__main__":
+    main()
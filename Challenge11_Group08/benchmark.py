@@ -0,0 +1,126 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Serves one large file to several concurrent downloaders while other clients
+# keep fetching a small file, and reports download throughput and small-request
+# latency (the small requests should not queue behind the big transfers):
+#   python benchmark.py --large-size 256 --downloads 4 --small-clients 8
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+def start_server(port, root, *options):
+    server = subprocess.Popen([sys.executable, SERVER, '--port', str(port), *options], cwd=root,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+def fetch(sock, path, buffer):
+    """GET path on a persistent connection, return the body length"""
+    sock.sendall(f'GET /{path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    head = b''
+    while b'\r\n\r\n' not in head:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError("connection closed")
+        head += chunk
+    head, body = head.split(b'\r\n\r\n', 1)
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    remaining = length - len(body)
+    while remaining > 0:
+        n = sock.recv_into(buffer, min(len(buffer), remaining))
+        if not n:
+            raise ConnectionError("connection closed")
+        remaining -= n
+    return length
+
+def download(port, results, index):
+    sock = socket.create_connection(('127.0.0.1', port))
+    start = time.perf_counter()
+    size = fetch(sock, 'large.bin', memoryview(bytearray(1024 * 1024)))
+    results[index] = (size, time.perf_counter() - start)
+    sock.close()
+
+def small_requests(port, stop, latencies):
+    sock = socket.create_connection(('127.0.0.1', port))
+    buffer = memoryview(bytearray(64 * 1024))
+    while not stop.is_set():
+        start = time.perf_counter()
+        fetch(sock, 'small.html', buffer)
+        latencies.append(time.perf_counter() - start)
+    sock.close()
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def run(port, large_mb, downloads, small_clients, small_size=2048):
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, 'large.bin'), 'wb') as f:
+            for _ in range(large_mb):
+                f.write(os.urandom(1024 * 1024))
+        with open(os.path.join(root, 'small.html'), 'wb') as f:
+            f.write(b'x' * small_size)
+
+        server = start_server(port, root)
+        try:
+            stop = threading.Event()
+            latencies = []
+            small = [threading.Thread(target=small_requests, args=(port, stop, latencies))
+                     for _ in range(small_clients)]
+            for thread in small:
+                thread.start()
+            time.sleep(0.5)  # Small-request baseline before the downloads start
+            baseline = len(latencies)
+
+            results = [None] * downloads
+            large = [threading.Thread(target=download, args=(port, results, i))
+                     for i in range(downloads)]
+            start = time.perf_counter()
+            for thread in large:
+                thread.start()
+            for thread in large:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            stop.set()
+            for thread in small:
+                thread.join()
+        finally:
+            server.terminate()
+            server.wait()
+    return results, elapsed, latencies[:baseline], latencies[baseline:]
+
+def main():
+    parser = argparse.ArgumentParser(description="Large downloads vs small request latency")
+    parser.add_argument('--large-size', type=int, default=256, help="large file size in MB")
+    parser.add_argument('--downloads', type=int, default=4, help="concurrent large downloads")
+    parser.add_argument('--small-clients', type=int, default=8, help="clients fetching a small file")
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    results, elapsed, idle, loaded = run(args.port, args.large_size, args.downloads, args.small_clients)
+    total = sum(size for size, _ in results)
+    print(f"large downloads: {args.downloads} x {args.large_size} MB in {elapsed:.2f} s")
+    print(f"throughput:      {total / elapsed / 1e6:.1f} MB/s aggregate")
+    for label, samples in (("small, idle", idle), ("small, loaded", loaded)):
+        if samples:
+            print(f"{label + ':':<17}{len(samples)} requests, p50 {percentile(samples, 50) * 1000:.2f} ms, "
+                  f"p99 {percentile(samples, 99) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
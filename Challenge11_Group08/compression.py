@@ -0,0 +1,58 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip is made on the fly
+    brotli = None
+
+# Content-Encoding for server.py. Precompressed siblings (style.css.br,
+# style.css.gz) are served when the client accepts them; otherwise bodies of
+# compressible types are compressed on the fly, off the event loop. Binary
+# types and bodies too small or too large to be worth it are sent as they are.
+
+SIBLINGS = {'br': '.br', 'gzip': '.gz'}  # precompressed files next to the original, preferred first
+MIN_SIZE = 256               # smaller bodies barely shrink and cost a round of compression
+MAX_SIZE = 8 * 1024 * 1024   # larger ones would hold a compression thread too long
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5           # brotli's slower levels are meant for precompressing, not on the fly
+
+COMPRESSIBLE_TYPES = {'application/javascript', 'application/json', 'application/xml',
+                      'application/xhtml+xml', 'application/wasm', 'image/svg+xml',
+                      'application/x-javascript', 'application/manifest+json'}
+
+def compressible(mime_type):
+    mime_type = mime_type.split(';', 1)[0].strip()
+    return (mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES
+            or mime_type.endswith('+xml') or mime_type.endswith('+json'))
+
+def on_the_fly():
+    """The codings this server can produce itself, preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def choose_encoding(accept_encoding, available):
+    """The coding from available the client likes best, or None for identity"""
+    if not accept_encoding or not available:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        name, _, value = params.partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+    best, best_q = None, 0.0
+    for coding in SIBLINGS:  # preference order breaks ties
+        q = weights.get(coding, weights.get('*', 0.0))
+        if coding in available and q > best_q:
+            best, best_q = coding, q
+    return best
+
+def compress(data, coding):
+    if coding == 'br':
+        return brotli.compress(bytes(data), quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
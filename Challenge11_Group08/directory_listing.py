@@ -0,0 +1,139 @@
+import html
+import os
+import urllib.parse
+from collections import OrderedDict
+
+# Directory listings for server.py. A directory is read once with os.scandir
+# (the file type comes with each entry, no stat per file), sorted, and its
+# entries rendered to HTML list items. That Listing is cached under the
+# directory's inode and mtime, which change whenever an entry is added, removed
+# or renamed, and served PAGE_SIZE entries at a time.
+
+PAGE_SIZE = 1000
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html')
+
+_template = None
+
+def template():
+    """index.html split around %CONTENT%, read on first use"""
+    global _template
+    if _template is None:
+        with open(TEMPLATE_PATH, 'r') as f:
+            before, _, after = f.read().partition('%CONTENT%')
+        _template = (before, after)
+    return _template
+
+def list_item(link):
+    return f'''
+            <li class="file-item">
+                <div class="file-name">{link}</div>
+            </li>'''
+
+def requested_page(query):
+    """The 1-based page asked for with ?page=N"""
+    try:
+        return max(int(urllib.parse.parse_qs(query).get('page', ['1'])[0]), 1)
+    except ValueError:
+        return 1
+
+def directory_key(st):
+    return (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+class Listing:
+    """The sorted, rendered entries of one directory"""
+    def __init__(self, path):
+        # Stat before reading, so a change during the scan invalidates the result
+        self.key = directory_key(os.stat(path))
+        self.path = path
+        abs_path = os.path.abspath(path)
+        rel_path = os.path.relpath(abs_path, start=os.getcwd())
+
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                entries.append((not is_dir, entry.name.lower(), entry.name, is_dir))
+        entries.sort()
+
+        # Parent directory link if not in root
+        self.items = [] if rel_path == '.' else [self.link(rel_path, '..', True)]
+        self.items += [self.link(rel_path, name, is_dir) for _, _, name, is_dir in entries]
+        self.pages = max(1, -(-len(self.items) // PAGE_SIZE))
+        self.header = template()[0].replace('%PATH%', html.escape(abs_path))
+        self.rendered = {}  # {(page, coding): body bytes}, filled in by the server
+
+    @staticmethod
+    def link(rel_path, name, is_dir):
+        href = urllib.parse.quote(f'/{os.path.join(rel_path, name)}')
+        if is_dir:
+            return list_item(f'<a href="{href}" class="directory">📁 {html.escape(name)}/</a>')
+        return list_item(f'<a href="{href}">📄 {html.escape(name)}</a>')
+
+    def render(self, page):
+        """The HTML of one page of the listing (past the end: the last page)"""
+        page = min(page, self.pages)
+        start = (page - 1) * PAGE_SIZE
+        parts = [self.header]
+        nav = ''
+        if self.pages > 1:
+            links = [f'Page {page} of {self.pages}']
+            if page > 1:
+                links.append(f'<a href="?page={page - 1}">previous</a>')
+            if page < self.pages:
+                links.append(f'<a href="?page={page + 1}">next</a>')
+            nav = list_item(' · '.join(links))
+        parts.append(nav)
+        parts.extend(self.items[start:start + PAGE_SIZE])
+        parts.append(nav)
+        parts.append(template()[1])
+        return ''.join(parts).encode('utf-8')
+
+class ListingCache:
+    """Listings of recently viewed directories, up to max_items entries in total"""
+    def __init__(self, max_items=500000):
+        self.max_items = max_items
+        self.listings = OrderedDict()  # {path: Listing}, least recently used first
+        self.items = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """The cached Listing of path if the directory has not changed since, else None"""
+        listing = self.listings.get(path)
+        try:
+            current = listing is not None and directory_key(os.stat(path)) == listing.key
+        except OSError:
+            current = False
+        if not current:
+            self.remove(path)
+            self.misses += 1
+            return None
+        self.listings.move_to_end(path)
+        self.hits += 1
+        return listing
+
+    def add(self, listing):
+        if self.listings.get(listing.path) is listing:
+            return
+        self.remove(listing.path)
+        self.listings[listing.path] = listing
+        self.items += len(listing.items)
+        while self.items > self.max_items and len(self.listings) > 1:
+            _, evicted = self.listings.popitem(last=False)
+            self.items -= len(evicted.items)
+
+    def remove(self, path):
+        listing = self.listings.pop(path, None)
+        if listing is not None:
+            self.items -= len(listing.items)
+
+    def stats(self):
+        return (f"listing_cache_hits {self.hits}\n"
+                f"listing_cache_misses {self.misses}\n"
+                f"listing_cache_directories {len(self.listings)}\n"
+                f"listing_cache_items {self.items}\n")
@@ -0,0 +1,92 @@
+import copy
+import email.utils
+
+# Validators, conditional requests and byte ranges for server.py (RFC 9110
+# sections 8.8, 13 and 14). Validators come straight from the file's stat, so
+# revalidating costs no reads: the ETag is inode-size-mtime, Last-Modified the
+# mtime.
+
+MAX_RANGES = 16  # more ranges than this in one request and the whole file is sent
+
+class FileVersion:
+    """ETag and Last-Modified of one version of a file"""
+    def __init__(self, st):
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+
+    def encoded(self, coding, size):
+        """The version of a compressed representation: its own size and ETag"""
+        version = copy.copy(self)
+        version.size = size
+        version.etag = f'{self.etag[:-1]}-{coding}"'
+        return version
+
+def parse_date(value):
+    """Seconds since the epoch of an HTTP date, or None if it is not one"""
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def etag_matches(value, etag):
+    """If-None-Match comparison: weak, and '*' matches anything"""
+    if value.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in value.split(',')]
+    return etag in tags or f'W/{etag}' in tags
+
+def not_modified(headers, version):
+    """Whether a GET/HEAD with these headers gets 304 Not Modified"""
+    if 'if-none-match' in headers:
+        # If-Modified-Since is ignored when If-None-Match is there
+        return etag_matches(headers['if-none-match'], version.etag)
+    if 'if-modified-since' in headers:
+        since = parse_date(headers['if-modified-since'])
+        return since is not None and version.mtime <= since
+    return False
+
+def requested_ranges(headers, version):
+    """The (first, last) byte ranges to send, [] if none can be, None for the whole file"""
+    value = headers.get('range')
+    if value is None:
+        return None
+
+    # If-Range: only send part of the file if it is still the version the client has
+    if_range = headers.get('if-range')
+    if if_range is not None and if_range != version.etag and if_range != version.last_modified:
+        return None
+
+    unit, _, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    size = version.size
+    ranges = []
+    for spec in specs.split(','):
+        first, dash, last = spec.strip().partition('-')
+        if not dash or not (first or last) or not all(n.isdigit() for n in (first, last) if n):
+            return None  # Malformed: ignore the header
+        if not first:
+            # Suffix range: the last N bytes
+            if int(last) > 0 and size > 0:
+                ranges.append((max(0, size - int(last)), size - 1))
+            continue
+        first = int(first)
+        if last and int(last) < first:
+            return None
+        if first < size:
+            ranges.append((first, min(int(last), size - 1) if last else size - 1))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Coalesce overlapping and adjacent ranges so no byte is sent twice
+    ranges.sort()
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
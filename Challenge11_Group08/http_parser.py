@@ -0,0 +1,87 @@
+# Incremental HTTP/1.x request parser for server.py: feed() it whatever recv
+# returned, then take complete requests off with next_request() until it
+# returns None. Partial headers stay buffered across reads, several pipelined
+# requests in one read come out one by one, in order, and request bodies
+# (which this static server never needs) are skipped.
+
+MAX_HEADER_SIZE = 64 * 1024
+
+class ParseError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+class Request:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers  # {lower-case name: value}
+
+    @property
+    def keep_alive(self):
+        """HTTP/1.1 keeps the connection unless told to close, HTTP/1.0 only if asked"""
+        tokens = [t.strip().lower() for t in self.headers.get('connection', '').split(',')]
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in tokens
+        return 'close' not in tokens
+
+class RequestParser:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scanned = 0         # bytes already searched for the end of the headers
+        self.body_remaining = 0  # body bytes of the last request still to skip
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_request(self):
+        """The next complete Request, or None until more bytes arrive"""
+        if self.body_remaining:
+            skipped = min(self.body_remaining, len(self.buffer))
+            del self.buffer[:skipped]
+            self.body_remaining -= skipped
+            if self.body_remaining:
+                return None
+
+        # Empty lines before a request line are allowed (RFC 9112 section 2.2)
+        while self.buffer[:2] == b'\r\n':
+            del self.buffer[:2]
+
+        end = self.buffer.find(b'\r\n\r\n', max(0, self.scanned - 3))
+        if end < 0:
+            self.scanned = len(self.buffer)
+            if len(self.buffer) > MAX_HEADER_SIZE:
+                raise ParseError(431, 'Request Header Fields Too Large')
+            return None
+        if end > MAX_HEADER_SIZE:
+            raise ParseError(431, 'Request Header Fields Too Large')
+        head = self.buffer[:end].decode('iso-8859-1')
+        del self.buffer[:end + 4]
+        self.scanned = 0
+
+        lines = head.split('\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3:
+            raise ParseError(400, 'Bad Request')
+        method, target, version = parts
+        if not version.startswith('HTTP/1.'):
+            raise ParseError(505, 'HTTP Version Not Supported')
+
+        headers = {}
+        for line in lines[1:]:
+            name, colon, value = line.partition(':')
+            if not colon or not name or name != name.strip():
+                raise ParseError(400, 'Bad Request')
+            name = name.lower()
+            value = value.strip()
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+        if 'transfer-encoding' in headers:
+            raise ParseError(501, 'Not Implemented')
+        length = headers.get('content-length', '0')
+        if not length.isdigit():
+            raise ParseError(400, 'Bad Request')
+        self.body_remaining = int(length)
+        return Request(method, target, version, headers)
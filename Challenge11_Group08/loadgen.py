@@ -0,0 +1,107 @@
+import argparse
+import os
+import selectors
+import socket
+import tempfile
+import time
+
+from benchmark import start_server, fetch, percentile
+
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+# Idle keep-alive load generator: opens many connections that each make one
+# request and then stay open doing nothing, then measures the server's CPU use
+# while they idle and the latency of fresh requests made alongside them
+#   python loadgen.py --connections 10000 --idle 5
+
+REQUEST = b'GET /small.html HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process, from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def open_idle_connections(port, count):
+    """Connect count sockets, make one request on each and read the responses"""
+    sockets = []
+    for _ in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(REQUEST)
+        sock.setblocking(False)
+        sockets.append(sock)
+
+    # Wait for every response so the connections really are idle afterwards
+    selector = selectors.DefaultSelector()
+    for sock in sockets:
+        selector.register(sock, selectors.EVENT_READ)
+    answered = 0
+    while answered < count:
+        for key, _ in selector.select(timeout=10):
+            data = key.fileobj.recv(65536)
+            if not data:
+                raise ConnectionError("server closed an idle connection")
+            selector.unregister(key.fileobj)
+            answered += 1
+    selector.close()
+    return sockets
+
+def probe(port, requests):
+    """Latency of requests on a fresh connection"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    buffer = memoryview(bytearray(65536))
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fetch(sock, 'small.html', buffer)
+        latencies.append(time.perf_counter() - start)
+    sock.close()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Many idle keep-alive connections against server.py")
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--idle', type=float, default=5.0, help="seconds to measure idle CPU over")
+    parser.add_argument('--probes', type=int, default=500, help="requests made while the rest idle")
+    parser.add_argument('--port', type=int, default=8082)
+    args = parser.parse_args()
+
+    if resource is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, 'small.html'), 'wb') as f:
+            f.write(b'x' * 2048)
+        server = start_server(args.port, root)
+        try:
+            start = time.perf_counter()
+            sockets = open_idle_connections(args.port, args.connections)
+            setup = time.perf_counter() - start
+
+            cpu_start = cpu_seconds(server.pid)
+            time.sleep(args.idle)
+            cpu_end = cpu_seconds(server.pid)
+            latencies = probe(args.port, args.probes)
+            alive = server.poll() is None
+            for sock in sockets:
+                sock.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"connections:     {args.connections} opened and answered in {setup:.2f} s")
+    if cpu_start is not None:
+        print(f"idle server CPU: {(cpu_end - cpu_start) / args.idle:.1%} over {args.idle:.0f} s")
+    print(f"probe requests:  p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"server alive:    {alive}")
+
+if __name__ == "__main__":
+    main()
@@ -1,132 +1,722 @@
+import argparse
 import socket
-import select
+import selectors
 import sys
 import os
 import mimetypes
+import signal
+import subprocess
+import time
+import urllib.parse
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-server_address = ('127.0.0.1', 8080)
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server_socket.bind(server_address)
-server_socket.listen(5)
+from compression import SIBLINGS, MIN_SIZE, MAX_SIZE, choose_encoding, compress, compressible, on_the_fly
+from directory_listing import Listing, ListingCache, requested_page
+from http_conditional import FileVersion, not_modified, requested_ranges
+from http_parser import RequestParser, ParseError
+from static_cache import CachedFile, StaticCache
 
-input_socket = [server_socket]
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+# At most this much of a file goes out per writable event, so one big
+# download can't keep the loop from serving everyone else
+SEND_CHUNK = 1024 * 1024
+MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+
+IDLE_TIMEOUT = 30.0  # close keep-alive connections quiet for this long
+DRAIN_TIMEOUT = 30.0  # how long a stopping worker waits for its open requests
+MAX_PIPELINE = 32    # queued responses per connection before we stop reading from it
+
+BOUNDARY = f'byteranges-{os.urandom(8).hex()}'  # separates the parts of multi-range responses
+STATS_PATH = '__stats'  # GET /__stats: this process's counters, as text
+static_cache = None  # StaticCache, set up in main()
+document_root = os.path.realpath('.')  # the directory being served; nothing outside it is
+listing_cache = ListingCache()
+
+class Response:
+    """Bytes and ranges of an open file, sent in order as the socket allows"""
+    def __init__(self, head, file=None, length=0):
+        self.segments = deque()  # memoryviews of bytes to send, [offset, remaining] file ranges
+        self.file = file
+        self.use_sendfile = hasattr(os, 'sendfile')
+        self.job = None  # (key, work, finish) while the body is being made off the loop
+        self.add(head)
+        if file and length:
+            self.add_file(0, length)
+
+    @property
+    def ready(self):
+        return self.job is None
+
+    def finish(self, result):
+        """Become the Response built from the result of the deferred job"""
+        finish = self.job[2]
+        self.job = None
+        response = finish(result)
+        self.segments, self.file = response.segments, response.file
+
+    def add(self, data):
+        if data:
+            self.segments.append(memoryview(data))
+
+    def add_file(self, offset, length):
+        self.segments.append([offset, length])
+
+    def send(self, sock):
+        """Send what the socket takes without blocking; True once everything is out"""
+        while self.segments:
+            segment = self.segments[0]
+            if isinstance(segment, memoryview):
+                # MSG_MORE lets the kernel put what follows in the same
+                # segment instead of waiting on Nagle for it
+                sent = sock.send(segment, MSG_MORE if len(self.segments) > 1 else 0)
+                if sent < len(segment):
+                    self.segments[0] = segment[sent:]
+                    return False
+                self.segments.popleft()
+                continue
+
+            offset, remaining = segment
+            count = min(SEND_CHUNK, remaining)
+            sent = None
+            if self.use_sendfile:
+                try:
+                    # Zero-copy: the kernel moves file pages straight to the socket
+                    sent = os.sendfile(sock.fileno(), self.file.fileno(), offset, count)
+                except (BlockingIOError, InterruptedError):
+                    return False
+                except OSError:
+                    self.use_sendfile = False  # e.g. a filesystem without sendfile support
+            if sent is None:
+                self.file.seek(offset)
+                sent = sock.send(self.file.read(count))
+
+            if sent == 0:
+                self.segments.clear()  # File shrank under us, nothing more to send
+                return True
+            segment[0] += sent
+            segment[1] -= sent
+            if not segment[1]:
+                self.segments.popleft()
+            # At most one file chunk per call
+            return not self.segments
+        return True
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+class Connection:
+    """A client socket with its request parser and queue of responses to write"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.parser = RequestParser()
+        self.responses = deque()  # Response objects, sent in request order
+        self.closing = False      # no more requests once the queued responses are out
+        self.events = selectors.EVENT_READ
+        self.last_active = 0.0
+
+def format_head(status, headers, length):
+    lines = [f'HTTP/1.1 {status}'] + [f'{name}: {value}' for name, value in headers]
+    if length is not None:
+        lines.append(f'Content-Length: {length}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+def build_response(status, headers=(), body=b'', file=None, length=None, head_only=False):
+    """Response with a status line, headers and either body bytes or an open file"""
+    if length is None:
+        length = len(body)
+    if head_only:
+        # HEAD: same headers as GET, no body
+        if file:
+            file.close()
+        body, file = b'', None
+    return Response(format_head(status, headers, length) + body, file, length)
+
+def deferred_response(key, work, finish):
+    """A Response that waits in the queue while work() runs in the server's
+    thread pool, then becomes finish(work()). Jobs with the same key run once."""
+    response = Response(b'')
+    response.job = (key, work, finish)
+    return response
+
+def file_response(request, version, mime_type, connection_headers, cached=None, file=None, coding=None):
+    """200, 206, 304 or 416 for a file, served from its cache entry or an open file"""
+    head_only = request.method == 'HEAD'
+    if cached is not None:
+        coding = cached.coding
+    validators = [('ETag', version.etag), ('Last-Modified', version.last_modified)]
+    if coding:
+        validators.append(('Content-Encoding', coding))
+    if compressible(mime_type):
+        validators.append(('Vary', 'Accept-Encoding'))
+
+    if not_modified(request.headers, version):
+        if file:
+            file.close()
+        # Content-Length is that of the 200 the client already has
+        return build_response('304 Not Modified', [*validators, *connection_headers],
+                              length=version.size, head_only=True)
+
+    # Range only applies to GET
+    ranges = None if head_only else requested_ranges(request.headers, version)
+    if ranges is None:
+        if cached is not None:
+            return Response(cached.render(connection_headers, head_only))
+        headers = [('Content-Type', mime_type), ('Accept-Ranges', 'bytes'), *validators, *connection_headers]
+        return build_response('200 OK', headers, file=file, length=version.size, head_only=head_only)
+    if not ranges:
+        if file:
+            file.close()
+        return build_response('416 Range Not Satisfiable',
+                              [('Content-Range', f'bytes */{version.size}'), *connection_headers])
+
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        content_type = mime_type
+        extra = [('Content-Range', f'bytes {first}-{last}/{version.size}')]
+        parts = [(b'', first, last)]
+        closing = b''
+    else:
+        # Several ranges: a multipart/byteranges body, one part per range
+        content_type = f'multipart/byteranges; boundary={BOUNDARY}'
+        extra = []
+        parts = [((f'\r\n--{BOUNDARY}\r\nContent-Type: {mime_type}\r\n'
+                   f'Content-Range: bytes {first}-{last}/{version.size}\r\n\r\n').encode('utf-8'), first, last)
+                 for first, last in ranges]
+        closing = f'\r\n--{BOUNDARY}--\r\n'.encode('utf-8')
+
+    headers = [('Content-Type', content_type), *extra, *validators, *connection_headers]
+    length = sum(len(part) + last - first + 1 for part, first, last in parts) + len(closing)
+    response = Response(format_head('206 Partial Content', headers, length), file)
+    for part, first, last in parts:
+        response.add(part)
+        if cached is not None:
+            response.add(cached.body[first:last + 1])
+        else:
+            response.add_file(first, last - first + 1)
+    response.add(closing)
+    return response
+
+def cached_response(request, cached, connection_headers):
+    """Response for a cached file, in the best encoding the client accepts"""
+    coding = None
+    accept_encoding = request.headers.get('accept-encoding')
+    # Ranges are always of the plain file
+    if accept_encoding and 'range' not in request.headers:
+        available = set(cached.variants)
+        if cached.compressible:
+            available.update(on_the_fly())
+        coding = choose_encoding(accept_encoding, available)
+    if coding is None:
+        return file_response(request, cached.version, cached.mime_type, connection_headers, cached=cached)
 
-def generate_directory_listing(base_path='.'):
+    variant = cached.variants.get(coding)
+    if variant is not None:
+        return file_response(request, variant.version, cached.mime_type, connection_headers, cached=variant)
+    # First request for this encoding: compress in the pool, keep the result next to the plain body
+    return deferred_response(('file', id(cached), coding), partial(compress, cached.body, coding),
+                             partial(finish_compressed_file, request, cached, coding, connection_headers))
+
+def finish_compressed_file(request, cached, coding, connection_headers, data):
+    if len(data) >= len(cached.body):
+        cached.compressible = False  # Doesn't shrink, send it plain from now on
+        return file_response(request, cached.version, cached.mime_type, connection_headers, cached=cached)
+    variant = cached.variants.get(coding) or static_cache.add_variant(cached, coding, data)
+    return file_response(request, variant.version, cached.mime_type, connection_headers, cached=variant)
+
+def read_compressed(path, coding):
+    # Runs in the pool: the file's stat and body, compressed unless that doesn't shrink it
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        body = f.read()
+    data = compress(body, coding)
+    if len(data) >= len(body):
+        return st, body, None
+    return st, data, coding
+
+def finish_compressed_stream(request, path, mime_type, connection_headers, result):
+    st, body, coding = result
+    version = FileVersion(st)
+    if coding:
+        version = version.encoded(coding, len(body))
+    entry = CachedFile(path, version, mime_type, body, time.monotonic(), coding)
+    if coding:
+        static_cache.add_encoded(path, FileVersion(st).etag, entry)
+    return file_response(request, version, mime_type, connection_headers, cached=entry)
+
+def listing_response(request, path, query, connection_headers):
+    """Directory listing page, from the cached Listing or after scanning the directory in the pool"""
+    page = requested_page(query)
+    coding = choose_encoding(request.headers.get('accept-encoding'), on_the_fly())
+    listing = listing_cache.get(path)
+    if listing is not None:
+        page = min(page, listing.pages)
+        body = listing.rendered.get((page, coding))
+        if body is not None:
+            return listing_page_response(request, coding, connection_headers, body)
+    # Scanning, rendering and compressing a big directory takes a while: not on the loop
+    return deferred_response(('listing', path, page, coding), partial(build_listing_page, path, listing, page, coding),
+                             partial(finish_listing_page, request, page, coding, connection_headers))
+
+def build_listing_page(path, listing, page, coding):
+    # Runs in the pool
     try:
-        template_path = os.path.join(os.path.dirname(__file__), 'index.html')
-        with open(template_path, 'r') as f:
-            template = f.read()
+        if listing is None:
+            listing = Listing(path)
+        body = listing.render(page)
+    except Exception as e:
+        print(f"Error generating directory listing: {e}")
+        return None, f"<html><body><h1>Error: {str(e)}</h1></body></html>".encode('utf-8'), None
+    if coding and len(body) >= MIN_SIZE:
+        return listing, body, compress(body, coding)
+    return listing, body, None
+
+def finish_listing_page(request, page, coding, connection_headers, result):
+    listing, body, compressed = result
+    if listing is None:
+        return listing_page_response(request, None, connection_headers, body)
+    listing_cache.add(listing)
+    page = min(page, listing.pages)
+    listing.rendered[(page, None)] = body
+    if compressed is None:
+        return listing_page_response(request, None, connection_headers, body)
+    listing.rendered[(page, coding)] = compressed
+    return listing_page_response(request, coding, connection_headers, compressed)
+
+def listing_page_response(request, coding, connection_headers, body):
+    headers = [('Content-Type', 'text/html; charset=UTF-8'), ('Vary', 'Accept-Encoding')]
+    if coding:
+        headers.append(('Content-Encoding', coding))
+    return build_response('200 OK', [*headers, *connection_headers], body, head_only=request.method == 'HEAD')
+
+def handle_request(request, connection_headers=()):
+    """Build the Response for one parsed Request"""
+    if request.method not in ('GET', 'HEAD'):
+        return build_response('501 Not Implemented', connection_headers)
+    head_only = request.method == 'HEAD'
     
-        # Get absolute path and make it relative to server root
-        abs_path = os.path.abspath(base_path)
-        rel_path = os.path.relpath(abs_path, start=os.getcwd())
-        
-        items = []
-        # Add parent directory link if not in root
-        if rel_path != '.':
-            items.append({
-                'name': '..',
-                'is_dir': True,
-                'size': 0,
-                'mtime': 0
-            })
-        
-        for f in os.listdir(base_path):
-            full_path = os.path.join(base_path, f)
-            item = {
-                'name': f,
-                'is_dir': os.path.isdir(full_path),
-                'size': os.path.getsize(full_path) if os.path.isfile(full_path) else 0,
-                'mtime': os.path.getmtime(full_path)
-            }
-            items.append(item)
+    target, _, query = request.target.partition('?')
+    request_file = urllib.parse.unquote(target).lstrip('/')
+    
+    # Check for index files first
+    if request_file == '' or request_file == '/':
+        request_path = '.'
+    else:
+        request_path = request_file
+
+    # Hot small files: no stat, open or read, just the prepared bytes
+    cached = static_cache.get(request_path)
+    if cached is not None:
+        return cached_response(request, cached, connection_headers)
+
+    if request_path == STATS_PATH:
+        headers = [('Content-Type', 'text/plain; charset=UTF-8'), *connection_headers]
+        body = f"pid {os.getpid()}\n{static_cache.stats()}{listing_cache.stats()}".encode('utf-8')
+        return build_response('200 OK', headers, body, head_only=head_only)
+
+    # The target was percent-decoded, so %2e%2e/ is ../ by now: only paths that resolve
+    # (symlinks too) inside the document root are served. Cached ones already did.
+    try:
+        inside = os.path.commonpath([document_root, os.path.realpath(request_path)]) == document_root
+    except ValueError:
+        inside = False  # An embedded NUL, or another drive
+    if not inside:
+        return build_response('404 Not Found', connection_headers)
+
+    if os.path.isdir(request_path):
+        index_php = os.path.join(request_path, 'index.php')
+        if os.path.exists(index_php):
+            request_file = index_php
+        else:
+            return listing_response(request, request_path, query, connection_headers)
+
+    # Handle file requests
+    if os.path.exists(request_file):
+        mime_type, _ = mimetypes.guess_type(request_file)
+        if mime_type is None:
+            mime_type = 'application/octet-stream'
         
-        items.sort(key=lambda x: (not x['is_dir'], x['name'].lower()))
+        # Special handling for PHP files
+        if request_file.endswith('.php'):
+            # For this example, just serve the PHP file as text
+            mime_type = 'text/plain'
         
-        content = ''
-        for item in items:
-            name = item['name']
-            if item['is_dir']:
-                link = f'<a href="/{os.path.join(rel_path, name)}" class="directory">📁 {name}/</a>'
-            else:
-                link = f'<a href="/{os.path.join(rel_path, name)}">📄 {name}</a>'
-            
-            content += f'''
-            <li class="file-item">
-                <div class="file-name">{link}</div>
-            </li>
-            '''
+        f = open(request_file, 'rb')
+        cached = static_cache.add(request_file, f, mime_type)
+        if cached is not None:
+            f.close()
+            return cached_response(request, cached, connection_headers)
 
-        return template.replace('%CONTENT%', content).replace('%PATH%', abs_path)
-    except Exception as e:
-        print(f"Error generating directory listing: {e}")
-        return f"<html><body><h1>Error: {str(e)}</h1></body></html>"
+        # Too big to cache: from a precompressed sibling if there is one the
+        # client accepts, else compressed in the pool up to MAX_SIZE, else
+        # streamed from the file as the socket drains
+        f.seek(0)
+        coding = None
+        accept_encoding = request.headers.get('accept-encoding')
+        if accept_encoding and compressible(mime_type) and 'range' not in request.headers:
+            available = [coding for coding, suffix in SIBLINGS.items() if os.path.isfile(request_file + suffix)]
+            coding = choose_encoding(accept_encoding, available)
+            if coding is None:
+                version = FileVersion(os.fstat(f.fileno()))
+                coding = choose_encoding(accept_encoding, on_the_fly())
+                if coding and MIN_SIZE <= version.size <= MAX_SIZE:
+                    f.close()
+                    encoded = static_cache.get_encoded(request_file, version.etag, coding)
+                    if encoded is not None:
+                        return file_response(request, encoded.version, mime_type, connection_headers,
+                                             cached=encoded)
+                    # Its ETag doesn't depend on the compressed bytes: a 304 needs no compressing
+                    # (nor the Content-Length, which isn't known yet)
+                    encoded = version.encoded(coding, None)
+                    if not_modified(request.headers, encoded):
+                        validators = [('ETag', encoded.etag), ('Last-Modified', encoded.last_modified),
+                                      ('Content-Encoding', coding), ('Vary', 'Accept-Encoding')]
+                        return Response(format_head('304 Not Modified', [*validators, *connection_headers],
+                                                    None))
+                    return deferred_response(('stream', request_file, version.etag, coding),
+                                             partial(read_compressed, request_file, coding),
+                                             partial(finish_compressed_stream, request, request_file, mime_type,
+                                                     connection_headers))
+                coding = None
+        if coding:
+            f.close()
+            f = open(request_file + SIBLINGS[coding], 'rb')
+            st = os.fstat(f.fileno())
+            version = FileVersion(st).encoded(coding, st.st_size)
+        else:
+            version = FileVersion(os.fstat(f.fileno()))
+        return file_response(request, version, mime_type, connection_headers, file=f, coding=coding)
+    
+    return build_response('404 Not Found', connection_headers)
 
-try:
-    while True:
-        read_ready, write_ready, exception = select.select(input_socket, [], [])
-        
-        for sock in read_ready:
-            if sock == server_socket:
-                client_socket, client_address = server_socket.accept()
-                input_socket.append(client_socket)                       
-            else:                
-                data = sock.recv(4096)
-                
-                if not data:
-                    input_socket.remove(sock)
-                    sock.close()
+class Server:
+    """Event loop over non-blocking sockets: epoll (or the best the OS has) via selectors"""
+    def __init__(self, server_socket, compress_threads=2):
+        self.server_socket = server_socket
+        self.server_socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(server_socket, selectors.EVENT_READ, None)
+        self.connections = OrderedDict()  # {Connection: None}, least recently active first
+        self.draining = False
+
+        # Deferred responses (compression): the pool does the work, then a
+        # byte on the wakeup socket gets the loop to pick up the results
+        self.pool = ThreadPoolExecutor(max_workers=compress_threads)
+        self.jobs = {}        # {job key: [(Connection, Response) waiting for it]}
+        self.done = deque()   # (job key, Future), appended from pool threads
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, self.wakeup_recv)
+
+    def serve_forever(self):
+        while not self.draining or self.connections:
+            if self.draining and time.monotonic() > self.drain_deadline:
+                break  # Clients that still hold on after the grace period are cut off
+            for key, events in self.selector.select(timeout=1.0):
+                if key.data is None:
+                    self.accept()
+                    continue
+                if key.data is self.wakeup_recv:
+                    self.finish_jobs()
                     continue
-                
-                data_str = data.decode('utf-8')
-                request_header = data_str.split('\r\n')
-                
-                if len(request_header[0].split()) < 2:
+                conn = key.data
+                if events & selectors.EVENT_WRITE:
+                    self.write(conn)
+                if events & selectors.EVENT_READ and conn.sock.fileno() != -1:
+                    self.read(conn)
+            self.close_idle()
+
+    def drain(self):
+        """Stop accepting and let serve_forever return once open requests are answered"""
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_deadline = time.monotonic() + DRAIN_TIMEOUT
+        self.selector.unregister(self.server_socket)
+        for conn in list(self.connections):
+            conn.closing = True
+            # Idle keep-alive connections go now, busy ones after their last response
+            if not conn.responses:
+                self.close(conn)
+
+    def accept(self):
+        # Take every connection that is waiting, not just one per wakeup
+        while True:
+            try:
+                client_socket, client_address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            client_socket.setblocking(False)
+            conn = Connection(client_socket)
+            self.selector.register(client_socket, conn.events, conn)
+            self.touch(conn)
+
+    def start_job(self, conn, response):
+        key, work, _ = response.job
+        waiting = self.jobs.get(key)
+        if waiting is None:
+            self.jobs[key] = waiting = []
+            future = self.pool.submit(work)
+            future.add_done_callback(lambda future: self.job_done(key, future))
+        waiting.append((conn, response))
+
+    def job_done(self, key, future):
+        # Runs in a pool thread: hand over to the loop
+        self.done.append((key, future))
+        try:
+            self.wakeup_send.send(b'\0')
+        except BlockingIOError:
+            pass  # Already plenty of wakeups pending
+
+    def finish_jobs(self):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.done:
+            key, future = self.done.popleft()
+            for conn, response in self.jobs.pop(key):
+                if conn not in self.connections:
+                    continue  # Closed while we were working for it
+                try:
+                    response.finish(future.result())
+                except Exception as e:
+                    print(f"Error preparing response: {e}")
+                    self.close(conn)
                     continue
-                    
-                request_file = request_header[0].split()[1].lstrip('/')
-                
-                # Check for index files first
-                if request_file == '' or request_file == '/':
-                    request_path = '.'
-                else:
-                    request_path = request_file
-
-                if os.path.isdir(request_path):
-                    index_php = os.path.join(request_path, 'index.php')
-                    if os.path.exists(index_php):
-                        request_file = index_php
-                    else:
-                        response_data = generate_directory_listing(request_path)
-                        content_length = len(response_data)
-                        response_header = f'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=UTF-8\r\nContent-Length: {content_length}\r\n\r\n'
-                        response = (response_header + response_data).encode('utf-8')
-                        sock.sendall(response)
-                        continue
-
-                # Handle file requests
-                if os.path.exists(request_file):
-                    mime_type, _ = mimetypes.guess_type(request_file)
-                    if mime_type is None:
-                        mime_type = 'application/octet-stream'
-                    
-                    # Special handling for PHP files
-                    if request_file.endswith('.php'):
-                        # For this example, just serve the PHP file as text
-                        mime_type = 'text/plain'
-                    
-                    with open(request_file, 'rb') as f:
-                        response_data = f.read()
-                    
-                    content_length = len(response_data)
-                    response_header = f'HTTP/1.1 200 OK\r\nContent-Type: {mime_type}\r\nContent-Length: {content_length}\r\n\r\n'
-                    response = response_header.encode('utf-8') + response_data
-                    sock.sendall(response)
-                else:
-                    response_header = 'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n'
-                    sock.sendall(response_header.encode('utf-8'))
-
-except KeyboardInterrupt:        
-    server_socket.close()
-    sys.exit(0)
\ No newline at end of file
+                self.update(conn)
+
+    def touch(self, conn):
+        conn.last_active = time.monotonic()
+        self.connections[conn] = None
+        self.connections.move_to_end(conn)
+
+    def close_idle(self):
+        """Close connections with no traffic either way for IDLE_TIMEOUT"""
+        deadline = time.monotonic() - IDLE_TIMEOUT
+        while self.connections:
+            conn = next(iter(self.connections))
+            if conn.last_active > deadline:
+                return
+            self.close(conn)
+
+    def read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            data = b''
+        if not data:
+            self.close(conn)
+            return
+        
+        self.touch(conn)
+        conn.parser.feed(data)
+        self.process(conn)
+
+    def process(self, conn):
+        """Answer the complete requests in the read buffer, in order"""
+        while not conn.closing and len(conn.responses) < MAX_PIPELINE:
+            try:
+                request = conn.parser.next_request()
+            except ParseError as e:
+                conn.responses.append(build_response(f'{e.status} {e.reason}', [('Connection', 'close')]))
+                conn.closing = True
+                break
+            if request is None:
+                break
+            
+            if not request.keep_alive or self.draining:
+                connection_headers = [('Connection', 'close')]
+                conn.closing = True  # Close once this response is out
+            elif request.version == 'HTTP/1.0':
+                connection_headers = [('Connection', 'keep-alive')]
+            else:
+                connection_headers = []
+            response = handle_request(request, connection_headers)
+            conn.responses.append(response)
+            if not response.ready:
+                self.start_job(conn, response)
+        self.update(conn)
+
+    def update(self, conn):
+        """Register for what the connection can do next, or close it if it is finished"""
+        events = 0
+        # Stop reading while enough responses are queued, the rest waits in the socket
+        if not conn.closing and len(conn.responses) < MAX_PIPELINE:
+            events |= selectors.EVENT_READ
+        # Only ask for writability while there is something ready to write
+        if conn.responses and conn.responses[0].ready:
+            events |= selectors.EVENT_WRITE
+        if not events and not conn.responses:
+            self.close(conn)
+        elif events != conn.events:
+            # Nothing to wait for while the only responses are still being made
+            if not events:
+                self.selector.unregister(conn.sock)
+            elif not conn.events:
+                self.selector.register(conn.sock, events, conn)
+            else:
+                self.selector.modify(conn.sock, events, conn)
+            conn.events = events
+
+    def write(self, conn):
+        """Move pending responses along, at most one file chunk per event"""
+        self.touch(conn)
+        try:
+            while conn.responses and conn.responses[0].ready:
+                if not conn.responses[0].send(conn.sock):
+                    return
+                conn.responses.popleft().close()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close(conn)
+            return
+        # Pipelined requests may be waiting in the buffer
+        self.process(conn)
+
+    def close(self, conn):
+        if conn.events:
+            self.selector.unregister(conn.sock)
+        self.connections.pop(conn, None)
+        for response in conn.responses:
+            response.close()
+        conn.responses.clear()
+        conn.sock.close()
+
+def raise_file_limit():
+    """Allow as many open sockets as the hard limit permits"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+def run_worker(server_socket, compress_threads):
+    """Serve until SIGTERM, then finish the requests in progress and exit"""
+    server = Server(server_socket, compress_threads)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.drain())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is for the master
+    server.serve_forever()
+
+def spawn_worker(server_socket, options):
+    # A fresh interpreter per worker, so a reload also picks up new code
+    fd = server_socket.fileno()
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), *options,
+                             '--listen-fd', str(fd)], pass_fds=(fd,))
+
+def run_master(server_socket, port, worker_count, options):
+    """Pre-fork master: keep worker_count workers on the shared listening socket.
+
+    SIGHUP starts a new set of workers and gracefully stops the old ones, so
+    no connection is refused or cut during a reload; SIGTERM/Ctrl-C stops all.
+    """
+    reload_requested = False
+    stop_requested = False
+
+    def on_hup(signum, frame):
+        nonlocal reload_requested
+        reload_requested = True
+
+    def on_stop(signum, frame):
+        nonlocal stop_requested
+        stop_requested = True
+
+    signal.signal(signal.SIGHUP, on_hup)
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    workers = [spawn_worker(server_socket, options) for _ in range(worker_count)]
+    started = {worker.pid: time.monotonic() for worker in workers}
+    retiring = []  # old workers finishing their requests after a reload
+    print(f"Master {os.getpid()} serving 127.0.0.1:{port} with {worker_count} workers")
+
+    while not stop_requested:
+        time.sleep(0.2)
+
+        if reload_requested:
+            reload_requested = False
+            print("Reloading: starting new workers, draining the old ones")
+            retiring += workers
+            workers = [spawn_worker(server_socket, options) for _ in range(worker_count)]
+            started.update((worker.pid, time.monotonic()) for worker in workers)
+            for worker in retiring:
+                worker.send_signal(signal.SIGTERM)
+
+        retiring = [worker for worker in retiring if worker.poll() is None]
+
+        # Replace workers that died
+        for i, worker in enumerate(workers):
+            if worker.poll() is None:
+                continue
+            print(f"Worker {worker.pid} exited with {worker.returncode}, restarting")
+            if time.monotonic() - started.pop(worker.pid) < 1.0:
+                time.sleep(1.0)  # Don't spin if it dies on startup
+            workers[i] = spawn_worker(server_socket, options)
+            started[workers[i].pid] = time.monotonic()
+
+    for worker in workers + retiring:
+        if worker.poll() is None:
+            worker.send_signal(signal.SIGTERM)
+    for worker in workers + retiring:
+        worker.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Static HTTP server for the current directory")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="pre-fork this many worker processes (0: serve in this process)")
+    parser.add_argument('--cache-size', type=int, default=64, help="MB of small files kept in memory")
+    parser.add_argument('--cache-file-size', type=int, default=256, help="KB, larger files are not cached")
+    parser.add_argument('--cache-check', type=float, default=1.0,
+                        help="seconds between stat checks of a cached file (0: every request)")
+    parser.add_argument('--compress-threads', type=int, default=2,
+                        help="threads compressing responses off the event loop")
+    parser.add_argument('--listen-fd', type=int, help=argparse.SUPPRESS)  # set by the master
+    args = parser.parse_args()
+    raise_file_limit()
+
+    global static_cache
+    static_cache = StaticCache(args.cache_size * 1024 * 1024, args.cache_file_size * 1024, args.cache_check)
+
+    if args.listen_fd is not None:
+        run_worker(socket.socket(fileno=args.listen_fd), args.compress_threads)
+        return
+
+    server_address = ('127.0.0.1', args.port)
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(server_address)
+    server_socket.listen(socket.SOMAXCONN)
+
+    if args.workers > 0:
+        # Workers share this socket: a restarting or draining worker never
+        # takes queued connections down with it, as a per-worker
+        # SO_REUSEPORT socket would
+        options = ['--port', str(args.port), '--cache-size', str(args.cache_size),
+                   '--cache-file-size', str(args.cache_file_size), '--cache-check', str(args.cache_check),
+                   '--compress-threads', str(args.compress_threads)]
+        run_master(server_socket, args.port, args.workers, options)
+        server_socket.close()
+        return
+
+    try:
+        Server(server_socket, args.compress_threads).serve_forever()
+    except KeyboardInterrupt:        
+        server_socket.close()
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
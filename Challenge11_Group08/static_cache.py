@@ -0,0 +1,197 @@
+import os
+import stat
+import time
+from collections import OrderedDict
+
+from compression import SIBLINGS, MIN_SIZE, compressible
+from http_conditional import FileVersion
+
+# Small static files for server.py, kept in memory as ready-to-send responses:
+# the status line and headers are built and the body read once, so serving a
+# hot CSS/JS file is a dict lookup and a send. Compressed variants (read from
+# .br/.gz siblings or made on the fly) are kept alongside the plain body. An
+# entry is checked against a fresh stat of the file and its siblings at most
+# every `check_interval` seconds (0: on every hit) and dropped once an inode,
+# size or mtime changed. Files too big to cache whole can still have their
+# compressed representation kept, keyed by path, ETag and coding, so a new
+# version of the file is a new key. The least recently used entries go once
+# the cached bytes exceed `max_bytes`.
+
+def stat_key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def stat_keys(path):
+    """What revalidation compares: the file and each possible sibling"""
+    keys = []
+    for suffix in ('', *SIBLINGS.values()):
+        try:
+            keys.append(stat_key(os.stat(path + suffix)))
+        except OSError:
+            keys.append(None)
+    return tuple(keys)
+
+class CachedFile:
+    """One representation of a file: plain, or compressed with `coding`"""
+    def __init__(self, path, version, mime_type, body, checked, coding=None):
+        self.path = path
+        self.key = None  # stat_keys() when it was read
+        self.version = version
+        self.mime_type = mime_type
+        self.coding = coding
+        self.variants = {}  # {coding: CachedFile}, on the plain one
+        # Worth compressing on the fly (if the client accepts it and there is no sibling)
+        self.compressible = coding is None and compressible(mime_type) and len(body) >= MIN_SIZE
+
+        # Status line and the headers every 200 for this representation carries
+        lines = ['HTTP/1.1 200 OK', f'Content-Type: {mime_type}', 'Accept-Ranges: bytes',
+                 f'ETag: {version.etag}', f'Last-Modified: {version.last_modified}']
+        if coding:
+            lines.append(f'Content-Encoding: {coding}')
+        if compressible(mime_type):
+            lines.append('Vary: Accept-Encoding')
+        lines.append(f'Content-Length: {len(body)}')
+        self.headers = ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+        self.body_offset = len(self.headers) + 2
+        self.response = self.headers + b'\r\n' + body  # the whole response when no other header is needed
+        self.checked = checked
+
+    @property
+    def body(self):
+        return memoryview(self.response)[self.body_offset:]
+
+    @property
+    def size(self):
+        """Bytes held for this file, variants included"""
+        return len(self.response) + sum(len(variant.response) for variant in self.variants.values())
+
+    def render(self, extra_headers=(), head_only=False):
+        """Response bytes with extra (Connection) headers, reusing the cached ones when there are none"""
+        if not extra_headers:
+            return self.response[:self.body_offset] if head_only else self.response
+        head = self.headers + ''.join(f'{name}: {value}\r\n' for name, value in extra_headers).encode() + b'\r\n'
+        return head if head_only else head + self.response[self.body_offset:]
+
+class StaticCache:
+    def __init__(self, max_bytes, max_file_size, check_interval=1.0):
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.check_interval = check_interval
+        self.entries = OrderedDict()  # {path or (path, etag, coding): CachedFile}, least recently used first
+        self.bytes = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0  # entries dropped because the file changed
+        self.evictions = 0
+
+    def get(self, path):
+        """The CachedFile for path if it is cached and still current, else None"""
+        entry = self.entries.get(path)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        if now - entry.checked >= self.check_interval:
+            if stat_keys(path) != entry.key:
+                self.remove(path)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            entry.checked = now
+
+        self.entries.move_to_end(path)
+        self.hits += 1
+        return entry
+
+    def add(self, path, file, mime_type):
+        """Cache a just-opened file (and its siblings) if small enough; the CachedFile, or None"""
+        st = os.fstat(file.fileno())
+        if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_file_size:
+            return None
+        body = file.read(st.st_size)
+        if len(body) != st.st_size:
+            return None  # Changing under us, try again next time
+
+        version = FileVersion(st)
+        entry = CachedFile(path, version, mime_type, body, time.monotonic())
+        keys = [stat_key(st)]
+        for coding, suffix in SIBLINGS.items():
+            keys.append(None)
+            try:
+                with open(path + suffix, 'rb') as sibling:
+                    sibling_st = os.fstat(sibling.fileno())
+                    if not stat.S_ISREG(sibling_st.st_mode) or sibling_st.st_size > self.max_file_size:
+                        continue
+                    data = sibling.read()
+            except OSError:
+                continue
+            keys[-1] = stat_key(sibling_st)
+            # The sibling's inode and mtime go into its ETag, so a recompressed file gets a new one
+            sibling_version = FileVersion(sibling_st).encoded(coding, len(data))
+            sibling_version.last_modified = version.last_modified
+            sibling_version.mtime = version.mtime
+            entry.variants[coding] = CachedFile(path, sibling_version, mime_type, data, entry.checked, coding)
+        entry.key = tuple(keys)
+
+        self.remove(path)
+        self.entries[path] = entry
+        self.bytes += entry.size
+        self.evict()
+        return entry
+
+    def add_variant(self, entry, coding, data):
+        """Keep a body compressed on the fly next to the plain one; the variant's CachedFile"""
+        version = entry.version.encoded(coding, len(data))
+        variant = CachedFile(entry.path, version, entry.mime_type, data, entry.checked, coding)
+        # The file may have changed or been evicted while it was being compressed
+        if self.entries.get(entry.path) is entry and coding not in entry.variants:
+            entry.variants[coding] = variant
+            self.bytes += len(variant.response)
+            self.evict()
+        return variant
+
+    def get_encoded(self, path, etag, coding):
+        """The CachedFile for a big file compressed on the fly, or None"""
+        key = (path, etag, coding)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)  # get(path) already counted the lookup
+        return entry
+
+    def add_encoded(self, path, etag, entry):
+        """Keep the compressed representation of a file too big to cache whole,
+        unless it would take over a quarter of the cache"""
+        if entry.size > self.max_bytes // 4:
+            return
+        key = (path, etag, entry.coding)
+        self.remove(key)
+        self.entries[key] = entry
+        self.bytes += entry.size
+        self.evict()
+
+    def evict(self):
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups if lookups else 0.0
+        variants = sum(len(entry.variants) for entry in self.entries.values())
+        return (f"static_cache_hits {self.hits}\n"
+                f"static_cache_misses {self.misses}\n"
+                f"static_cache_hit_ratio {ratio:.4f}\n"
+                f"static_cache_invalidations {self.invalidations}\n"
+                f"static_cache_evictions {self.evictions}\n"
+                f"static_cache_entries {len(self.entries)}\n"
+                f"static_cache_compressed_variants {variants}\n"
+                f"static_cache_bytes {self.bytes}\n"
+                f"static_cache_max_bytes {self.max_bytes}\n")
@@ -4,19 +4,98 @@ import sys
 import time
 import os
 
+# codec.py, the message framing, is shared with the server one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codec
+
+MAX_BATCH = 64 * 1024  # bytes of messages sent together at most
+FLUSH_DELAY = 0.002  # seconds a message may wait for others to share its send
+
+class BatchWriter:
+    """Coalesces small messages into one send, as Nagle's algorithm would but
+    with a known bound: the buffer goes out once it holds max_batch bytes or its
+    oldest message is flush_delay seconds old (max_batch 0: every message at once)"""
+    def __init__(self, sock, max_batch=MAX_BATCH, flush_delay=FLUSH_DELAY):
+        self.sock = sock
+        self.max_batch = max_batch
+        self.flush_delay = flush_delay
+        self.buffer = bytearray()
+        self.deadline = None  # when the oldest buffered message must go
+        self.error = None  # a failed background send, raised by the next write
+        self.closed = False
+        self.condition = threading.Condition(threading.Lock())
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        with self.condition:
+            if self.error:
+                raise self.error
+            if not self.buffer:
+                self.deadline = time.monotonic() + self.flush_delay
+                self.condition.notify()
+            self.buffer += frame
+            if len(self.buffer) >= self.max_batch:
+                self.send_buffer()
+
+    def flush(self):
+        """Send what is buffered now"""
+        with self.condition:
+            if self.error:
+                raise self.error
+            self.send_buffer()
+
+    def close(self):
+        with self.condition:
+            if not self.error:
+                self.send_buffer()
+            self.closed = True
+            self.condition.notify()
+
+    def send_buffer(self):
+        # With the condition held, so batches go out in order
+        if self.buffer:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            self.sock.sendall(data)
+
+    def run(self):
+        """Flusher thread: sends the buffer when its deadline passes"""
+        with self.condition:
+            while not self.closed and not self.error:
+                if not self.buffer:
+                    self.condition.wait()
+                    continue
+                delay = self.deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                try:
+                    self.send_buffer()
+                except OSError as e:
+                    self.error = e
+
 class SocketClient:
-    def __init__(self, host='localhost', port=5008):
+    def __init__(self, host='localhost', port=5008, max_batch=MAX_BATCH, flush_delay=FLUSH_DELAY):
         self.host = host
         self.port = port
         self.socket = None
         self.running = False
         self.receive_thread = None
+        self.max_batch = max_batch
+        self.flush_delay = flush_delay
+        self.writer = None
+        self.decoder = codec.Decoder()
 
     def connect(self):
         """Connect to the server"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            # Batching is done here, with a deadline: Nagle's algorithm on top
+            # would hold a batch back until the previous one is acknowledged
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.writer = BatchWriter(self.socket, self.max_batch, self.flush_delay)
             print(f"Connected to server at {self.host}:{self.port}")
             return True
         except Exception as e:
@@ -27,15 +106,16 @@ class SocketClient:
         """Thread function to continuously receive messages"""
         while self.running:
             try:
-                data = self.socket.recv(1024)
+                data = self.socket.recv(65536)
                 if not data:
                     print("Connection to server lost")
                     self.running = False
                     break
                 
-                # Handle received data
-                print(f"\nReceived: {data.decode('utf-8', errors='ignore')}")
-                print("Enter message (or 'exit' to quit): ", end="", flush=True)
+                # Handle received messages
+                for message in self.decoder.feed(data):
+                    print(f"\nReceived: {message.decode('utf-8', errors='ignore')}")
+                    print("Enter message (or 'exit' to quit): ", end="", flush=True)
                 
             except Exception as e:
                 print(f"\nError receiving data: {e}")
@@ -43,9 +123,9 @@ class SocketClient:
                 break
 
     def send_message(self, message):
-        """Send a message to the server"""
+        """Send a message to the server, within flush_delay"""
         try:
-            self.socket.send(message.encode('utf-8'))
+            self.writer.write(codec.encode(message.encode('utf-8')))
             return True
         except Exception as e:
             print(f"Error sending message: {e}")
@@ -82,6 +162,11 @@ class SocketClient:
             print("\nClient interrupted.")
         finally:
             self.running = False
+            if self.writer:
+                try:
+                    self.writer.close()
+                except OSError:
+                    pass
             if self.socket:
                 self.socket.close()
             print("Client disconnected")
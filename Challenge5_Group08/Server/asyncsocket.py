@@ -0,0 +1,149 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+
+try:
+    import uvloop
+except ImportError:  # Optional: the standard event loop does the same, a bit slower
+    uvloop = None
+
+# codec.py, the message framing, is shared with the client one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codec
+
+# Event loop version of threadsocket.py with the same Server API (run,
+# broadcast, remove_client, Enter to stop). Every connection is a Protocol on
+# one asyncio loop instead of an OS thread, so an idle client costs a few KB
+# rather than a thread and its stack, and there is no accept polling.
+
+class Server:
+    def __init__(self, host='localhost', port=5008):
+        self.host = host
+        self.port = port
+        self.backlog = socket.SOMAXCONN
+        self.size = 1024
+        self.server = None
+        self.loop = None
+        self.clients = {}  # Dictionary to track connected clients, by client_id
+        self.running = True  # Flag to control server operation
+        self.stopped = None  # asyncio.Event set to shut down
+
+    def handle_user_input(self):
+        """Thread function to handle user input for server shutdown"""
+        print("Server running. Press Enter to stop.")
+        try:
+            while input() != "":  # Wait for Enter key
+                pass
+        except EOFError:
+            return  # No console (e.g. started from a script): run until interrupted
+        print("Server shutdown initiated...")
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        try:
+            self.server = await self.loop.create_server(lambda: Client(self), self.host, self.port,
+                                                        family=socket.AF_INET, backlog=self.backlog,
+                                                        reuse_address=True)
+        except OSError as e:
+            print(f"Error opening socket: {e}")
+            sys.exit(1)
+        print(f"Server started on {self.host}:{self.port} ({'uvloop' if uvloop else 'asyncio'} event loop)")
+
+        # Start a separate thread for handling user input
+        input_thread = threading.Thread(target=self.handle_user_input)
+        input_thread.daemon = True
+        input_thread.start()
+
+        await self.stopped.wait()
+        self.running = False
+        self.server.close()
+        for client in list(self.clients.values()):
+            client.transport.close()
+        await self.server.wait_closed()
+        print("Server shutdown complete")
+
+    def run(self):
+        loop_factory = uvloop.new_event_loop if uvloop else None
+        try:
+            with asyncio.Runner(loop_factory=loop_factory) as runner:
+                runner.run(self.serve())
+        except KeyboardInterrupt:
+            print("Server interrupted. Shutting down...")
+
+    def broadcast(self, message, sender=None):
+        """Broadcast a message to all connected clients except the sender"""
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if not in_loop:
+            # Called from another thread: the loop owns the transports
+            self.loop.call_soon_threadsafe(self.broadcast, message, sender)
+            return
+        message = codec.encode(message)
+        for client in self.clients.values():
+            if client is not sender and client.running:
+                client.send(message)
+
+    def remove_client(self, client):
+        """Remove a client from the connected clients"""
+        self.clients.pop(client.client_id, None)
+
+class Client(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.address = None
+        self.client_id = None
+        self.running = False
+        self.decoder = codec.Decoder()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+        self.client_id = f"{self.address[0]}:{self.address[1]}"
+        self.running = True
+        self.server.clients[self.client_id] = self
+        print(f"New connection from {self.address}")
+
+    def data_received(self, data):
+        try:
+            messages = self.decoder.feed(data)
+        except codec.FrameError as e:
+            print(f"Error handling client {self.address}: {e}")
+            self.transport.close()
+            return
+        if not messages:
+            return  # Only part of a message so far
+
+        # Process received data
+        print(f'Received from {self.address}: {codec.preview(messages)}')
+
+        # Echo the messages back, all in one write
+        self.send(codec.encode_many(messages))
+
+    def send(self, message):
+        self.transport.write(message)
+
+    def pause_writing(self):
+        # The client is not reading its echoes: stop reading from it too,
+        # as the blocking send() does in the threaded server
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            print(f"Error handling client {self.address}: {exc}")
+        print(f"Client {self.address} disconnected")
+        self.running = False
+        self.server.remove_client(self)
+
+if __name__ == "__main__":
+    s = Server()
+    s.run()
@@ -0,0 +1,217 @@
+import os
+import queue
+import selectors
+import socket
+import threading
+from collections import deque
+
+from threadsocket import MSG_DONTWAIT, Outbox, Server
+import codec
+
+# Thread pool version of threadsocket.py with the same Server API: a fixed
+# number of worker threads serve every client, instead of a thread each. The
+# main thread is the reactor: it accepts connections and selects over the idle
+# ones, and hands each socket with data waiting to the pool, which reads it,
+# echoes and hands it back. Threads and memory stay bounded under a flood:
+#  - past max_clients connections, new ones are told the server is busy and closed
+#  - while max_pending sockets wait for a worker, accepting stops, so new
+#    connections wait in the listen backlog (and past that are refused)
+
+BUSY_MESSAGE = codec.encode(b"Server busy, try again later")
+ACCEPT_BURST = 64  # connections accepted per turn of the reactor, so a flood doesn't starve the clients
+
+class PoolServer(Server):
+    def __init__(self, host='localhost', port=5008, workers=None, max_clients=10000, max_pending=None,
+                 queue_size=256, slow_policy='drop-oldest', backlog=socket.SOMAXCONN):
+        super().__init__(host, port, queue_size, slow_policy, backlog)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_clients = max_clients
+        self.max_pending = max_pending or 64 * self.workers  # sockets waiting for a worker
+        self.selector = selectors.DefaultSelector()
+        self.ready = queue.Queue()  # clients with data waiting, for the workers
+        self.idle = deque()  # clients handed back by the workers, for the reactor to watch again
+        self.woken = False
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.accepting = False
+        self.rejected = 0  # connections turned away at max_clients
+
+    def run(self):
+        self.open_socket()
+        self.server.setblocking(False)
+        self.sender.start()
+        workers = [threading.Thread(target=self.work, daemon=True) for _ in range(self.workers)]
+        for worker in workers:
+            worker.start()
+        print(f"{self.workers} workers, up to {self.max_clients} clients")
+
+        # Start a separate thread for handling user input
+        input_thread = threading.Thread(target=self.handle_user_input)
+        input_thread.daemon = True
+        input_thread.start()
+
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+        self.set_accepting(True)
+        try:
+            # Main server loop; the timeout checks the running flag periodically
+            while self.running:
+                for key, _ in self.selector.select(timeout=1.0):
+                    if key.fileobj is self.server:
+                        self.accept()
+                    elif key.data is None:
+                        self.woken = False
+                        try:
+                            while self.wakeup_recv.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    else:
+                        # A worker owns the socket until it hands it back
+                        self.selector.unregister(key.fileobj)
+                        self.ready.put(key.data)
+                while self.idle:
+                    client = self.idle.popleft()
+                    self.selector.register(client.client, selectors.EVENT_READ, client)
+                # Admission control: leave new connections in the backlog while the pool is behind
+                self.set_accepting(self.ready.qsize() < self.max_pending)
+
+        except KeyboardInterrupt:
+            print("Server interrupted. Shutting down...")
+        finally:
+            self.running = False
+            self.set_accepting(False)
+            self.server.close()
+
+            # Stop the workers, then every connection
+            for _ in workers:
+                self.ready.put(None)
+            for worker in workers:
+                worker.join(1)
+            with self.clients_lock:
+                clients = list(self.clients.values())
+            for client in clients:
+                client.outbox.release()
+
+            print(f"Server shutdown complete ({self.rejected} connections turned away)")
+
+    def set_accepting(self, accepting):
+        if accepting != self.accepting:
+            if accepting:
+                self.selector.register(self.server, selectors.EVENT_READ, None)
+            else:
+                self.selector.unregister(self.server)
+            self.accepting = accepting
+
+    def accept(self):
+        for _ in range(ACCEPT_BURST):
+            try:
+                client_socket, client_address = self.server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"Socket error: {e}")
+                return
+            if len(self.clients) >= self.max_clients:
+                self.rejected += 1
+                try:
+                    client_socket.send(BUSY_MESSAGE, MSG_DONTWAIT)
+                except OSError:
+                    pass
+                client_socket.close()
+                continue
+
+            print(f"New connection from {client_address}")
+            client_socket.setblocking(False)
+            client = PooledClient(client_socket, client_address, self)
+            with self.clients_lock:
+                self.clients[client.client_id] = client
+            self.selector.register(client_socket, selectors.EVENT_READ, client)
+
+    def work(self):
+        """Worker thread: serve clients with data waiting until handed None"""
+        while True:
+            client = self.ready.get()
+            if client is None:
+                return
+            client.handle()
+
+    def hand_back(self, client):
+        """Have the reactor watch a client's socket again (from any thread)"""
+        self.idle.append(client)
+        # One wakeup byte however many clients come back before the reactor runs
+        if not self.woken:
+            self.woken = True
+            try:
+                self.wakeup_send.send(b'\0')
+            except BlockingIOError:
+                pass
+
+    def broadcast(self, message, sender=None):
+        """Broadcast a message to all connected clients except the sender"""
+        message = codec.encode(message)  # One immutable frame, shared by every queue
+        # Only copy the list under the lock: queueing can block with the 'block' policy
+        with self.clients_lock:
+            recipients = [client for client in self.clients.values() if client != sender and client.running]
+        for client in recipients:
+            client.outbox.put(message)
+
+    def remove_client(self, client):
+        """Remove a client from the connected clients"""
+        with self.clients_lock:
+            self.clients.pop(client.client_id, None)
+
+class PooledClient:
+    """A connection served by whichever worker picks it up; owned by one thread at a time"""
+    def __init__(self, client, address, server):
+        self.client = client
+        self.address = address
+        self.size = 65536  # a recv takes whatever has arrived, however many messages that is
+        self.running = True
+        self.server = server
+        self.client_id = f"{address[0]}:{address[1]}"
+        self.outbox = Outbox(client, server.sender, server.queue_size, server.slow_policy)
+        self.decoder = codec.Decoder()
+
+    def handle(self):
+        """Serve the data waiting on the socket, then hand the socket back to the reactor"""
+        try:
+            data = self.client.recv(self.size)
+            messages = self.decoder.feed(data)
+        except (BlockingIOError, InterruptedError):
+            self.server.hand_back(self)
+            return
+        except (OSError, codec.FrameError) as e:
+            print(f"Error handling client {self.address}: {e}")
+            data = b''
+        if not data:
+            # Client disconnected
+            self.disconnect()
+            return
+        if not messages:
+            self.server.hand_back(self)  # Only part of a message so far
+            return
+
+        # Process received data
+        print(f'Received from {self.address}: {codec.preview(messages)}')
+
+        # Echo the messages back, all in one send. Never wait for a client that
+        # doesn't read its echoes, that would hold up a worker: stop reading
+        # from it instead, until the Sender has caught up
+        self.outbox.put(codec.encode_many(messages), policy='queue')
+        if not self.outbox.when_drained(self.resume):
+            self.server.hand_back(self)
+
+    def resume(self):
+        self.server.hand_back(self)
+
+    def disconnect(self):
+        if self.outbox.disconnected:
+            print(f"Client {self.address} disconnected: too slow to read its messages")
+        elif self.outbox.dropped:
+            print(f"Client {self.address} disconnected ({self.outbox.dropped} messages dropped)")
+        else:
+            print(f"Client {self.address} disconnected")
+        self.running = False
+        self.server.remove_client(self)
+        self.outbox.release()  # the Sender closes the socket
@@ -1,14 +1,28 @@
+import argparse
 import select
+import selectors
 import socket
 import sys
 import threading
 import os
+from collections import deque
+
+# codec.py, the message framing, is shared with the client one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codec
+
+SLOW_POLICIES = ('drop-oldest', 'disconnect', 'block')  # 'queue' (no limit) is for the server's own echoes
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)  # Without it (Windows) a full socket stalls the Sender
 
 class Server:
-    def __init__(self):
-        self.host = 'localhost'
-        self.port = 5008
-        self.backlog = 5
+    def __init__(self, host='localhost', port=5008, queue_size=256, slow_policy='drop-oldest',
+                 backlog=socket.SOMAXCONN):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size  # messages waiting to be sent to one client
+        self.slow_policy = slow_policy  # what broadcast does when a client's queue is full
+        self.sender = Sender()  # writes every client's outbox
+        self.backlog = backlog  # connection bursts queue here while accept() catches up
         self.size = 1024
         self.server = None
         self.threads = []
@@ -21,7 +35,7 @@ class Server:
             self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server.bind((self.host, self.port))
-            self.server.listen(5)
+            self.server.listen(self.backlog)
             print(f"Server started on {self.host}:{self.port}")
         except Exception as e:
             print(f"Error opening socket: {e}")
@@ -45,6 +59,7 @@ class Server:
 
     def run(self):
         self.open_socket()
+        self.sender.start()
         
         # Start a separate thread for handling user input
         input_thread = threading.Thread(target=self.handle_user_input)
@@ -96,13 +111,12 @@ class Server:
 
     def broadcast(self, message, sender=None):
         """Broadcast a message to all connected clients except the sender"""
+        message = codec.encode(message)  # One immutable frame, shared by every queue
+        # Only copy the list under the lock: queueing can block with the 'block' policy
         with self.clients_lock:
-            for client in self.threads:
-                if client != sender and client.running:
-                    try:
-                        client.client.send(message)
-                    except:
-                        pass  # Handle failed send silently
+            recipients = [client for client in self.threads if client != sender and client.running]
+        for client in recipients:
+            client.outbox.put(message)
 
     def remove_client(self, client):
         """Remove a client from the active threads list"""
@@ -115,10 +129,12 @@ class Client(threading.Thread):
         threading.Thread.__init__(self)
         self.client = client
         self.address = address
-        self.size = 1024
+        self.size = 65536  # a recv takes whatever has arrived, however many messages that is
         self.running = True
         self.server = server
         self.client_id = f"{address[0]}:{address[1]}"
+        self.outbox = Outbox(client, server.sender, server.queue_size, server.slow_policy)
+        self.decoder = codec.Decoder()
 
     def run(self):
         try:
@@ -127,22 +143,232 @@ class Client(threading.Thread):
                 if not data:
                     # Client disconnected
                     break
+                messages = self.decoder.feed(data)
+                if not messages:
+                    continue  # Only part of a message so far
                 
                 # Process received data
-                print(f'Received from {self.address}: {data.decode("utf-8", errors="ignore")}')
+                print(f'Received from {self.address}: {codec.preview(messages)}')
                 
-                # Echo the data back (you can modify this to handle different commands)
-                self.client.send(data)
+                # Echo the messages back (you can modify this to handle different commands),
+                # all in one send. A client that doesn't read its echoes only holds up its own reads
+                if not self.outbox.put(codec.encode_many(messages), policy='block'):
+                    break
                 
         except Exception as e:
             print(f"Error handling client {self.address}: {e}")
         finally:
             # Clean up when client disconnects
-            print(f"Client {self.address} disconnected")
-            self.client.close()
+            if self.outbox.disconnected:
+                print(f"Client {self.address} disconnected: too slow to read its messages")
+            elif self.outbox.dropped:
+                print(f"Client {self.address} disconnected ({self.outbox.dropped} messages dropped)")
+            else:
+                print(f"Client {self.address} disconnected")
+            self.outbox.release()  # the Sender closes the socket
             self.running = False
             self.server.remove_client(self)
 
+class Outbox:
+    """Bounded queue of messages for one client, written out by the server's Sender"""
+    def __init__(self, sock, sender, queue_size, policy):
+        self.sock = sock
+        self.sender = sender
+        self.queue_size = queue_size
+        self.policy = policy
+        self.queue = deque()  # messages to send, oldest first; the head may be partly sent
+        self.sent = 0         # bytes of the head already sent
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.registered = False  # waiting for the socket to be writable (Sender thread only)
+        self.closed = False
+        self.released = False  # the reader is done with the socket: the Sender may close it
+        self.drained = None  # called once the queue is below queue_size again (see when_drained)
+        self.disconnected = False  # closed by the 'disconnect' policy
+        self.dropped = 0
+
+    def put(self, message, policy=None):
+        """Queue a message, applying the slow-consumer policy if the queue is full.
+        False if the client is (or just got) disconnected."""
+        policy = policy or self.policy
+        with self.lock:
+            if self.closed:
+                return False
+            if len(self.queue) >= self.queue_size:
+                if policy == 'drop-oldest':
+                    # The head may be partly on the wire already, so the oldest one after it goes
+                    self.dropped += 1
+                    if len(self.queue) < 2:
+                        return True
+                    del self.queue[1]
+                elif policy == 'block':
+                    while len(self.queue) >= self.queue_size and not self.closed:
+                        self.not_full.wait()
+                    if self.closed:
+                        return False
+                elif policy != 'queue':
+                    self.disconnected = True
+            if not self.disconnected:
+                self.queue.append(message)
+                first = len(self.queue) == 1
+        if self.disconnected:
+            self.close()
+            return False
+        if first:
+            self.sender.wake(self)
+        return True
+
+    def flush(self):
+        """Send what the socket takes without blocking; True if some is left for later"""
+        while True:
+            with self.lock:
+                if self.closed or not self.queue:
+                    return False
+                message = self.queue[0]
+                offset = self.sent
+            try:
+                sent = self.sock.send(memoryview(message)[offset:], MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                self.close()
+                return False
+            with self.lock:
+                if self.closed:
+                    return False
+                self.sent += sent
+                drained = None
+                if self.sent == len(message):
+                    self.queue.popleft()
+                    self.sent = 0
+                    self.not_full.notify()
+                    drained = self.take_drained()
+            if drained is not None:
+                drained()
+
+    def take_drained(self):
+        # With the lock held: the drained callback if it is due, once
+        drained = None
+        if self.drained is not None and (self.closed or len(self.queue) < self.queue_size):
+            drained, self.drained = self.drained, None
+        return drained
+
+    def when_drained(self, callback):
+        """Call callback (from the Sender) once the queue is below queue_size, or the
+        client is gone. False, without calling it, if that is already the case."""
+        with self.lock:
+            if self.closed or len(self.queue) < self.queue_size:
+                return False
+            self.drained = callback
+            return True
+
+    def close(self):
+        """Stop sending and cut the connection, which also ends the client's reader"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.clear()
+            self.not_full.notify_all()
+            drained = self.take_drained()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if drained is not None:
+            drained()  # so whoever waits on it sees the connection end
+        self.sender.wake(self)
+
+    def release(self):
+        """Close, from the reader that is done with the socket. The Sender closes
+        the socket once it has let go of it too."""
+        self.close()
+        self.released = True
+        self.sender.wake(self)
+
+class Sender(threading.Thread):
+    """Writes every client's Outbox: non-blocking sends, and a selector for the
+    sockets whose buffers are full, so no broadcast ever waits on a socket"""
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.ready = deque()  # Outboxes with new messages (or just closed)
+        self.woken = False
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+
+    def wake(self, outbox):
+        self.ready.append(outbox)
+        # One wakeup byte however many clients a broadcast reaches
+        if not self.woken:
+            self.woken = True
+            try:
+                self.wakeup_send.send(b'\0')
+            except BlockingIOError:
+                pass
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    self.woken = False
+                    try:
+                        while self.wakeup_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.ready.append(key.data)
+            while self.ready:
+                outbox = self.ready.popleft()
+                self.update(outbox, outbox.flush())
+
+    def update(self, outbox, pending):
+        if outbox.closed:
+            if outbox.registered:
+                self.selector.unregister(outbox.sock)
+                outbox.registered = False
+            if outbox.released:
+                outbox.sock.close()
+        elif pending and not outbox.registered:
+            self.selector.register(outbox.sock, selectors.EVENT_WRITE, outbox)
+            outbox.registered = True
+        elif not pending and outbox.registered:
+            self.selector.unregister(outbox.sock)
+            outbox.registered = False
+
 if __name__ == "__main__":
-    s = Server()
+    parser = argparse.ArgumentParser(description="Echo server")
+    parser.add_argument('--mode', choices=('thread', 'asyncio', 'pool'), default='thread',
+                        help="a thread per client, every client on one asyncio event loop, "
+                             "or a fixed pool of worker threads behind a selector")
+    parser.add_argument('--port', type=int, default=5008)
+    parser.add_argument('--queue-size', type=int, default=256,
+                        help="messages queued per client before the slow-consumer policy applies (thread and pool modes)")
+    parser.add_argument('--slow-policy', choices=SLOW_POLICIES, default='drop-oldest',
+                        help="when a client's queue is full: drop its oldest message, disconnect it, "
+                             "or make broadcast wait (thread and pool modes)")
+    parser.add_argument('--backlog', type=int, default=socket.SOMAXCONN,
+                        help="connections the kernel queues before accept() (thread and pool modes)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="worker threads (pool mode)")
+    parser.add_argument('--max-clients', type=int, default=10000,
+                        help="connections served at once; later ones are told the server is busy (pool mode)")
+    parser.add_argument('--max-pending', type=int,
+                        help="sockets waiting for a worker before accepting pauses (pool mode, default 64 per worker)")
+    args = parser.parse_args()
+
+    if args.mode == 'asyncio':
+        import asyncsocket
+        s = asyncsocket.Server(port=args.port)
+    elif args.mode == 'pool':
+        import poolsocket
+        s = poolsocket.PoolServer(port=args.port, workers=args.workers, max_clients=args.max_clients,
+                                  max_pending=args.max_pending, queue_size=args.queue_size,
+                                  slow_policy=args.slow_policy, backlog=args.backlog)
+    else:
+        s = Server(port=args.port, queue_size=args.queue_size, slow_policy=args.slow_policy,
+                   backlog=args.backlog)
     s.run()
\ No newline at end of file
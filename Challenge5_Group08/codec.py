@@ -0,0 +1,69 @@
+import struct
+
+# Message framing shared by the Challenge5 client and servers. On the wire
+# every message is a 4-byte big-endian length followed by that many bytes, so
+# a message arrives whole however TCP splits or joins the stream; a length
+# over max_size is an error instead of an allocation.
+
+HEADER = struct.Struct('!I')
+MAX_MESSAGE = 1024 * 1024
+
+class FrameError(ValueError):
+    """A length prefix over the decoder's max_size"""
+
+def encode(message, max_size=MAX_MESSAGE):
+    if len(message) > max_size:
+        raise FrameError(f"message of {len(message)} bytes is over the {max_size} byte limit")
+    return HEADER.pack(len(message)) + message
+
+def encode_many(messages, max_size=MAX_MESSAGE):
+    """Frames for several messages, as one buffer for a single send"""
+    return b''.join([encode(message, max_size) for message in messages])
+
+class Decoder:
+    """Incremental decoder: feed it whatever recv() returned, get the complete messages"""
+    def __init__(self, max_size=MAX_MESSAGE):
+        self.max_size = max_size
+        self.buffer = bytearray()  # the start of a message still incomplete
+        self.needed = HEADER.size  # bytes buffer must hold before a message can complete
+
+    def feed(self, data):
+        """The messages completed by data (bytes), oldest first (raises FrameError)"""
+        if self.buffer:
+            self.buffer += data
+            if len(self.buffer) < self.needed:
+                return []  # A large message arriving in pieces: collect without reparsing
+            data = bytes(self.buffer)
+        # Messages are sliced straight out of data: one copy each
+        messages = []
+        append = messages.append
+        unpack = HEADER.unpack_from
+        header = HEADER.size
+        max_size = self.max_size
+        offset = 0
+        end = len(data)
+        self.needed = HEADER.size
+        while end - offset >= header:
+            (length,) = unpack(data, offset)
+            if length > max_size:
+                raise FrameError(f"message of {length} bytes is over the {max_size} byte limit")
+            start = offset + header
+            stop = start + length
+            if stop > end:
+                self.needed = header + length
+                break
+            append(data[start:stop])
+            offset = stop
+        self.buffer = bytearray(data[offset:])
+        return messages
+
+    @property
+    def pending(self):
+        """Bytes of an incomplete message held back"""
+        return len(self.buffer)
+
+def preview(messages):
+    """How a batch of received messages shows in the logs"""
+    if len(messages) == 1:
+        return messages[0].decode("utf-8", errors="ignore")
+    return f"{len(messages)} messages"
@@ -0,0 +1,98 @@
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+import codec
+from loadgen import start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Client'))
+from client import BatchWriter, FLUSH_DELAY
+
+# Throughput of the echo path: each connection pushes small framed messages
+# through a BatchWriter while a reader decodes the echoes, counts them and
+# checks they come back whole and in order. Per server mode and batch size
+# (0: a send per message, as the client did before batching):
+#   python echo_bench.py --modes thread asyncio pool --batches 0 65536 --messages 1000000
+
+def connection(port, messages, size, max_batch, results, index):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    padding = b'p' * (size - 8)
+    state = {'received': 0, 'in_order': True}
+
+    def read():
+        decoder = codec.Decoder()
+        expected = 0
+        try:
+            while expected < messages:
+                data = sock.recv(1 << 20)
+                if not data:
+                    break
+                for message in decoder.feed(data):
+                    if int.from_bytes(message[:8], 'big') != expected or len(message) != size:
+                        state['in_order'] = False
+                    expected += 1
+        except OSError:
+            pass
+        state['received'] = expected
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    writer = BatchWriter(sock, max_batch, FLUSH_DELAY)
+    encode = codec.encode
+    for i in range(messages):
+        writer.write(encode(i.to_bytes(8, 'big') + padding))
+    writer.close()
+    reader.join()
+    sock.close()
+    results[index] = state
+
+def run(mode, port, connections, messages, size, max_batch):
+    server = start_server(mode, port)
+    try:
+        per_connection = messages // connections
+        results = [None] * connections
+        threads = [threading.Thread(target=connection, args=(port, per_connection, size, max_batch, results, i))
+                   for i in range(connections)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        server.communicate(b'\n', timeout=60)
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
+
+    sent = per_connection * connections
+    received = sum(result['received'] for result in results)
+    in_order = all(result['in_order'] for result in results)
+    wire = received * (size + codec.HEADER.size)
+    print(f"{mode:8} batch {max_batch:>6}: {received / elapsed:>10,.0f} messages/s echoed "
+          f"({wire / elapsed / 1e6:.1f} MB/s each way), {received}/{sent} back, in order: {in_order}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Echo throughput of small framed messages")
+    parser.add_argument('--modes', nargs='+', choices=('thread', 'asyncio', 'pool'),
+                        default=['thread', 'asyncio', 'pool'])
+    parser.add_argument('--batches', nargs='+', type=int, default=[0, 65536],
+                        help="BatchWriter max_batch values to compare (0: no batching)")
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=200000, help="in total, over all connections")
+    parser.add_argument('--size', type=int, default=16, help="message bytes, at least 8 (the sequence number)")
+    parser.add_argument('--port', type=int, default=5208)
+    args = parser.parse_args()
+
+    port = args.port
+    for mode in args.modes:
+        for max_batch in args.batches:
+            run(mode, port, args.connections, args.messages, max(args.size, 8), max_batch)
+            port += 1  # no waiting for the previous server's port
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import codec
+
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+# Load generator for the echo server: opens many idle connections, then
+# measures the server's memory, threads and idle CPU, and the echo round trip
+# of a few active clients next to them, for each server mode:
+#   python loadgen.py --modes thread asyncio pool --connections 50000
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Server', 'threadsocket.py')
+PORTS_PER_SOURCE = 25000  # stay inside the ephemeral port range per source address
+# Linux: pick the local port at connect() time, so ports in TIME_WAIT from
+# earlier connections to another server port can be reused
+IP_BIND_ADDRESS_NO_PORT = getattr(socket, 'IP_BIND_ADDRESS_NO_PORT', 24 if sys.platform == 'linux' else None)
+
+def start_server(mode, port, *options):
+    server = subprocess.Popen([sys.executable, SERVER, '--mode', mode, '--port', str(port), *options],
+                              stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+def proc_status(pid):
+    """VmRSS in MB and thread count of a process, from /proc (Linux only)"""
+    status = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                status[name] = value.strip()
+    except OSError:
+        return None, None
+    return int(status['VmRSS'].split()[0]) / 1024, int(status['Threads'])
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process, from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def open_connections(port, count):
+    """Up to count connections, spread over 127.0.0.x source addresses"""
+    sockets = []
+    for i in range(count):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if IP_BIND_ADDRESS_NO_PORT is not None:
+                sock.setsockopt(socket.IPPROTO_IP, IP_BIND_ADDRESS_NO_PORT, 1)
+            sock.bind((f'127.0.0.{1 + i // PORTS_PER_SOURCE}', 0))
+            sock.connect(('127.0.0.1', port))
+        except OSError as e:
+            sock.close()
+            print(f"  stopped at {len(sockets)} connections: {e}")
+            break
+        sockets.append(sock)
+    return sockets
+
+def close_now(sock):
+    # Reset instead of FIN: no TIME_WAIT left holding the port for a minute
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    sock.close()
+
+def echo_latencies(port, clients, messages, size=64):
+    """Round trips of size-byte messages, clients taking turns"""
+    socks = [socket.create_connection(('127.0.0.1', port)) for _ in range(clients)]
+    for sock in socks:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    payload = codec.encode(b'p' * (size - codec.HEADER.size))  # a size-byte frame
+    latencies = []
+    for i in range(messages):
+        sock = socks[i % clients]
+        start = time.perf_counter()
+        sock.sendall(payload)
+        received = 0
+        while received < size:
+            chunk = sock.recv(size - received)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            received += len(chunk)
+        latencies.append(time.perf_counter() - start)
+    for sock in socks:
+        close_now(sock)
+    return latencies
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def run(mode, port, connections, idle, clients, messages):
+    print(f"{mode}:")
+    # Room for every connection in pool mode, rather than its default admission limit
+    options = ('--max-clients', str(connections + clients + 10)) if mode == 'pool' else ()
+    server = start_server(mode, port, *options)
+    try:
+        start = time.perf_counter()
+        sockets = open_connections(port, connections)
+        if not sockets:
+            print("  no connection could be opened, skipping")
+            return
+        # Connections are accepted in order: once the last one echoes, all are being served
+        sockets[-1].sendall(codec.encode(b'x'))
+        sockets[-1].recv(codec.HEADER.size + 1, socket.MSG_WAITALL)
+        setup = time.perf_counter() - start
+        rss, threads = proc_status(server.pid)
+
+        cpu_start = cpu_seconds(server.pid)
+        time.sleep(idle)
+        cpu_end = cpu_seconds(server.pid)
+        latencies = echo_latencies(port, clients, messages)
+        alive = server.poll() is None
+
+        for sock in sockets:
+            close_now(sock)
+        # Enter on the server's console shuts it down
+        start = time.perf_counter()
+        server.communicate(b'\n', timeout=60)
+        shutdown = time.perf_counter() - start
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
+
+    print(f"  idle connections: {len(sockets)} opened in {setup:.1f} s")
+    if rss is not None:
+        print(f"  server memory:    {rss:.0f} MB RSS, {threads} threads")
+    if cpu_start is not None:
+        print(f"  idle server CPU:  {(cpu_end - cpu_start) / idle:.1%}")
+    print(f"  echo round trip:  p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f} ms over {messages} messages")
+    print(f"  server alive:     {alive}, shut down in {shutdown:.1f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Idle connections and echo latency against the echo server")
+    parser.add_argument('--modes', nargs='+', choices=('thread', 'asyncio', 'pool'),
+                        default=['thread', 'asyncio', 'pool'])
+    parser.add_argument('--connections', type=int, default=50000)
+    parser.add_argument('--idle', type=float, default=3.0, help="seconds to measure idle CPU over")
+    parser.add_argument('--clients', type=int, default=10, help="active echo clients")
+    parser.add_argument('--messages', type=int, default=5000, help="echo round trips to time")
+    parser.add_argument('--port', type=int, default=5108)
+    args = parser.parse_args()
+
+    if resource is not None:
+        # The server inherits the raised limit too
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        if hard < args.connections + 100:
+            print(f"Open file limit is {hard}: expect to stop short of {args.connections} connections")
+
+    for i, mode in enumerate(args.modes):
+        run(mode, args.port + i, args.connections, args.idle, args.clients, args.messages)
+
+if __name__ == "__main__":
+    main()
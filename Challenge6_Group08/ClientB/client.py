@@ -2,7 +2,11 @@ import socket
 import threading
 import os
 import sys
-import time
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from protocol import (FrameDecoder, send_frame, encode_header, file_hash, REGISTER, REGISTERED,
+                      FILE_START, FILE_DATA, FILE_END, ACK, HAVE, NEED)
 
 # Global variables
 client_id = None
@@ -10,6 +14,14 @@ running = False
 server_host = '127.0.0.1'
 server_port = 5555
 client_socket = None
+send_lock = threading.Lock()  # uploads and ACKs share the socket, one frame at a time
+decoder = FrameDecoder()
+upload_ids = itertools.count(1)
+answers = {}  # {upload file_id: [threading.Event, server has it]}
+known_hashes = {}  # {content hash: path of a received file with that content}
+
+CHUNK_SIZE = 64 * 1024
+ANSWER_TIMEOUT = 5.0  # upload anyway if the server does not say HAVE/NEED in time
 
 def receive_files():
     """Continuously listen for incoming files"""
@@ -22,57 +34,90 @@ def receive_files():
     # Assurez-vous que le dossier existe
     os.makedirs(received_dir, exist_ok=True)
     
+    # Index what we already hold, so the server can skip sending it again
+    for name in os.listdir(received_dir):
+        path = os.path.join(received_dir, name)
+        if os.path.isfile(path):
+            known_hashes[file_hash(path)] = path
+    
+    # One reusable receive buffer, so file size does not matter
+    view = memoryview(bytearray(CHUNK_SIZE))
+    incoming = {}  # {file_id: (open file, filename, sender_id, filepath, hash)}
+    
     while running:
         try:
-            data = client_socket.recv(1024).decode('utf-8')
-            if not data:
-                print("Connection to server lost.")
-                break
-            
-            if data.startswith('SEND:'):
-                parts = data.split(':')
-                if len(parts) < 5:
-                    continue
-                
-                _, filename, filesize, sender_id, file_id = parts
-                filesize = int(filesize)
-                
-                print(f"Receiving {filename} from {sender_id}...")
-                
-                # Receive file data
-                file_data = b''
-                bytes_received = 0
-                
-                while bytes_received < filesize:
-                    chunk = client_socket.recv(min(4096, filesize - bytes_received))
-                    if not chunk:
-                        raise Exception("Connection closed during file transfer")
-                    file_data += chunk
-                    bytes_received += len(chunk)
+            for frame in decoder.frames():
+                if frame.kind == FILE_START:
+                    filename = os.path.basename(frame.fields[0])
+                    filesize = int(frame.fields[1])
+                    sender_id = frame.fields[2]
+                    digest = frame.fields[3] if len(frame.fields) > 3 else ''
+                    
+                    # Same content already received: no need for another copy
+                    known = known_hashes.get(digest)
+                    if digest and known and os.path.exists(known) and os.path.getsize(known) == filesize:
+                        with send_lock:
+                            send_frame(client_socket, HAVE, frame.file_id)
+                        print(f"Already have {filename} from {sender_id} as {known}")
+                        continue
+                    if digest:
+                        with send_lock:
+                            send_frame(client_socket, NEED, frame.file_id)
+                    
+                    print(f"Receiving {filename} from {sender_id}...")
+                    
+                    # Save file to received folder
+                    # Add a suffix if file already exists
+                    final_filename = filename
+                    counter = 0
+                    while os.path.exists(os.path.join(received_dir, final_filename)):
+                        counter += 1
+                        base_name, ext = os.path.splitext(filename)
+                        final_filename = f"{base_name}_{counter}{ext}"
+                    
+                    filepath = os.path.join(received_dir, final_filename)
+                    incoming[frame.file_id] = (open(filepath, 'wb'), filename, sender_id, filepath, digest)
                 
-                # Save file to received folder
-                # Add a suffix if file already exists
-                final_filename = filename
-                counter = 0
-                while os.path.exists(os.path.join(received_dir, final_filename)):
-                    counter += 1
-                    base_name, ext = os.path.splitext(filename)
-                    final_filename = f"{base_name}_{counter}{ext}"
+                elif frame.kind == FILE_DATA:
+                    # Write file data to disk as it arrives
+                    if frame.file_id in incoming:
+                        incoming[frame.file_id][0].write(frame.payload)
                 
-                filepath = os.path.join(received_dir, final_filename)
-                with open(filepath, 'wb') as f:
-                    f.write(file_data)
+                elif frame.kind == FILE_END:
+                    if frame.file_id not in incoming:
+                        continue
+                    f, filename, sender_id, filepath, digest = incoming.pop(frame.file_id)
+                    f.close()
+                    if digest:
+                        known_hashes[digest] = filepath
+                    
+                    print(f"Received {filename} from {sender_id}")
+                    print(f"Saved to {filepath}")
+                    
+                    # Send ACK to server with the file_id
+                    with send_lock:
+                        send_frame(client_socket, ACK, frame.file_id, [client_id])
+                    print(f"Sent acknowledgment for {filename}")
                 
-                print(f"Received {filename} from {sender_id}")
-                print(f"Saved to {filepath}")
-                
-                # Send ACK to server with the file_id
-                client_socket.send(f"ACK:{file_id}:{client_id}".encode('utf-8'))
-                print(f"Sent acknowledgment for {filename}")
+                elif frame.kind in (HAVE, NEED):
+                    # Server's answer to one of our uploads
+                    if frame.file_id in answers:
+                        answers[frame.file_id][1] = frame.kind == HAVE
+                        answers[frame.file_id][0].set()
+            
+            n = client_socket.recv_into(view)
+            if not n:
+                print("Connection to server lost.")
+                break
+            decoder.feed(view[:n])
         
         except Exception as e:
             print(f"Error receiving file: {e}")
             running = False
+    
+    for f, *_ in incoming.values():
+        f.close()
+
 def send_file(filename):
     """Send a file to the server for broadcasting"""
     global client_socket, client_id
@@ -99,16 +144,33 @@ def send_file(filename):
         
         # Get file size
         filesize = os.path.getsize(filepath)
-        if filesize > 2 * 1024 * 1024:  # 2MB limit
-            print("File size exceeds 2MB limit.")
-            return False
         
-        # Send file metadata
-        client_socket.send(f"SEND:{os.path.basename(filename)}:{filesize}:{client_id}".encode('utf-8'))
+        # Send file metadata, with the content hash so the server can skip known files
+        digest = file_hash(filepath)
+        file_id = next(upload_ids)
+        answer = answers[file_id] = [threading.Event(), False]
+        with send_lock:
+            send_frame(client_socket, FILE_START, file_id,
+                       [os.path.basename(filename), str(filesize), digest])
+        answered = answer[0].wait(ANSWER_TIMEOUT)
+        del answers[file_id]
+        if answered and answer[1]:
+            print(f"Server already has {filename}, sent without uploading it again.")
+            return True
         
-        # Send file content
+        # Stream file content straight from disk (zero-copy where the OS supports it)
         with open(filepath, 'rb') as f:
-            client_socket.sendall(f.read())
+            offset = 0
+            while offset < filesize:
+                count = min(CHUNK_SIZE, filesize - offset)
+                with send_lock:
+                    client_socket.sendall(encode_header(FILE_DATA, file_id, payload_length=count))
+                    if client_socket.sendfile(f, offset, count) != count:
+                        raise Exception(f"{filename} changed while sending")
+                offset += count
+        
+        with send_lock:
+            send_frame(client_socket, FILE_END, file_id)
         
         print(f"Sent {filename} to server.")
         return True
@@ -117,15 +179,27 @@ def send_file(filename):
         print(f"Error sending file: {e}")
         return False
     
+def read_frame():
+    """Block until the next frame from the server is complete"""
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            return frame
+        data = client_socket.recv(CHUNK_SIZE)
+        if not data:
+            raise Exception("Connection closed by server")
+        decoder.feed(data)
+
 def register(entered_client_id):
     """Register with the server using the provided client_id"""
     global client_socket, client_id
     
     try:
-        client_socket.send(f"REGISTER:{entered_client_id}".encode('utf-8'))
-        response = client_socket.recv(1024).decode('utf-8')
-        print(response)
-        if "successful" in response.lower():
+        with send_lock:
+            send_frame(client_socket, REGISTER, fields=[entered_client_id])
+        response = read_frame()
+        print(response.fields[0] if response.fields else "No response from server")
+        if response.kind == REGISTERED:
             client_id = entered_client_id
             return True
         return False
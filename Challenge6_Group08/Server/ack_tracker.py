@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# One thread tracks the ACK of every (file, recipient) delivery in flight.
+#
+# A delivery is expected when the file is forwarded, started when its writer
+# sends FILE_START and armed once FILE_END is out: from then on the recipient
+# has `timeout` seconds to ACK. Deadlines sit in a single heap (stale entries
+# are skipped when they surface, never searched for), so tens of thousands of
+# deliveries cost one thread and O(log n) per event instead of a Timer each.
+# A delivery that times out is handed back to `resend` up to `retries` times.
+
+class Delivery:
+    def __init__(self, file_id, client_id, filename, filesize, sender_id, digest):
+        self.file_id = file_id
+        self.client_id = client_id
+        self.filename = filename
+        self.filesize = filesize
+        self.sender_id = sender_id
+        self.digest = digest
+        self.attempts = 0
+        self.started = None   # when FILE_START went out
+        self.deadline = None  # armed once the whole file is out
+
+class LatencyHistogram:
+    """Send-to-ACK latencies in power-of-two millisecond buckets"""
+    BOUNDS = [2 ** i for i in range(18)]  # 1 ms .. 131 s, then overflow
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        bucket = 0
+        while bucket < len(self.BOUNDS) and ms > self.BOUNDS[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (capped at the max), in ms"""
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.BOUNDS[bucket], self.max) if bucket < len(self.BOUNDS) else self.max
+        return 0.0
+
+    def summary(self):
+        return (f"{self.count} ACKs, mean {self.total / self.count:.1f} ms, "
+                f"p50 <= {self.percentile(50):g} ms, p99 <= {self.percentile(99):g} ms, "
+                f"max {self.max:.1f} ms")
+
+class AckTracker(threading.Thread):
+    def __init__(self, timeout, retries, resend, report_interval=60.0):
+        super().__init__(daemon=True)
+        self.timeout = timeout
+        self.retries = retries
+        self.resend = resend  # resend(delivery) -> True if it was queued again
+        self.report_interval = report_interval
+        self.deliveries = {}  # {(file_id, client_id): Delivery}
+        self.deadlines = []   # heap of (deadline, sequence, key)
+        self.sequence = itertools.count()
+        self.histograms = {}  # {client_id: LatencyHistogram}
+        self.acked_since_report = 0
+        self.condition = threading.Condition()
+
+    def expect(self, file_id, client_id, filename, filesize, sender_id, digest):
+        with self.condition:
+            self.deliveries[(file_id, client_id)] = Delivery(file_id, client_id, filename, filesize,
+                                                             sender_id, digest)
+
+    def started(self, file_id, client_id):
+        with self.condition:
+            delivery = self.deliveries.get((file_id, client_id))
+            if delivery and delivery.started is None:
+                delivery.started = time.time()
+
+    def sent(self, file_id, client_id):
+        """The whole file is out: start the ACK clock"""
+        with self.condition:
+            delivery = self.deliveries.get((file_id, client_id))
+            if delivery is None:
+                return
+            delivery.deadline = time.time() + self.timeout
+            heapq.heappush(self.deadlines, (delivery.deadline, next(self.sequence), (file_id, client_id)))
+            if self.deadlines[0][2] == (file_id, client_id):
+                self.condition.notify()
+
+    def ack(self, file_id, client_id):
+        """Record an ACK (or HAVE); the Delivery, or None if it was not outstanding"""
+        with self.condition:
+            delivery = self.deliveries.pop((file_id, client_id), None)
+            if delivery is None:
+                return None
+            if delivery.started is not None:
+                histogram = self.histograms.setdefault(client_id, LatencyHistogram())
+                histogram.add(time.time() - delivery.started)
+                self.acked_since_report += 1
+            return delivery
+
+    def fail(self, file_id, client_id, reason):
+        with self.condition:
+            delivery = self.deliveries.pop((file_id, client_id), None)
+        logging.error(f"Error forwarding file to {client_id}: {reason}")
+        print(f"Error forwarding file to {client_id}: {reason}")
+        return delivery
+
+    def outstanding(self):
+        with self.condition:
+            return len(self.deliveries)
+
+    def run(self):
+        next_report = time.time() + self.report_interval
+        while True:
+            expired = []
+            with self.condition:
+                now = time.time()
+                while self.deadlines and self.deadlines[0][0] <= now:
+                    deadline, _, key = heapq.heappop(self.deadlines)
+                    delivery = self.deliveries.get(key)
+                    # Skip entries for deliveries since ACKed, failed or re-armed
+                    if delivery is not None and delivery.deadline == deadline:
+                        expired.append(delivery)
+                if not expired:
+                    wait = next_report - now
+                    if self.deadlines:
+                        wait = min(wait, self.deadlines[0][0] - now)
+                    self.condition.wait(max(wait, 0))
+
+            # Outside the lock: resending takes other locks
+            for delivery in expired:
+                self.expire(delivery)
+
+            if time.time() >= next_report:
+                next_report = time.time() + self.report_interval
+                if self.acked_since_report:
+                    self.acked_since_report = 0
+                    self.report()
+
+    def expire(self, delivery):
+        if delivery.attempts < self.retries:
+            delivery.attempts += 1
+            delivery.deadline = None
+            delivery.started = None
+            if self.resend(delivery):
+                logging.info(f"No ACK from {delivery.client_id} for {delivery.filename}, "
+                             f"resending (retry {delivery.attempts}/{self.retries})")
+                return
+        with self.condition:
+            self.deliveries.pop((delivery.file_id, delivery.client_id), None)
+        logging.info(f"Timeout: No ACK from {delivery.client_id} for {delivery.filename} ❌")
+        print(f"Timeout: No ACK from {delivery.client_id} for {delivery.filename} ❌")
+
+    def report(self):
+        """Log the per-recipient send-to-ACK latency histograms"""
+        with self.condition:
+            lines = [f"{client_id}: {histogram.summary()}"
+                     for client_id, histogram in sorted(self.histograms.items())]
+            outstanding = len(self.deliveries)
+        logging.info(f"Delivery latency ({outstanding} outstanding): " + "; ".join(lines))
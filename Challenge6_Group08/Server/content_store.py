@@ -0,0 +1,139 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Content-addressed store for the file sharing server: files are kept under
+# their SHA-256, most recently used first. Small files live in memory until the
+# memory budget is full, then the least recently used ones are spilled to disk;
+# the oldest files on disk are deleted once the disk budget is full.
+
+class ContentStore:
+    def __init__(self, memory_limit, disk_limit, directory):
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.directory = directory
+        self.memory = OrderedDict()  # {hash: bytes}, least recently used first
+        self.disk = OrderedDict()    # {hash: size}, least recently used first
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Counters
+        self.hits = 0             # uploads the server already had
+        self.misses = 0
+        self.recipient_hits = 0   # recipients that already had a file
+        self.bytes_saved = 0      # payload bytes not uploaded or not forwarded
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest)
+
+    def open(self, digest, count=True):
+        """A readable file object for the content, or None (counting hits and misses)"""
+        with self.lock:
+            if digest in self.memory:
+                self.memory.move_to_end(digest)
+                if count:
+                    self.hits += 1
+                    self.bytes_saved += len(self.memory[digest])
+                return io.BytesIO(self.memory[digest])
+            if digest in self.disk:
+                self.disk.move_to_end(digest)
+                if count:
+                    self.hits += 1
+                    self.bytes_saved += self.disk[digest]
+                # Opened under the lock: eviction can unlink it but not pull it from under us
+                return open(self.path(digest), 'rb')
+            if count:
+                self.misses += 1
+            return None
+
+    def recipient_hit(self, size):
+        """A recipient answered HAVE, so the content was not forwarded to it"""
+        with self.lock:
+            self.recipient_hits += 1
+            self.bytes_saved += size
+
+    def sink(self, digest, filesize):
+        """Somewhere to write an upload that should end up in the store"""
+        return ContentSink(self, digest, filesize)
+
+    def add_memory(self, digest, data):
+        with self.lock:
+            if digest in self.memory or digest in self.disk:
+                return
+            self.memory[digest] = data
+            self.memory_bytes += len(data)
+            self.evict()
+
+    def add_file(self, digest, path, size):
+        with self.lock:
+            if digest in self.memory or digest in self.disk:
+                os.remove(path)
+                return
+            os.replace(path, self.path(digest))
+            self.disk[digest] = size
+            self.disk_bytes += size
+            self.evict()
+
+    def evict(self):
+        """Spill memory to disk, then delete from disk, until both budgets hold (lock held)"""
+        while self.memory_bytes > self.memory_limit:
+            digest, data = self.memory.popitem(last=False)
+            self.memory_bytes -= len(data)
+            if len(data) <= self.disk_limit:
+                with open(self.path(digest), 'wb') as f:
+                    f.write(data)
+                self.disk[digest] = len(data)
+                self.disk_bytes += len(data)
+        while self.disk_bytes > self.disk_limit:
+            digest, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            os.remove(self.path(digest))
+
+    def stats(self):
+        return (f"Content store: {self.hits} hits, {self.misses} misses, "
+                f"{self.recipient_hits} recipient hits, {self.bytes_saved} bytes saved, "
+                f"{len(self.memory)} in memory ({self.memory_bytes} bytes), "
+                f"{len(self.disk)} on disk ({self.disk_bytes} bytes)")
+
+class ContentSink:
+    """Collects an upload as it is relayed; only stored if it really has the announced hash"""
+    def __init__(self, store, digest, filesize):
+        self.store = store
+        self.digest = digest
+        self.hash = hashlib.sha256()
+        self.data = None
+        self.file = None
+        if filesize <= store.memory_limit // 4:
+            self.data = bytearray()
+        elif filesize <= store.disk_limit:
+            self.file = tempfile.NamedTemporaryFile(dir=store.directory, suffix='.part', delete=False)
+
+    def write(self, chunk):
+        self.hash.update(chunk)
+        if self.data is not None:
+            self.data += chunk
+        elif self.file is not None:
+            self.file.write(chunk)
+
+    def close(self):
+        """Hand the content to the store, False if it did not match its hash"""
+        verified = self.hash.hexdigest() == self.digest
+        if self.data is not None and verified:
+            self.store.add_memory(self.digest, bytes(self.data))
+        elif self.file is not None:
+            self.file.close()
+            if verified:
+                self.store.add_file(self.digest, self.file.name, os.path.getsize(self.file.name))
+            else:
+                os.remove(self.file.name)
+        return verified
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.file.name)
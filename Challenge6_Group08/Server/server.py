@@ -1,12 +1,25 @@
+import argparse
 import socket
 import threading
-import select
+import queue
 import time
 import os
 import sys
 import logging
+import itertools
+import shutil
+import signal
+import tempfile
+import secrets
+from collections import deque
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from protocol import (FrameDecoder, send_frame, REGISTER, REGISTERED, ERROR,
+                      FILE_START, FILE_DATA, FILE_END, ACK, HAVE, NEED, valid_hash)
+from content_store import ContentStore
+from ack_tracker import AckTracker
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -18,165 +31,475 @@ logging.basicConfig(
 )
 
 # Global variables
-clients = {}  # {client_id: (socket, address)}
+clients = {}  # {client_id: (socket, address, ClientWriter)}
 clients_lock = threading.Lock()
-pending_acks = {}  # {filename+timestamp: {client_id: received_status}}
-pending_acks_lock = threading.Lock()
+# Ids the server gives forwarded files: a random per-run prefix and a counter,
+# so an ACK meant for an earlier run of the server can never match
+FILE_ID_PREFIX = secrets.randbits(31) << 32
+file_ids = itertools.count(1)
 
-def receive_file(client_socket, filesize):
-    """Receive a file from a client"""
-    data = b''
-    bytes_received = 0
-    
-    while bytes_received < filesize:
-        chunk = client_socket.recv(min(4096, filesize - bytes_received))
-        if not chunk:
-            raise Exception("Connection closed during file transfer")
-        data += chunk
-        bytes_received += len(chunk)
-    
-    return data
-
-def check_acks(file_id, filename):
-    """Check if all clients have acknowledged receipt of the file"""
-    with pending_acks_lock:
-        if file_id in pending_acks:
-            for cid, status in pending_acks[file_id].items():
-                if status is False:
-                    logging.info(f"Timeout: No ACK from {cid} for {filename} ❌")
-                    print(f"Timeout: No ACK from {cid} for {filename} ❌")
-            
-            # Clean up pending ACKs after timeout
-            del pending_acks[file_id]
+RELAY_CHUNK_SIZE = 64 * 1024     # recv size
+OUTBOUND_QUEUE_CHUNKS = 64       # chunks buffered in memory per recipient per file (4 MB), then on disk
+SLOW_RECIPIENT_TIMEOUT = 10.0    # a recipient that takes nothing for this long is dropped
+OFFER_TIMEOUT = 5.0              # wait this long for HAVE/NEED before sending anyway
 
-def forward_file(filename, file_data, sender_id, file_id):
-    """Forward a file to all other registered clients"""
-    with clients_lock:
-        targets = [cid for cid in clients.keys() if cid != sender_id]
-        
-        if not targets:
-            logging.info(f"No other clients to forward {filename} to")
-            print(f"No other clients to forward {filename} to")
-            return
-        
-        # Initialize pending ACKs for this file
-        with pending_acks_lock:
-            pending_acks[file_id] = {cid: False for cid in targets}
-        
-        # Log forwarding attempt
-        targets_str = ", ".join(targets)
-        logging.info(f"Forwarding {filename} to {targets_str}")
-        print(f"Forwarding {filename} to {targets_str}")
-        
-        # Send file to all other clients
-        for cid in targets:
-            if cid not in clients:
+content_store = None  # ContentStore, set up in main()
+ack_tracker = None    # AckTracker, set up in main()
+
+class Transfer:
+    """One file on its way to one recipient: a bounded queue of chunks in memory,
+    then, if the recipient falls behind, the rest of the file from the upload's Backlog"""
+    def __init__(self, file_id, filename, filesize, sender_id, digest):
+        self.file_id = file_id
+        self.filename = filename
+        self.filesize = filesize
+        self.sender_id = sender_id
+        self.digest = digest
+        self.chunks = deque()  # None marks the end
+        self.condition = threading.Condition()
+        self.backlog = None  # Backlog the rest of the file is read from, once behind
+        self.backlog_offset = 0  # file offset the writer reads next from the backlog
+        self.failed = None  # reason, once the transfer is abandoned
+        self.answered = threading.Event()  # set on the recipient's HAVE/NEED
+        self.have = False
+
+    def offer(self, chunk, offset, upload):
+        """Queue the chunk at file offset, never blocking the sender: once the
+        memory queue is full, this chunk and the rest come from the backlog"""
+        with self.condition:
+            if self.failed or self.backlog is not None:
+                return  # Aborted, or the backlog has it
+            if len(self.chunks) < OUTBOUND_QUEUE_CHUNKS:
+                self.chunks.append(chunk)
+            else:
+                self.backlog_offset = offset
+                self.backlog = upload.spill(offset)
+            self.condition.notify()
+
+    def end(self):
+        with self.condition:
+            if self.backlog is None:
+                self.chunks.append(None)
+            self.condition.notify()
+
+    def next(self):
+        """The writer's next chunk: bytes, or None at the end of the file or once it failed"""
+        with self.condition:
+            while not self.chunks and self.backlog is None and not self.failed:
+                self.condition.wait()
+            if self.failed:
+                return None
+            if self.chunks:
+                return self.chunks.popleft()
+            backlog = self.backlog
+        chunk = backlog.read(self.backlog_offset, RELAY_CHUNK_SIZE, self)
+        self.backlog_offset += len(chunk)
+        return chunk or None
+
+    def abort(self, reason):
+        with self.condition:
+            self.failed = reason
+            self.condition.notify()
+            backlog = self.backlog
+        if backlog is not None:
+            backlog.wake()  # The writer may be waiting for more of the file
+
+class Backlog:
+    """An upload from file offset `start` on, in a temporary file, for the
+    recipients that fell behind; deleted once the upload and they let go of it"""
+    def __init__(self, start):
+        self.start = start
+        self.end = start  # file offset after the last byte written
+        self.done = False
+        self.file = tempfile.TemporaryFile(dir=content_store.directory, suffix='.backlog')
+        self.condition = threading.Condition()
+
+    def append(self, chunk):
+        with self.condition:
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(chunk)
+            self.end += len(chunk)
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def read(self, offset, size, transfer):
+        """Up to size bytes from file offset, b'' at the end of the upload or once transfer failed"""
+        with self.condition:
+            while offset >= self.end and not self.done and not transfer.failed:
+                self.condition.wait()
+            if transfer.failed or offset >= self.end:
+                return b''
+            self.file.seek(offset - self.start)
+            return self.file.read(min(size, self.end - offset))
+
+class ClientWriter(threading.Thread):
+    """Owns every send to one client, so a slow client only ever stalls itself"""
+    def __init__(self, client_id, client_socket):
+        super().__init__(daemon=True)
+        self.client_id = client_id
+        self.client_socket = client_socket
+        self.transfers = queue.Queue()  # Transfer objects, one file at a time; None stops
+        self.current = None  # Transfer being sent
+        self.send_lock = threading.Lock()  # whole frames only, control frames go in between
+        self.last_progress = time.time()
+        self.waiting = False  # for more of the file from its sender, not on the client
+        self.closed = False
+
+    def run(self):
+        while True:
+            transfer = self.transfers.get()
+            if transfer is None:
+                break
+            if self.closed or transfer.failed:
+                ack_tracker.fail(transfer.file_id, self.client_id, transfer.failed or "client disconnected")
                 continue
-                
-            target_socket = clients[cid][0]
+            self.last_progress = time.time()
+            self.current = transfer
             try:
-                # Send file metadata with the unique file_id
-                header = f"SEND:{filename}:{len(file_data)}:{sender_id}:{file_id}"
-                target_socket.send(header.encode('utf-8'))
-                time.sleep(0.1)  # Small delay to ensure header is processed
+                fields = [transfer.filename, str(transfer.filesize), transfer.sender_id]
+                ack_tracker.started(transfer.file_id, self.client_id)
+                self.send(FILE_START, transfer.file_id, fields + [transfer.digest or ''])
                 
-                # Send file data
-                target_socket.sendall(file_data)
+                # A recipient that already holds the content gets none of it
+                skip = (transfer.digest is not None and transfer.answered.wait(OFFER_TIMEOUT)
+                        and transfer.have)
+                while True:
+                    self.waiting = True
+                    chunk = transfer.next()
+                    self.last_progress = time.time()  # A slow sender is not a slow recipient
+                    self.waiting = False
+                    if skip and (chunk is None or transfer.failed):
+                        break
+                    if transfer.failed:
+                        raise Exception(transfer.failed)
+                    if chunk is None:
+                        self.send(FILE_END, transfer.file_id)
+                        ack_tracker.sent(transfer.file_id, self.client_id)
+                        break
+                    if not skip:
+                        self.send(FILE_DATA, transfer.file_id, payload=chunk)
+                    self.last_progress = time.time()
             except Exception as e:
-                logging.error(f"Error forwarding file to {cid}: {e}")
-                print(f"Error forwarding file to {cid}: {e}")
-                with pending_acks_lock:
-                    pending_acks[file_id][cid] = "Failed"
-        
-        # Start a timer to check for ACKs
-        ack_timer = threading.Timer(5.0, check_acks, args=[file_id, filename])
-        ack_timer.daemon = True
-        ack_timer.start()
+                ack_tracker.fail(transfer.file_id, self.client_id, transfer.failed or str(e))
+                self.close()  # Its copy of the stream is cut mid-file, so it has to reconnect
+            finally:
+                self.current = None
+
+    def send(self, kind, file_id=0, fields=(), payload=b''):
+        """Send one frame; safe to call from other threads between file chunks"""
+        with self.send_lock:
+            send_frame(self.client_socket, kind, file_id, fields, payload)
+
+    def stalled(self):
+        """Whether the client took nothing of the file being sent for SLOW_RECIPIENT_TIMEOUT,
+        with data waiting for it"""
+        return (self.current is not None and not self.waiting
+                and time.time() - self.last_progress > SLOW_RECIPIENT_TIMEOUT)
+
+    def answer(self, file_id, have):
+        """Deliver the client's HAVE/NEED for the file being offered, return its Transfer"""
+        transfer = self.current
+        if transfer is None or transfer.file_id != file_id:
+            return None
+        transfer.have = have
+        transfer.answered.set()
+        return transfer
+
+    def enqueue(self, transfer):
+        self.transfers.put(transfer)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stop(self):
+        self.closed = True
+        self.transfers.put(None)
+
+class Upload:
+    """A file arriving from its sender, relayed to the recipients chunk by chunk"""
+    def __init__(self, file_id, filename, filesize, sender_id, transfers):
+        self.file_id = file_id
+        self.filename = filename
+        self.filesize = filesize
+        self.sender_id = sender_id
+        self.transfers = transfers  # {ClientWriter: Transfer} still receiving this file
+        self.bytes_received = 0
+        self.sink = None  # ContentSink when the content goes into the store
+        self.backlog = None  # Backlog, from the first recipient that falls behind
+
+    def relay(self, chunk):
+        """Queue one FILE_DATA payload for every recipient without waiting for
+        any of them: the ones behind read it from the backlog"""
+        offset = self.bytes_received
+        self.bytes_received += len(chunk)
+        if self.bytes_received > self.filesize:
+            raise Exception(f"{self.filename} is larger than announced")
+        if self.sink:
+            self.sink.write(chunk)
+        for writer, transfer in list(self.transfers.items()):
+            if writer.closed:
+                transfer.abort("client disconnected")
+                del self.transfers[writer]
+                continue
+            transfer.offer(chunk, offset, self)
+        if self.backlog is not None:
+            self.backlog.append(chunk)
+
+    def spill(self, offset):
+        """The backlog, started at offset (the chunk being relayed) if there is none yet"""
+        if self.backlog is None:
+            self.backlog = Backlog(offset)
+        return self.backlog
+
+    def finish(self):
+        if self.bytes_received != self.filesize:
+            raise Exception(f"{self.filename} ended after {self.bytes_received} of {self.filesize} bytes")
+        if self.sink and not self.sink.close():
+            logging.warning(f"{self.filename} does not match its announced hash, not cached")
+        if self.backlog is not None:
+            self.backlog.finish()
+        for transfer in self.transfers.values():
+            transfer.end()
+
+    def abort(self, reason):
+        if self.sink:
+            self.sink.discard()
+        for transfer in self.transfers.values():
+            transfer.abort(reason)
+        if self.backlog is not None:
+            self.backlog.finish()
+
+    def replay(self, source):
+        """Relay the content from the store instead of the sender (runs in its own thread)"""
+        try:
+            with source:
+                while True:
+                    chunk = source.read(RELAY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.relay(chunk)
+            self.finish()
+        except Exception as e:
+            logging.error(f"Error relaying {self.filename} from the content store: {e}")
+            self.abort(str(e))
+
+def forward_file(filename, filesize, sender_id, digest=None):
+    """Start relaying a file from its sender to all other registered clients"""
+    file_id = FILE_ID_PREFIX | next(file_ids)
+    
+    # Only snapshot the recipients under the lock, the relay itself runs without it
+    with clients_lock:
+        targets = {cid: entry[2] for cid, entry in clients.items() if cid != sender_id}
+    
+    if not targets:
+        logging.info(f"No other clients to forward {filename} to")
+        print(f"No other clients to forward {filename} to")
+        return Upload(file_id, filename, filesize, sender_id, {})  # Drain the upload anyway
+    
+    # Log forwarding attempt
+    targets_str = ", ".join(targets)
+    logging.info(f"Forwarding {filename} to {targets_str}")
+    print(f"Forwarding {filename} to {targets_str}")
+    
+    # Queue the file behind whatever each recipient is already receiving
+    transfers = {}
+    for cid, writer in targets.items():
+        ack_tracker.expect(file_id, cid, filename, filesize, sender_id, digest)
+        transfers[writer] = Transfer(file_id, filename, filesize, sender_id, digest)
+        writer.enqueue(transfers[writer])
+    return Upload(file_id, filename, filesize, sender_id, transfers)
+
+def watch_writers():
+    """Drop recipients that stopped reading mid-file, during the upload or after it"""
+    while True:
+        time.sleep(1.0)
+        with clients_lock:
+            writers = [entry[2] for entry in clients.values()]
+        for writer in writers:
+            transfer = writer.current
+            if transfer is not None and writer.stalled():
+                transfer.abort("too slow")
+                writer.close()
+
+def resend(delivery):
+    """Queue a file again for a recipient that did not ACK it, from the content store"""
+    with clients_lock:
+        entry = clients.get(delivery.client_id)
+    if entry is None or delivery.digest is None:
+        return False
+    source = content_store.open(delivery.digest, count=False)
+    if source is None:
+        return False  # Evicted, or never cached
+    
+    writer = entry[2]
+    transfer = Transfer(delivery.file_id, delivery.filename, delivery.filesize,
+                        delivery.sender_id, delivery.digest)
+    writer.enqueue(transfer)
+    upload = Upload(delivery.file_id, delivery.filename, delivery.filesize, delivery.sender_id,
+                    {writer: transfer})
+    threading.Thread(target=upload.replay, args=(source,), daemon=True).start()
+    return True
 
 def handle_client(client_socket, client_address):
     """Handle a client connection"""
     client_id = None
+    decoder = FrameDecoder()
+    buffer = memoryview(bytearray(RELAY_CHUNK_SIZE))
+    uploads = {}  # {sender's file id: Upload} for files still arriving
     
     try:
         while True:
-            # Receive message from client
-            data = client_socket.recv(1024).decode('utf-8')
-            if not data:
+            # Receive data from client and process every complete frame in it
+            n = client_socket.recv_into(buffer)
+            if not n:
                 break
+            decoder.feed(buffer[:n])
             
-            # Process the received message
-            if data.startswith('REGISTER:'):
-                # Handle registration
-                client_id = data.split(':')[1]
-                with clients_lock:
-                    # Check if client_id is already taken
-                    if client_id in clients:
-                        client_socket.send(f"Registration failed: ID {client_id} already in use".encode('utf-8'))
-                        logging.warning(f"Registration attempt with duplicate ID {client_id} from {client_address}")
-                        continue
+            for frame in decoder.frames():
+                if frame.kind == REGISTER:
+                    # Handle registration
+                    requested_id = frame.fields[0]
+                    with clients_lock:
+                        # Check if client_id is already taken
+                        if requested_id in clients or client_id:
+                            send_frame(client_socket, ERROR,
+                                       fields=[f"Registration failed: ID {requested_id} already in use"])
+                            logging.warning(f"Registration attempt with duplicate ID {requested_id} from {client_address}")
+                            continue
                         
-                    clients[client_id] = (client_socket, client_address)
-                
-                logging.info(f"Client {client_id} registered from {client_address}")
-                client_socket.send(f"Registration successful as {client_id}".encode('utf-8'))
-            
-            elif data.startswith('SEND:'):
-                # Handle file sending request
-                parts = data.split(':')
-                if len(parts) < 4 or not client_id:
-                    continue
-                
-                _, filename, filesize, sender_id = parts
-                filesize = int(filesize)
+                        client_id = requested_id
+                        writer = ClientWriter(client_id, client_socket)
+                        clients[client_id] = (client_socket, client_address, writer)
+                        # Reply before the writer can start sending files
+                        writer.send(REGISTERED, fields=[f"Registration successful as {client_id}"])
+                    writer.start()
+                    
+                    logging.info(f"Client {client_id} registered from {client_address}")
                 
-                # Generate unique file identifier with timestamp
-                timestamp = int(time.time())
-                file_id = f"{filename}_{timestamp}"
+                elif frame.kind == FILE_START:
+                    # Handle file sending request
+                    if len(frame.fields) < 2 or not client_id:
+                        continue
+                    
+                    filename = os.path.basename(frame.fields[0])
+                    filesize = int(frame.fields[1])
+                    digest = frame.fields[2] if len(frame.fields) > 2 else ''
+                    digest = digest if valid_hash(digest) else None  # also names a file on disk
+                    
+                    logging.info(f"Client {client_id} is sending {filename} ({filesize} bytes)")
+                    print(f"Client {client_id} is sending {filename} ({filesize} bytes)")
+                    
+                    upload = forward_file(filename, filesize, client_id, digest)
+                    source = content_store.open(digest) if digest else None
+                    if source is not None:
+                        # Seen this content before: forward it from the store, skip the upload
+                        writer.send(HAVE, frame.file_id)
+                        logging.info(f"{filename} from {client_id} is already cached, not uploaded")
+                        logging.info(content_store.stats())
+                        threading.Thread(target=upload.replay, args=(source,), daemon=True).start()
+                        continue
+                    
+                    # Forward to other clients while the content arrives
+                    if digest:
+                        upload.sink = content_store.sink(digest, filesize)
+                        writer.send(NEED, frame.file_id)
+                    uploads[frame.file_id] = upload
                 
-                # Receive the file content
-                file_data = receive_file(client_socket, filesize)
+                elif frame.kind == FILE_DATA:
+                    if frame.file_id in uploads:
+                        uploads[frame.file_id].relay(frame.payload)
                 
-                logging.info(f"Client {sender_id} sent {filename} ({filesize} bytes)")
-                print(f"Client {sender_id} sent {filename} ({filesize} bytes)")
+                elif frame.kind == FILE_END:
+                    if frame.file_id not in uploads:
+                        continue
+                    upload = uploads.pop(frame.file_id)
+                    upload.finish()
+                    
+                    logging.info(f"Client {client_id} sent {upload.filename} ({upload.filesize} bytes)")
+                    print(f"Client {client_id} sent {upload.filename} ({upload.filesize} bytes)")
+                    if upload.sink:
+                        logging.info(content_store.stats())
                 
-                # Forward to other clients
-                forward_file(filename, file_data, sender_id, file_id)
-            
-            elif data.startswith('ACK:'):
-                # Handle acknowledgment
-                parts = data.split(':')
-                if len(parts) < 3:
-                    continue
+                elif frame.kind in (HAVE, NEED):
+                    # Answer to a file offered to this client
+                    if not client_id:
+                        continue
+                    transfer = writer.answer(frame.file_id, frame.kind == HAVE)
+                    if transfer is None or frame.kind == NEED:
+                        continue
+                    
+                    # Already having the file counts as receiving it
+                    content_store.recipient_hit(transfer.filesize)
+                    ack_tracker.ack(frame.file_id, client_id)
+                    logging.info(f"{client_id} already has {transfer.filename}, not forwarded ✅")
+                    print(f"{client_id} already has {transfer.filename}, not forwarded ✅")
                 
-                _, file_id, ack_client_id = parts
-                with pending_acks_lock:
-                    if file_id in pending_acks and ack_client_id in pending_acks[file_id]:
-                        pending_acks[file_id][ack_client_id] = True
-                        logging.info(f"Received ACK from {ack_client_id} for {file_id} ✅")
-                        print(f"Received ACK from {ack_client_id} for {file_id} ✅")
+                elif frame.kind == ACK:
+                    # Handle acknowledgment
+                    if not frame.fields:
+                        continue
+                    
+                    ack_client_id = frame.fields[0]
+                    delivery = ack_tracker.ack(frame.file_id, ack_client_id)
+                    if delivery is not None:
+                        logging.info(f"Received ACK from {ack_client_id} for {delivery.filename} ✅")
+                        print(f"Received ACK from {ack_client_id} for {delivery.filename} ✅")
     
     except Exception as e:
         logging.error(f"Error handling client {client_id}: {e}")
     
     finally:
+        # Files cut off mid-upload can't be completed
+        for upload in uploads.values():
+            upload.abort("sender disconnected")
+        
         # Clean up when client disconnects
         if client_id:
             with clients_lock:
                 if client_id in clients:
-                    del clients[client_id]
+                    clients.pop(client_id)[2].stop()
             logging.info(f"Client {client_id} disconnected")
             print(f"Client {client_id} disconnected")
         client_socket.close()
 
 def main():
     """Main function to start the server"""
+    global content_store, ack_tracker
+    parser = argparse.ArgumentParser(description="File sharing server")
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--cache-memory', type=int, default=64, help="MB of file content kept in memory")
+    parser.add_argument('--cache-disk', type=int, default=1024, help="MB of file content spilled to disk")
+    parser.add_argument('--cache-dir', default=None, help="spill directory (default: a temporary one)")
+    parser.add_argument('--ack-timeout', type=float, default=5.0, help="seconds to wait for an ACK")
+    parser.add_argument('--retries', type=int, default=1, help="resends to a client that does not ACK")
+    args = parser.parse_args()
     host = '127.0.0.1'
-    port = 5555
+    port = args.port
     
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((host, port))
     server_socket.listen(5)
+
+    ack_tracker = AckTracker(args.ack_timeout, args.retries, resend)
+    ack_tracker.start()
+    # A spill directory of our own goes away with the server, on Ctrl+C or SIGTERM
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix='content_store_')
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    content_store = ContentStore(args.cache_memory * 1024 * 1024, args.cache_disk * 1024 * 1024, cache_dir)
+    threading.Thread(target=watch_writers, daemon=True).start()
     
     logging.info(f"Server started on {host}:{port}")
     print(f"Server running on {host}:{port}")
@@ -190,8 +513,11 @@ def main():
             client_thread.start()
     except KeyboardInterrupt:
         logging.info("Server shutting down")
+        ack_tracker.report()
     finally:
         server_socket.close()
+        if not args.cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,164 @@
+import argparse
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from protocol import (FrameDecoder, send_frame, REGISTER, REGISTERED,
+                      FILE_START, FILE_DATA, FILE_END, HAVE, NEED)
+
+# Relay throughput benchmark: N senders upload at once to a fresh Server/server.py,
+# every other registered client (the M receivers and the other senders) gets a copy
+#   python benchmark.py --senders 4 --receivers 4 --size 32
+#   python benchmark.py --senders 2 --receivers 2 --size 8 --files 500
+#   python benchmark.py --senders 2 --receivers 4 --size 16 --files 8 --dedup
+# With --dedup every file carries the hash of the (identical) content, so the
+# server's content store and the receivers' HAVE answers can skip it.
+
+CHUNK_SIZE = 64 * 1024
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Server', 'server.py')
+
+def start_server(port, workdir):
+    server = subprocess.Popen([sys.executable, SERVER, '--port', str(port)], cwd=workdir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+def register(port, client_id):
+    sock = socket.create_connection(('127.0.0.1', port))
+    send_frame(sock, REGISTER, fields=[client_id])
+    decoder = FrameDecoder()
+    response = None
+    while response is None:
+        decoder.feed(sock.recv(1024))
+        response = decoder.next_frame()
+    if response.kind != REGISTERED:
+        raise RuntimeError(response.fields[0])
+    return sock
+
+class Client:
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()  # upload and answers share the socket
+        self.answers = {}  # {upload file id: [threading.Event, server has it]}
+
+    def send(self, *args, **kwargs):
+        with self.lock:
+            send_frame(self.sock, *args, **kwargs)
+
+def drain(client, expected_files, expected_answers, totals, index):
+    """Read whole files off a client socket, counting the payload bytes, and
+    the server's HAVE/NEED answers to the client's own uploads"""
+    view = memoryview(bytearray(256 * 1024))
+    decoder = FrameDecoder()
+    seen = set()  # content hashes already received
+    finished = 0
+    answered = 0
+    while finished < expected_files or answered < expected_answers:
+        n = client.sock.recv_into(view)
+        if not n:
+            return
+        decoder.feed(view[:n])
+        for frame in decoder.frames():
+            if frame.kind == FILE_DATA:
+                totals[index] += len(frame.payload)
+            elif frame.kind == FILE_END:
+                finished += 1
+            elif frame.kind == FILE_START and frame.fields[3]:
+                have = frame.fields[3] in seen
+                seen.add(frame.fields[3])
+                client.send(HAVE if have else NEED, frame.file_id)
+                finished += have
+            elif frame.kind in (HAVE, NEED):
+                client.answers[frame.file_id][1] = frame.kind == HAVE
+                client.answers[frame.file_id][0].set()
+                answered += 1
+
+def upload(client, client_id, data, files, dedup, finished, uploaded, index, start):
+    """Send the same data as several files back to back on one connection"""
+    view = memoryview(data)
+    digest = hashlib.sha256(data).hexdigest() if dedup else ''
+    for file_id in range(1, files + 1):
+        answer = client.answers[file_id] = [threading.Event(), False]
+        client.send(FILE_START, file_id, [f"{client_id}_{file_id}.bin", str(len(data)), digest])
+        if dedup and answer[0].wait(5.0) and answer[1]:
+            continue  # The server has it already
+        for offset in range(0, len(data), CHUNK_SIZE):
+            client.send(FILE_DATA, file_id, payload=view[offset:offset + CHUNK_SIZE])
+        client.send(FILE_END, file_id)
+        uploaded[index] += len(data)
+    finished[index] = time.time() - start
+
+def run(senders, receivers, size_mb, port, files=1, dedup=False):
+    data = os.urandom(size_mb * 1024 * 1024 // files)
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(port, workdir)
+        try:
+            ids = [f"S{i}" for i in range(senders)] + [f"R{i}" for i in range(receivers)]
+            sockets = [register(port, cid) for cid in ids]
+            clients = [Client(sock) for sock in sockets]
+            totals = [0] * len(ids)
+            finished = [0.0] * senders
+            uploaded = [0] * senders
+
+            # Every client gets one copy of each upload but its own
+            readers = []
+            for i, client in enumerate(clients):
+                expected = (senders - 1 if i < senders else senders) * files
+                # With --dedup a sender also waits for an answer to each of its uploads
+                answers = files if dedup and i < senders else 0
+                readers.append(threading.Thread(target=drain, args=(client, expected, answers, totals, i)))
+            for reader in readers:
+                reader.start()
+
+            start = time.time()
+            writers = [threading.Thread(target=upload,
+                                        args=(clients[i], ids[i], data, files, dedup, finished,
+                                              uploaded, i, start))
+                       for i in range(senders)]
+            for writer in writers:
+                writer.start()
+            for thread in writers + readers:
+                thread.join()
+            elapsed = time.time() - start
+            for sock in sockets:
+                sock.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+    expected_bytes = senders * (senders - 1 + receivers) * len(data) * files
+    return sum(totals), expected_bytes, elapsed, finished, sum(uploaded)
+
+def main():
+    parser = argparse.ArgumentParser(description="File sharing relay throughput")
+    parser.add_argument('--senders', type=int, default=4)
+    parser.add_argument('--receivers', type=int, default=4)
+    parser.add_argument('--size', type=int, default=32, help="file size in MB, per sender")
+    parser.add_argument('--files', type=int, default=1, help="split each upload into this many files")
+    parser.add_argument('--dedup', action='store_true', help="announce content hashes")
+    parser.add_argument('--port', type=int, default=5556)
+    args = parser.parse_args()
+
+    delivered, expected, elapsed, finished, uploaded = run(args.senders, args.receivers, args.size,
+                                                           args.port, args.files, args.dedup)
+    print(f"senders:         {args.senders} x {args.size} MB in {args.files} file(s)")
+    print(f"receivers:       {args.receivers} (+ {args.senders - 1} other senders each)")
+    print(f"time:            {elapsed:.2f} s")
+    print(f"uploads done:    {min(finished):.2f} - {max(finished):.2f} s")
+    print(f"uploaded:        {uploaded / 1e6:.1f} of {args.senders * args.size * 1.048576:.1f} MB")
+    print(f"delivered:       {delivered / 1e6:.1f} of {expected / 1e6:.1f} MB")
+    print(f"throughput:      {delivered / elapsed / 1e6:.1f} MB/s aggregate relay")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import hashlib
+import re
+import struct
+from collections import namedtuple
+
+# Framed protocol shared by Server/server.py and the clients.
+#
+# Every frame is a fixed binary header followed by `meta` (UTF-8 text fields
+# separated by NUL) and then the payload:
+#
+#   type (1 byte) | meta length (2) | payload length (4) | file id (8) | meta | payload
+#
+# A file goes out as FILE_START, any number of FILE_DATA chunks and FILE_END,
+# all under the same file id, so files can be pipelined back to back on one
+# connection and control frames can sit between the chunks.
+#
+# FILE_START carries the SHA-256 of the content. Whoever receives it answers
+# HAVE if it already holds that content, and then gets no FILE_DATA for it, or
+# NEED. A client waits for the server's answer before uploading; the server
+# waits (briefly) for each recipient's answer before forwarding.
+
+HEADER = struct.Struct('!BHIQ')
+
+REGISTER = 1      # meta: client id
+REGISTERED = 2    # meta: message
+ERROR = 3         # meta: message
+FILE_START = 4    # meta: filename, size, hash (client) / filename, size, sender id, hash (server)
+FILE_DATA = 5     # payload: next chunk of the file
+FILE_END = 6
+ACK = 7           # meta: client id
+HAVE = 8          # answer to FILE_START: content already held, don't send it
+NEED = 9          # answer to FILE_START: send the content
+
+MAX_META = 4096
+MAX_PAYLOAD = 1024 * 1024
+
+Frame = namedtuple('Frame', ['kind', 'file_id', 'fields', 'payload'])
+
+class ProtocolError(Exception):
+    pass
+
+def file_hash(path):
+    """Hex SHA-256 of a file, as FILE_START carries it"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def valid_hash(digest):
+    return re.fullmatch('[0-9a-f]{64}', digest) is not None
+
+def encode_header(kind, file_id=0, fields=(), payload_length=0):
+    """Header and meta of a frame; the payload_length bytes of payload follow it"""
+    meta = '\0'.join(fields).encode('utf-8')
+    if len(meta) > MAX_META or payload_length > MAX_PAYLOAD:
+        raise ProtocolError("frame too large")
+    return HEADER.pack(kind, len(meta), payload_length, file_id) + meta
+
+def encode(kind, file_id=0, fields=(), payload=b''):
+    return encode_header(kind, file_id, fields, len(payload)) + payload
+
+def send_frame(sock, kind, file_id=0, fields=(), payload=b''):
+    sock.sendall(encode_header(kind, file_id, fields, len(payload)))
+    if payload:
+        sock.sendall(payload)
+
+class FrameDecoder:
+    """Incremental decoder: feed() whatever recv returned, then iterate frames()"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0  # start of the first undecoded frame
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_frame(self):
+        """The next complete frame, or None until more bytes arrive"""
+        available = len(self.buffer) - self.offset
+        if available < HEADER.size:
+            return None
+        kind, meta_length, payload_length, file_id = HEADER.unpack_from(self.buffer, self.offset)
+        if meta_length > MAX_META or payload_length > MAX_PAYLOAD:
+            raise ProtocolError("frame too large")
+        end = self.offset + HEADER.size + meta_length + payload_length
+        if len(self.buffer) < end:
+            return None
+
+        start = self.offset + HEADER.size
+        meta = self.buffer[start:start + meta_length].decode('utf-8')
+        fields = meta.split('\0') if meta else []
+        payload = bytes(self.buffer[start + meta_length:end])
+
+        # Drop consumed bytes in bulk rather than once per frame
+        self.offset = end
+        if self.offset == len(self.buffer):
+            self.buffer.clear()
+            self.offset = 0
+        elif self.offset > MAX_PAYLOAD:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        return Frame(kind, file_id, fields, payload)
+
+    def frames(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
@@ -0,0 +1,77 @@
+import argparse
+import math
+import random
+import time
+
+import primality
+
+# Time of primality.is_prime across input sizes, for primes (the slow case:
+# every test runs to the end) and random odd numbers, uncached and cached,
+# next to the trial division the server used before, while that takes under
+# --trial-limit seconds:
+#   python bench_primality.py --bits 16 32 64 128 512 1024 2048 4096
+
+def trial_division(n):
+    """The server's previous is_prime"""
+    if n < 2:
+        return False
+    for i in range(2, int(n ** 0.5) + 1):
+        if n % i == 0:
+            return False
+    return True
+
+def random_prime(bits, rng):
+    while True:
+        n = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if primality.check(n):
+            return n
+
+def per_call(function, numbers):
+    start = time.perf_counter()
+    for n in numbers:
+        function(n)
+    return (time.perf_counter() - start) / len(numbers)
+
+def uncached(n):
+    primality.check.cache_clear()
+    return primality.check(n)
+
+def fmt(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    return f"{seconds * 1e3:.2f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Primality test timings by input size")
+    parser.add_argument('--bits', nargs='+', type=int, default=[16, 32, 48, 64, 128, 256, 512, 1024, 2048, 4096])
+    parser.add_argument('--samples', type=int, default=20,
+                        help="numbers of each kind per size, fewer past 512 bits (finding primes takes a while)")
+    parser.add_argument('--trial-limit', type=float, default=2.0, help="skip trial division past this many seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    start = time.perf_counter()
+    primality.build_sieve(primality.SIEVE_LIMIT)
+    print(f"sieve of {primality.SIEVE_LIMIT} built in {fmt(time.perf_counter() - start)}")
+    print(f"{'bits':>5} {'prime':>10} {'random odd':>11} {'cached':>9} {'trial division (prime)':>23}")
+    # Trial division of a prime takes sqrt(n) steps: time one to skip the sizes past the limit
+    step = per_call(trial_division, [random_prime(32, rng)]) / 2 ** 16
+    trial_bits = 2 * math.log2(args.trial_limit / step)
+    for bits in args.bits:
+        samples = max(2, min(args.samples, args.samples * 512 // bits))
+        primes = [random_prime(bits, rng) for _ in range(samples)]
+        odds = [rng.getrandbits(bits) | (1 << (bits - 1)) | 1 for _ in range(samples)]
+        prime_time = per_call(uncached, primes)
+        odd_time = per_call(uncached, odds)
+        primality.check(primes[0])
+        cached_time = per_call(primality.check, [primes[0]] * samples)
+        trial = None
+        if bits <= trial_bits:
+            trial = per_call(trial_division, primes[:1])
+        print(f"{bits:>5} {fmt(prime_time):>10} {fmt(odd_time):>11} {fmt(cached_time):>9} {fmt(trial):>23}")
+
+if __name__ == "__main__":
+    main()
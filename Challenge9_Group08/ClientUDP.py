@@ -1,110 +1,366 @@
+import argparse
 import socket
 import os
-import struct
 import time
+import zlib
+from collections import OrderedDict
+
+from batchio import BatchSender, MAX_UDP_PAYLOAD, path_mtu_payload
+from fec import ParityEncoder
+from udp_protocol import (BLOCK_SIZE, BLOCK_HEADER, DEFAULT_WINDOW, total_blocks,
+                          file_digest, leaf_hash, TreeHash, decode_ranges, parse_ack,
+                          seal, unseal)
 
 server_address = ('127.0.0.1', 5000)
-client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-client_socket.settimeout(1.0)
-
-# Get file path from user
-file_path = input("Enter file path to send: ")
-
-# Validate file exists and size >= 10MB
-if not os.path.exists(file_path):
-    print("File does not exist")
-    exit()
-if os.path.getsize(file_path) < 10_000_000:
-    print("File must be at least 10MB")
-    exit()
-
-# Send filename and size
-file_name = os.path.basename(file_path)
-file_size = os.path.getsize(file_path)
-info = f"{file_name}|{file_size}"
-client_socket.sendto(info.encode(), server_address)
-
-# Wait for server ready signal
-_, _ = client_socket.recvfrom(1024)
-
-# Send file content in 1KB blocks
-sent_bytes = 0
-block_id = 0
-unacked_blocks = {}
-max_retries = 5
-
-with open(file_path, 'rb') as file:
-    while True:
-        # Handle retransmissions first
-        current_time = time.time()
-        for block_id, (data, send_time, retries) in list(unacked_blocks.items()):
-            if current_time - send_time > 1.0:  # 1 second timeout
-                if retries >= max_retries:
-                    print(f"\nFailed to send block {block_id} after {max_retries} attempts")
-                    client_socket.close()
-                    exit(1)
-                # Retransmit
-                packet = struct.pack('!Q', block_id) + data
-                client_socket.sendto(packet, server_address)
-                unacked_blocks[block_id] = (data, current_time, retries + 1)
-        
-        # Read and send new data
-        chunk = file.read(1024)
-        if not chunk and not unacked_blocks:  # All data sent and acknowledged
-            break
-        
-        if chunk:
-            packet = struct.pack('!Q', block_id) + chunk
-            client_socket.sendto(packet, server_address)
-            unacked_blocks[block_id] = (chunk, current_time, 0)
-            block_id += 1
-        
-        # Check for ACKs
+
+MIN_RTO = 0.05
+MAX_RTO = 2.0
+MIN_CWND = 4
+DUP_THRESHOLD = 3  # blocks SACKed past a hole before we call it lost
+max_retries = 10
+
+class RttEstimator:
+    """Smoothed RTT and retransmit timeout as in RFC 6298"""
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = 1.0  # Until the first sample arrives
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        self.rto = min(MAX_RTO, self.rto * 2)
+
+def handshake(client_socket, info, server_address):
+    """Send the transfer header until the server answers READY, return that (unsealed)"""
+    for _ in range(max_retries):
+        client_socket.sendto(info.encode(), server_address)
+        try:
+            # A fragmented resume lists up to MAX_MISSING_RANGES ranges: tens of KB
+            response, _ = client_socket.recvfrom(65535)
+            if response.startswith(b"READY|"):
+                try:
+                    return unseal(response)
+                except ValueError:
+                    continue  # Damaged or cut short, ask again
+            if response in (b"BUSY", b"ERROR"):
+                raise ConnectionError(f"Server refused the transfer: {response.decode()}")
+        except socket.timeout:
+            continue
+    raise TimeoutError("Server did not answer the handshake")
+
+def send_file(file_path, server_address=server_address, window=DEFAULT_WINDOW, resume=True,
+              block_size=BLOCK_SIZE, batched=True, fec_group=0, verbose=True):
+    """Send a file with a sliding window, return transfer statistics
+
+    block_size may be 'auto' to fill datagrams up to the path MTU; batched
+    sends runs of blocks with one syscall where the platform allows it;
+    fec_group > 0 adds one XOR parity block per that many data blocks.
+    """
+    if block_size == 'auto':
+        block_size = path_mtu_payload(server_address, BLOCK_HEADER.size)
+    block_size = min(int(block_size), MAX_UDP_PAYLOAD - BLOCK_HEADER.size)
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+    client_socket.settimeout(1.0)
+    sender = BatchSender(client_socket, server_address, batched)
+
+    # Send filename, size and content hash so an interrupted transfer can resume
+    file_name = os.path.basename(file_path)
+    file_size = os.path.getsize(file_path)
+    block_count = total_blocks(file_size, block_size)
+    if resume:
+        # One pass up front: the tree hash both keys the resume state and is
+        # what the server checks the finished file against
+        digest = file_digest(file_path, block_size)
+        tree = None
+        info = f"RESUME|{file_name}|{file_size}|{digest.hex()}|{block_size}|{fec_group}"
+    else:
+        # Blocks all go out in order, hash them on the way
+        digest = None
+        tree = TreeHash()
+        info = f"{file_name}|{file_size}|{block_size}|{fec_group}"
+    start_time = time.time()
+    ready = handshake(client_socket, info, server_address)
+
+    # READY|<session id>[|<ranges>], ranges of blocks the server still needs (up to
+    # MAX_MISSING_RANGES of them: it names any past those in MISSING at the end)
+    ready = ready.split("|")
+    session_id = int(ready[1])
+    if len(ready) > 2:
+        to_send = decode_ranges(ready[2])
+    else:
+        to_send = [(0, block_count - 1)] if block_count else []
+    skipped_blocks = block_count - sum(last - first + 1 for first, last in to_send)
+    pending = (block_id for first, last in to_send for block_id in range(first, last + 1))
+
+    rtt = RttEstimator()
+    cwnd = float(min(window, 16))  # congestion window, grows up to the flow window
+    ssthresh = float(window)
+    recovery_point = 0             # no second window cut until this block is acked
+    in_flight = OrderedDict()      # {block_id: [data, send_time, retries]}, oldest send first
+    next_block = next(pending, None)  # next new block to read from the file
+    position = 0                   # current file offset, to skip seeks on sequential reads
+    acked_upto = 0                 # cumulative ACK from the server
+    sacked_high = -1               # highest block we sent that a SACK covered
+    acked_bytes = 0
+    retransmissions = 0
+    last_progress = 0
+    outbox = []                    # datagrams queued for the next batched send
+    parity = ParityEncoder(fec_group, block_size, block_count) if fec_group else None
+    parity_blocks = 0
+
+    def transmit(block_id, data):
+        outbox.append(BLOCK_HEADER.pack(session_id, block_id, zlib.crc32(data)) + data)
+
+    def flush():
+        if outbox:
+            sender.send(outbox)
+            outbox.clear()
+
+    def retransmit(block_id):
+        nonlocal retransmissions
+        entry = in_flight[block_id]
+        if entry[2] >= max_retries:
+            client_socket.close()
+            raise TimeoutError(f"Failed to send block {block_id} after {max_retries} attempts")
+        transmit(block_id, entry[0])
+        entry[1] = time.time()
+        entry[2] += 1
+        in_flight.move_to_end(block_id)
+        retransmissions += 1
+
+    def mark_acked(block_id, now):
+        nonlocal acked_bytes
+        entry = in_flight.pop(block_id)
+        acked_bytes += len(entry[0])
+        # Karn's rule: only blocks sent once give a usable RTT sample
+        return now - entry[1] if entry[2] == 0 else None
+
+    def on_ack(message):
+        nonlocal acked_upto, sacked_high, cwnd, ssthresh, recovery_point
+        try:
+            cumulative, ranges = parse_ack(message)
+        except ValueError:
+            return  # Damaged in transit, the next ACK covers it
+        now = time.time()
+        newly_acked = 0
+        rtt_sample = None
+
+        for block_id in range(acked_upto, cumulative):
+            if block_id in in_flight:
+                newly_acked += 1
+                sample = mark_acked(block_id, now)
+                if sample is not None:
+                    rtt_sample = sample
+        acked_upto = max(acked_upto, cumulative)
+        for first, last in ranges:
+            for block_id in range(first, last + 1):
+                if block_id in in_flight:
+                    newly_acked += 1
+                    sacked_high = max(sacked_high, block_id)
+                    sample = mark_acked(block_id, now)
+                    if sample is not None:
+                        rtt_sample = sample
+
+        if rtt_sample is not None:
+            rtt.sample(rtt_sample)
+
+        # Grow the congestion window: slow start, then additive increase
+        if cwnd < ssthresh:
+            cwnd += newly_acked
+        elif cwnd:
+            cwnd += newly_acked / cwnd
+        cwnd = min(cwnd, window)
+
+        # Holes with DUP_THRESHOLD blocks SACKed beyond them are lost, resend them now.
+        # Only blocks we sent count: on a resume the server also SACKs what it already held
+        if ranges and sacked_high >= 0:
+            highest = sacked_high
+            holes_end = highest - DUP_THRESHOLD
+            lost = False
+            position = acked_upto
+            for first, last in ranges + [(highest + 1, highest + 1)]:
+                for block_id in range(position, min(first, holes_end + 1)):
+                    entry = in_flight.get(block_id)
+                    if entry is not None and now - entry[1] > (rtt.srtt or rtt.rto):
+                        retransmit(block_id)
+                        lost = True
+                position = last + 1
+            if lost and acked_upto >= recovery_point:
+                ssthresh = max(cwnd / 2, MIN_CWND)
+                cwnd = ssthresh
+                recovery_point = next_block if next_block is not None else block_count
+
+    status = None
+    verified = True
+    complete = False
+    resending = False              # sending blocks the server reported MISSING
+    with open(file_path, 'rb') as file:
+        while not complete:
+            while next_block is not None or in_flight:
+                # Fill the window with new blocks
+                while next_block is not None and len(in_flight) < int(cwnd):
+                    if position != next_block * block_size:
+                        file.seek(next_block * block_size)
+                    chunk = file.read(block_size)
+                    position = next_block * block_size + len(chunk)
+                    transmit(next_block, chunk)
+                    in_flight[next_block] = [chunk, time.time(), 0]
+                    if resending:
+                        retransmissions += 1
+                    elif tree is not None:
+                        tree.add_leaf(leaf_hash(chunk))
+                    if parity is not None and not resending:
+                        parity_block = parity.add(next_block, chunk)
+                        if parity_block is not None:
+                            transmit(*parity_block)
+                            parity_blocks += 1
+                    next_block = next(pending, None)
+                flush()
+
+                # Wait for ACKs, at most until the oldest block's timer fires
+                if in_flight:
+                    oldest = next(iter(in_flight.values()))
+                    client_socket.settimeout(max(0.001, oldest[1] + rtt.rto - time.time()))
+                try:
+                    ack, _ = client_socket.recvfrom(2048)
+                    if ack.startswith(b"ACK|"):
+                        on_ack(ack)
+                    # Drain whatever else is already queued without blocking
+                    client_socket.setblocking(False)
+                    try:
+                        while True:
+                            ack, _ = client_socket.recvfrom(2048)
+                            if ack.startswith(b"ACK|"):
+                                on_ack(ack)
+                    except BlockingIOError:
+                        pass
+                except socket.timeout:
+                    pass
+                flush()
+
+                # Per-block retransmit timers
+                now = time.time()
+                timed_out = False
+                while in_flight:
+                    block_id, entry = next(iter(in_flight.items()))
+                    if now - entry[1] < rtt.rto:
+                        break
+                    retransmit(block_id)
+                    timed_out = True
+                if timed_out:
+                    rtt.backoff()
+                    ssthresh = max(cwnd / 2, MIN_CWND)
+                    cwnd = MIN_CWND
+                    recovery_point = next_block if next_block is not None else block_count
+                flush()
+
+                if verbose and now - last_progress > 0.1:
+                    last_progress = now
+                    progress = (acked_bytes / file_size) * 100 if file_size else 100.0
+                    print(f"\rProgress: {progress:.2f}%", end='')
+
+            # Send end marker with the file digest and wait for completion confirmation,
+            # or for the blocks still missing, which go through the window again
+            if digest is None:
+                digest = tree.digest()
+            client_socket.settimeout(1.0)
+            while next_block is None and not complete:
+                client_socket.sendto(seal(f"END_OF_FILE|{session_id}|{digest.hex()}"), server_address)
+                try:
+                    while True:
+                        response, _ = client_socket.recvfrom(65535)
+                        if response in (b"COMPLETE", b"CORRUPT") or response.startswith(b"Received "):
+                            if response.startswith(b"Received "):
+                                status = response.decode()
+                            verified = response != b"CORRUPT" and "MISMATCH" not in (status or "")
+                            complete = True
+                            break
+                        elif response.startswith(b"MISSING|"):
+                            try:
+                                missing = decode_ranges(unseal(response).split("|", 1)[1])
+                            except ValueError:
+                                break  # Damaged, ask again
+                            resending = True
+                            pending = (block_id for first, last in missing
+                                       for block_id in range(first, last + 1))
+                            next_block = next(pending, None)
+                            break
+                        # Late ACKs from the window phase are ignored
+                except socket.timeout:
+                    continue
+    elapsed = time.time() - start_time
+
+    # Get completion status
+    for _ in range(0 if status else 5):
         try:
-            while True:
-                ack, _ = client_socket.recvfrom(1024)
-                ack_msg = ack.decode()
-                if ack_msg.startswith("ACK|"):
-                    acked_block = int(ack_msg.split("|")[1])
-                    if acked_block in unacked_blocks:
-                        sent_bytes += len(unacked_blocks[acked_block][0])
-                        del unacked_blocks[acked_block]
-                        progress = (sent_bytes / file_size) * 100
-                        print(f"\rProgress: {progress:.2f}%", end='')
+            response, _ = client_socket.recvfrom(1024)
+            if response.startswith(b"Received "):
+                status = response.decode()
+                break
         except socket.timeout:
             continue
+    client_socket.close()
+
+    if verbose:
+        if not verified:
+            print(f"\nTransfer FAILED verification, the server's copy differs. {status or ''}")
+        elif status:
+            print(f"\nTransfer complete. {status}")
+        else:
+            print("\nWarning: Final status not received, but file transfer might be complete")
+
+    return {
+        'bytes': file_size,
+        'blocks': block_count,
+        'seconds': elapsed,
+        'retransmissions': retransmissions,
+        'block_size': block_size,
+        'syscalls': sender.syscalls,
+        'parity_blocks': parity_blocks,
+        'skipped_blocks': skipped_blocks,
+        'srtt': rtt.srtt,
+        'status': status,
+        'verified': verified,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a file to ServerUDP.py")
+    parser.add_argument('file', nargs='?', help="file to send (asked for when omitted)")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="max blocks in flight")
+    parser.add_argument('--block-size', default=BLOCK_SIZE,
+                        help="bytes of file data per datagram, or 'auto' for the path MTU")
+    parser.add_argument('--no-batch', action='store_true', help="one syscall per datagram")
+    parser.add_argument('--fec', type=int, default=0, metavar='N',
+                        help="send an XOR parity block per N data blocks")
+    args = parser.parse_args()
+
+    # Get file path from user
+    file_path = args.file or input("Enter file path to send: ")
+
+    # Validate file exists and size >= 10MB
+    if not os.path.exists(file_path):
+        print("File does not exist")
+        exit()
+    if os.path.getsize(file_path) < 10_000_000:
+        print("File must be at least 10MB")
+        exit()
+
+    stats = send_file(file_path, window=args.window, block_size=args.block_size,
+                      batched=not args.no_batch, fec_group=args.fec)
+    rate = stats['bytes'] / stats['seconds'] / 1e6
+    print(f"{rate:.1f} MB/s, {stats['retransmissions']} retransmissions")
+    if stats['skipped_blocks']:
+        print(f"Resumed: {stats['skipped_blocks']} blocks were already on the server")
 
-# Send end marker and wait for completion confirmation
-while True:
-    client_socket.sendto(b"END_OF_FILE", server_address)
-    try:
-        response, _ = client_socket.recvfrom(1024)
-        if response == b"COMPLETE":
-            break
-        elif response.decode().startswith("MISSING|"):
-            missing_blocks = list(map(int, response.decode().split("|")[1].split(",")))
-            with open(file_path, 'rb') as file:
-                for block_id in missing_blocks:
-                    file.seek(block_id * 1024)
-                    chunk = file.read(1024)
-                    packet = struct.pack('!Q', block_id) + chunk
-                    client_socket.sendto(packet, server_address)
-    except socket.timeout:
-        continue
-
-# Get completion status
-max_status_retries = 5
-status_received = False
-for _ in range(max_status_retries):
-    try:
-        status, _ = client_socket.recvfrom(1024)
-        print(f"\nTransfer complete. {status.decode()}")
-        status_received = True
-        break
-    except socket.timeout:
-        continue
-
-if not status_received:
-    print("\nWarning: Final status not received, but file transfer might be complete")
-
-client_socket.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
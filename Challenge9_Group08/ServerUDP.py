@@ -1,80 +1,479 @@
+import argparse
+import itertools
+import mmap
+import multiprocessing
+import os
+import select
 import socket
 import struct
 import time  # Add this import at the top
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where there is no SO_REUSEPORT to run several workers either
+    fcntl = None
+
+from batchio import BatchReceiver, MAX_UDP_PAYLOAD
+from fec import PARITY_FLAG, group_of, group_blocks, rebuild
+from udp_protocol import (BLOCK_SIZE, BLOCK_HEADER, MAX_SACK_RANGES, MAX_MISSING_RANGES,
+                          ACK_EVERY, ACK_DELAY, Bitmap, total_blocks, encode_ranges,
+                          encode_ack, seal, unseal, leaf_hash, TreeHash, DIGEST_SIZE, NO_DIGEST)
 
 server_address = ('127.0.0.1', 5000)
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-server_socket.bind(server_address)
-print("Server listening on port 5000...")
 
-# Receive file info
-info, client_address = server_socket.recvfrom(1024)
-file_name, file_size = info.decode().split('|')
-file_size = int(file_size)
+STATE_MAGIC = b"UDPSTAT2"
+STATE_HEADER = struct.Struct('!8sQI16s')  # magic, file size, block size, content hash
+STATE_FLUSH_INTERVAL = 1.0
+SESSION_FLAG = 0x80000000  # session ids never start with an ASCII byte
+SESSION_TIMEOUT = 30.0     # idle sessions are dropped, their state kept for RESUME
+FINISHED_LINGER = 10.0     # completed sessions still answer END_OF_FILE this long
+MAX_PENDING_PARITY = 4096  # parity blocks kept per session while their group is incomplete
+
+def lock_file(path):
+    """Open path (creating it) under an exclusive lock that holds across worker
+    processes; the fd, or BlockingIOError if another transfer holds the lock"""
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            return fd
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise BlockingIOError(f"{path} is in use")
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)  # Removed by the transfer that held it: lock the new file
+
+class TransferState:
+    """Partial output file plus its on-disk completion bitmap and leaf hashes
+
+    received_<name>.state holds a small header (size, block size, content
+    hash), one bit per block, then one leaf hash per block, all
+    memory-mapped so a crashed transfer can pick up where it stopped.
+    """
+    def __init__(self, output_path, file_size, digest, block_size=BLOCK_SIZE):
+        self.output_path = output_path
+        self.state_path = output_path + ".state"
+        self.file_size = file_size
+        self.digest = digest
+        self.block_size = block_size
+        self.block_count = total_blocks(file_size, block_size)
+        # Held until close: a second upload to the same file, even in another worker, gets BUSY
+        self.lock = lock_file(self.state_path)
+        try:
+            self.open()
+        except BaseException:
+            os.close(self.lock)
+            raise
+
+    def open(self):
+        output_path, file_size, digest = self.output_path, self.file_size, self.digest
+        header = STATE_HEADER.pack(STATE_MAGIC, file_size, self.block_size, digest)
+        bitmap_size = (self.block_count + 7) // 8
+        self.leaves_offset = STATE_HEADER.size + bitmap_size
+        state_size = self.leaves_offset + self.block_count * DIGEST_SIZE
+
+        # Resume only if the same content was being received into a file of the right size
+        self.resumed = (digest != NO_DIGEST
+                        and os.path.exists(self.state_path)
+                        and os.path.getsize(self.state_path) == state_size
+                        and os.path.exists(output_path)
+                        and os.path.getsize(output_path) == file_size)
+        if self.resumed:
+            with open(self.state_path, 'rb') as f:
+                self.resumed = f.read(STATE_HEADER.size) == header
+
+        # Pre-size the output file and map it, blocks are written straight to their offset
+        self.output_file = open(output_path, 'r+b' if self.resumed else 'w+b')
+        self.output_file.truncate(file_size)
+        self.output = mmap.mmap(self.output_file.fileno(), file_size) if file_size else None
+
+        self.state_file = open(self.state_path, 'r+b' if self.resumed else 'w+b')
+        if not self.resumed:
+            self.state_file.write(header)
+            self.state_file.truncate(state_size)
+        self.state = mmap.mmap(self.state_file.fileno(), state_size)
+        self.received = Bitmap(self.block_count,
+                               memoryview(self.state)[STATE_HEADER.size:self.leaves_offset])
+
+    def leaf(self, block_id):
+        offset = self.leaves_offset + block_id * DIGEST_SIZE
+        return self.state[offset:offset + DIGEST_SIZE]
+
+    def set_leaf(self, block_id, leaf):
+        offset = self.leaves_offset + block_id * DIGEST_SIZE
+        self.state[offset:offset + DIGEST_SIZE] = leaf
+
+    def received_bytes(self):
+        count = self.received.count()
+        received_bytes = count * self.block_size
+        if count and self.received.test(self.block_count - 1):
+            # The last block is usually short
+            received_bytes -= self.block_count * self.block_size - self.file_size
+        return received_bytes
+
+    def flush(self):
+        # Data before bits, so a set bit always means the block is on disk
+        if self.output is not None:
+            self.output.flush()
+        self.state.flush()
+
+    def close(self, complete):
+        """Keep the state file for a later RESUME unless the transfer is over"""
+        self.received.bits.release()
+        self.flush()
+        if self.output is not None:
+            self.output.close()
+        self.output_file.close()
+        self.state.close()
+        self.state_file.close()
+        if complete:
+            os.remove(self.state_path)
+        os.close(self.lock)
+
+def parse_handshake(info):
+    """"name|size[|block size[|FEC group]]" starts a fresh transfer,
+    "RESUME|name|size|hash[|block size[|FEC group]]" may continue one"""
+    parts = info.decode().split('|')
+    if parts[0] == "RESUME" and 4 <= len(parts) <= 6:
+        file_name, file_size, digest = parts[1], int(parts[2]), bytes.fromhex(parts[3])
+        options = parts[4:]
+    else:
+        file_name, file_size, *options = parts
+        file_size, digest = int(file_size), NO_DIGEST
+    if len(options) > 2:
+        raise ValueError("bad transfer header")
+    block_size = int(options[0]) if options else BLOCK_SIZE
+    fec_group = int(options[1]) if len(options) > 1 else 0
+    if not 0 < block_size <= MAX_UDP_PAYLOAD - BLOCK_HEADER.size or file_size < 0 or fec_group < 0:
+        raise ValueError("bad transfer header")
+    return file_name, file_size, digest, block_size, fec_group
+
+class Session:
+    """One client's upload, demultiplexed by the session id in every packet"""
+    def __init__(self, session_id, server_socket, client_address, file_name, transfer, fec_group=0):
+        self.session_id = session_id
+        self.server_socket = server_socket
+        self.client_address = client_address
+        self.file_name = file_name
+        self.transfer = transfer
+        self.file_size = transfer.file_size
+        self.block_size = transfer.block_size
+        self.block_count = transfer.block_count
+        self.output = transfer.output
+        self.received = transfer.received
+        self.received_bytes = transfer.received_bytes()
+        self.next_expected = self.received.next_clear(0)  # every block below this one has arrived
+        self.highest_seen = self.block_count - 1 if transfer.resumed else -1
+        self.unacked = 0
+        self.last_packet = time.time()
+        self.fec_group = fec_group
+        self.parity = {}    # {group: parity block} for groups still missing blocks
+        self.rebuilt = 0
+        self.corrupt = 0
+
+        # Whole-file tree hash, folded up to the in-order frontier
+        self.tree = TreeHash()
+        self.fold_leaves()
+
+        # Ready signal with the session id, listing what is still missing when resuming
+        if transfer.resumed:
+            ranges = self.received.ranges(0, self.block_count, False, MAX_MISSING_RANGES)
+            self.ready = seal(f"READY|{session_id}|{encode_ranges(ranges)}")
+        else:
+            self.ready = seal(f"READY|{session_id}")
+
+    def send(self, message):
+        self.server_socket.sendto(message, self.client_address)
+
+    def send_ack(self):
+        ranges = self.received.ranges(self.next_expected + 1, self.highest_seen + 1, True,
+                                      MAX_SACK_RANGES)
+        self.send(encode_ack(self.next_expected, ranges))
+        self.unacked = 0
+
+    def fold_leaves(self):
+        while self.tree.leaves < self.next_expected:
+            self.tree.add_leaf(self.transfer.leaf(self.tree.leaves))
 
-# Send ready signal
-server_socket.sendto(b"READY", client_address)
+    def on_block(self, block_id, checksum, data):
+        offset = block_id * self.block_size
+        if block_id >= self.block_count or len(data) != min(self.block_size, self.file_size - offset):
+            return
+        self.last_packet = time.time()
+        if zlib.crc32(data) != checksum:
+            # Damaged in transit: drop it, SACK/MISSING will ask for it again
+            self.corrupt += 1
+            return
 
-# Receive file content
-received_data = {}
-expected_block_id = 0
-received_bytes = 0
+        # Store data
+        in_order = block_id == self.next_expected
+        if not self.received.test(block_id):
+            self.store(block_id, data)
+            if self.parity:
+                self.try_rebuild(group_of(block_id, self.fec_group))
 
-while True:
+        # Send ACK: every ACK_EVERY in-order blocks, right away on gaps or duplicates
+        self.unacked += 1
+        if not in_order or self.unacked >= ACK_EVERY or self.next_expected >= self.block_count:
+            self.send_ack()
+
+    def store(self, block_id, data):
+        offset = block_id * self.block_size
+        self.output[offset:offset + len(data)] = data
+        self.transfer.set_leaf(block_id, leaf_hash(data))
+        self.received.set(block_id)
+        self.received_bytes += len(data)
+        self.highest_seen = max(self.highest_seen, block_id)
+        if block_id == self.next_expected:
+            self.next_expected = self.received.next_clear(self.next_expected)
+            self.fold_leaves()
+
+    def on_parity(self, group, checksum, data):
+        if not self.fec_group or len(data) != self.block_size or group in self.parity:
+            return
+        if zlib.crc32(data) != checksum:
+            self.corrupt += 1
+            return
+        if group_of(self.block_count - 1, self.fec_group) < group:
+            return
+        self.last_packet = time.time()
+        if len(self.parity) >= MAX_PENDING_PARITY:
+            del self.parity[next(iter(self.parity))]  # Oldest group, the sender will retransmit
+        self.parity[group] = bytes(data)
+        self.try_rebuild(group)
+
+    def try_rebuild(self, group):
+        """Rebuild the group's only missing block from its parity, if that is the case"""
+        parity = self.parity.get(group)
+        if parity is None:
+            return
+        blocks = group_blocks(group, self.fec_group, self.block_count)
+        missing = [block_id for block_id in blocks if not self.received.test(block_id)]
+        if len(missing) > 1:
+            return
+        del self.parity[group]
+        if not missing:
+            return
+        survivors = (self.output[block_id * self.block_size:(block_id + 1) * self.block_size]
+                     for block_id in blocks if block_id != missing[0])
+        length = min(self.block_size, self.file_size - missing[0] * self.block_size)
+        self.store(missing[0], rebuild(parity, survivors, length))
+        self.rebuilt += 1
+        self.unacked += 1
+
+    def on_end_of_file(self, digest):
+        """Once complete, check the sender's digest and return (verified, status);
+        until then ask for missing blocks and return None"""
+        self.last_packet = time.time()
+        if self.next_expected < self.block_count:
+            ranges = self.received.ranges(self.next_expected, self.block_count, False,
+                                          MAX_MISSING_RANGES)
+            self.send(seal(f"MISSING|{encode_ranges(ranges)}"))
+            return None
+
+        # Everything is already in place on disk, and every leaf is folded in
+        self.transfer.close(complete=True)
+        verified = self.tree.digest() == digest
+        success_rate = (self.received_bytes / self.file_size) * 100 if self.file_size else 100.0
+        status = f"Received {self.received_bytes}/{self.file_size} bytes ({success_rate:.2f}%)"
+        status += ", digest verified" if verified else ", DIGEST MISMATCH"
+        if self.rebuilt:
+            status += f", {self.rebuilt} blocks rebuilt from parity"
+        if self.corrupt:
+            status += f", {self.corrupt} corrupt packets dropped"
+        return verified, status
+
+def serve(server_socket, output_dir='.', worker=0, max_transfers=None, batched=True, verbose=True):
+    """Receive uploads from any number of clients in parallel on one socket
+
+    Returns the status lines of completed transfers once max_transfers
+    have finished (never, when max_transfers is None).
+    """
+    sessions = {}        # {session_id: Session}
+    handshakes = {}      # {(client_address, header): session_id}, to repeat lost READYs
+    active_paths = {}    # {output path: Session} this worker is writing (the state lock covers the others)
+    finished = {}        # {session_id: (client_address, verified, status, expiry)} for late END_OF_FILEs
+    statuses = []
+    session_counter = itertools.count(1)
+    receiver = BatchReceiver(server_socket, batched)
+    dirty = set()        # sessions holding back an ACK
+    last_housekeeping = last_flush = time.time()
+    server_socket.settimeout(ACK_DELAY)
+
+    def start_session(info, client_address):
+        file_name, file_size, digest, block_size, fec_group = parse_handshake(info)
+        output_path = os.path.join(output_dir, f"received_{os.path.basename(file_name)}")
+        current = active_paths.get(output_path)
+        if current is not None:
+            if digest == NO_DIGEST or (file_size, digest) != (current.file_size, current.transfer.digest):
+                server_socket.sendto(b"BUSY", client_address)
+                return
+            # The same upload RESUMEd, by a restarted client: the old session is
+            # dead, hand its state file over rather than wait for it to time out
+            current.transfer.close(complete=False)
+            end_session(current)
+            if verbose:
+                print(f"Session {current.session_id:#x}: {current.file_name} taken over by {client_address}")
+        session_id = SESSION_FLAG | (worker << 20) | (next(session_counter) & 0xFFFFF)
+        try:
+            transfer = TransferState(output_path, file_size, digest, block_size)
+        except BlockingIOError:
+            server_socket.sendto(b"BUSY", client_address)  # Being written by another worker
+            return
+        session = Session(session_id, server_socket, client_address, file_name, transfer, fec_group)
+        sessions[session_id] = session
+        handshakes[(client_address, info)] = session_id
+        active_paths[output_path] = session
+        session.send(session.ready)
+        if verbose:
+            resumed = f", resuming with {transfer.received.count()} blocks on disk" if transfer.resumed else ""
+            print(f"Session {session_id:#x}: {file_name} ({file_size} bytes) from {client_address}{resumed}")
+
+    def end_session(session):
+        del sessions[session.session_id]
+        active_paths.pop(session.transfer.output_path, None)
+        for key in [key for key, sid in handshakes.items() if sid == session.session_id]:
+            del handshakes[key]
+
+    def on_control(message, address, now):
+        if message.startswith(b"END_OF_FILE|"):
+            # END_OF_FILE|<session id>|<sender's tree hash>|<crc>
+            try:
+                _, session_id, digest = unseal(message).split("|")
+                session_id, digest = int(session_id), bytes.fromhex(digest)
+            except ValueError:
+                return
+            session = sessions.get(session_id)
+            if session is not None and session.client_address == address:
+                result = session.on_end_of_file(digest)
+                if result is not None:
+                    verified, status = result
+                    end_session(session)
+                    finished[session_id] = (address, verified, status, now + FINISHED_LINGER)
+                    statuses.append(status)
+                    if verbose:
+                        print(f"Session {session_id:#x}: {session.file_name} complete. {status}")
+            if session_id in finished and finished[session_id][0] == address:
+                # Send completion and statistics; repeated END_OF_FILEs get them again
+                _, verified, status, _ = finished[session_id]
+                server_socket.sendto(b"COMPLETE" if verified else b"CORRUPT", address)
+                server_socket.sendto(status.encode(), address)
+        elif (address, message) in handshakes:
+            # Client never saw READY, say it again
+            session = sessions[handshakes[(address, message)]]
+            session.send(session.ready)
+        else:
+            try:
+                start_session(message, address)
+            except (ValueError, UnicodeDecodeError):
+                pass  # Stray packet from an old session
+            except OSError as e:
+                print(f"Cannot start transfer for {address}: {e}")
+                server_socket.sendto(b"ERROR", address)
+
+    while True:
+        try:
+            address, datagrams = receiver.receive()
+        except socket.timeout:
+            datagrams = []
+
+        now = time.time()
+        for datagram in datagrams:
+            if len(datagram) >= BLOCK_HEADER.size:
+                session_id, block_id, checksum = BLOCK_HEADER.unpack_from(datagram)
+                session = sessions.get(session_id)
+                if session is not None and session.client_address == address:
+                    payload = datagram[BLOCK_HEADER.size:]
+                    if block_id & PARITY_FLAG:
+                        session.on_parity(block_id & ~PARITY_FLAG, checksum, payload)
+                    else:
+                        session.on_block(block_id, checksum, payload)
+                    if session.unacked:
+                        dirty.add(session)
+                    continue
+            # Control messages
+            on_control(bytes(datagram), address, now)
+        if max_transfers is not None and len(statuses) >= max_transfers:
+            return statuses
+
+        # Once the socket is drained the sender is waiting on us: ACK now rather
+        # than after ACK_DELAY, or small windows would crawl at one per delay
+        if dirty and not select.select([server_socket], [], [], 0)[0]:
+            for session in dirty:
+                if session.unacked and session.session_id in sessions:
+                    session.send_ack()
+            dirty.clear()
+
+        # Delayed ACKs, idle sessions, periodic state flush
+        if now - last_housekeeping >= ACK_DELAY:
+            last_housekeeping = now
+            for session in list(sessions.values()):
+                if session.unacked:
+                    session.send_ack()
+                if now - session.last_packet > SESSION_TIMEOUT:
+                    # Keep the partial file and bitmap so the client can RESUME later
+                    session.transfer.close(complete=False)
+                    end_session(session)
+                    if verbose:
+                        print(f"Session {session.session_id:#x}: {session.file_name} timed out")
+            for session_id in [sid for sid, (*_, expiry) in finished.items() if expiry < now]:
+                del finished[session_id]
+        if now - last_flush > STATE_FLUSH_INTERVAL:
+            last_flush = now
+            for session in sessions.values():
+                session.transfer.flush()
+
+def receive_file(server_socket, output_dir='.', verbose=True):
+    """Receive one file and return the status line sent back to the client"""
+    return serve(server_socket, output_dir, max_transfers=1, verbose=verbose)[0]
+
+def open_socket(address, reuse_port=False):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    if reuse_port:
+        # The kernel spreads clients across the workers by address hash
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind(address)
+    return server_socket
+
+def run_worker(address, output_dir, worker, reuse_port):
+    server_socket = open_socket(address, reuse_port)
     try:
-        chunk, _ = server_socket.recvfrom(1032)
-        
-        if chunk == b"END_OF_FILE":
-            # Verify all blocks received
-            if len(received_data) * 1024 >= file_size:
-                server_socket.sendto(b"COMPLETE", client_address)
-                break
-            else:
-                # Request missing blocks
-                missing_blocks = []
-                total_blocks = (file_size + 1023) // 1024
-                for i in range(total_blocks):
-                    if i not in received_data:
-                        missing_blocks.append(i)
-                server_socket.sendto(f"MISSING|{','.join(map(str, missing_blocks))}".encode(), client_address)
-                continue
-        
-        block_id = struct.unpack('!Q', chunk[:8])[0]
-        data = chunk[8:]
-        
-        # Store data and send acknowledgment
-        if block_id not in received_data:
-            received_data[block_id] = data
-            received_bytes += len(data)
-            
-        # Send ACK
-        server_socket.sendto(f"ACK|{block_id}".encode(), client_address)
-        
-        progress = (received_bytes / file_size) * 100
-        print(f"\rProgress: {progress:.2f}%", end='')
-    
-    except socket.timeout:
-        continue
-
-# Combine all blocks in order
-ordered_data = bytearray()
-for i in range(len(received_data)):
-    ordered_data.extend(received_data[i])
-
-# Save received file
-output_path = f"received_{file_name}"
-with open(output_path, 'wb') as file:
-    file.write(ordered_data[:file_size])
-
-# Calculate and send statistics
-success_rate = (received_bytes / file_size) * 100
-status = f"Received {received_bytes}/{file_size} bytes ({success_rate:.2f}%)"
-print(f"\n{status}")
-
-# Send status multiple times to ensure delivery
-time.sleep(0.1)  # Small delay before sending status
-for _ in range(3):  # Send status 3 times
-    server_socket.sendto(status.encode(), client_address)
-    time.sleep(0.1)
-
-server_socket.close()
\ No newline at end of file
+        serve(server_socket, output_dir, worker=worker)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server_socket.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP file receiver")
+    parser.add_argument('--port', type=int, default=server_address[1])
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes sharing the port with SO_REUSEPORT")
+    parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args()
+    address = (server_address[0], args.port)
+
+    print(f"Server listening on port {args.port} with {args.workers} worker(s)...")
+    if args.workers == 1:
+        run_worker(address, args.output_dir, 0, False)
+        return
+    workers = [multiprocessing.Process(target=run_worker, args=(address, args.output_dir, i, True))
+               for i in range(args.workers)]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import socket
+import struct
+import sys
+
+# Batched datagram I/O for the UDP transfer path.
+#
+# On Linux, UDP generic segmentation offload (GSO) lets one sendmsg carry up
+# to 64 equal-sized datagrams that the kernel splits, and UDP_GRO hands the
+# receiver several datagrams from one flow in a single recvmsg. Elsewhere
+# (or if the kernel refuses) both fall back to one syscall per datagram.
+
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+MAX_GSO_SEGMENTS = 64
+MAX_UDP_PAYLOAD = 65507
+MAX_BATCH_BYTES = 65000   # one GSO super-packet must fit in a single IP datagram
+RECV_BUFFER_SIZE = 65536
+
+def path_mtu_payload(address, header_size):
+    """Largest block that fits one datagram on the path to address"""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(address)
+        mtu = probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        mtu = 1500
+    finally:
+        probe.close()
+    return min(mtu - 20 - 8, MAX_UDP_PAYLOAD) - header_size
+
+class BatchSender:
+    """Send lists of datagrams with as few syscalls as the platform allows"""
+    def __init__(self, sock, address, batched=True):
+        self.sock = sock
+        self.address = address
+        self.gso = batched and sys.platform.startswith('linux')
+        self.syscalls = 0
+
+    def send(self, packets):
+        if not self.gso:
+            for packet in packets:
+                self.sock.sendto(packet, self.address)
+            self.syscalls += len(packets)
+            return
+
+        # Runs of equal-sized datagrams go out as one GSO buffer; a shorter
+        # datagram may only close a run
+        start = 0
+        while start < len(packets):
+            segment = len(packets[start])
+            limit = min(MAX_GSO_SEGMENTS, max(1, MAX_BATCH_BYTES // segment))
+            end = start + 1
+            while end < len(packets) and end - start < limit and len(packets[end]) == segment:
+                end += 1
+            if end < len(packets) and end - start < limit and len(packets[end]) < segment:
+                end += 1
+            self._send_run(packets[start:end], segment)
+            start = end
+
+    def _send_run(self, run, segment):
+        self.syscalls += 1
+        if len(run) == 1:
+            self.sock.sendto(run[0], self.address)
+            return
+        try:
+            self.sock.sendmsg([b''.join(run)], [(socket.IPPROTO_UDP, UDP_SEGMENT, struct.pack('H', segment))],
+                              0, self.address)
+        except OSError:
+            # No GSO on this kernel or device, stay on plain sends from now on
+            self.gso = False
+            for packet in run:
+                self.sock.sendto(packet, self.address)
+            self.syscalls += len(run) - 1
+
+class BatchReceiver:
+    """Receive one or more datagrams per syscall into a reusable buffer"""
+    def __init__(self, sock, batched=True):
+        self.sock = sock
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.gro = False
+        self.syscalls = 0
+        if batched and sys.platform.startswith('linux'):
+            try:
+                sock.setsockopt(socket.IPPROTO_UDP, UDP_GRO, 1)
+                self.gro = True
+            except OSError:
+                pass
+        self.ancillary_size = socket.CMSG_SPACE(4) if self.gro else 0
+
+    def receive(self):
+        """Return (address, [memoryview of each datagram]); views are valid until the next call"""
+        self.syscalls += 1
+        if not self.gro:
+            nbytes, address = self.sock.recvfrom_into(self.buffer)
+            return address, [self.view[:nbytes]]
+
+        nbytes, ancillary, _, address = self.sock.recvmsg_into([self.buffer], self.ancillary_size)
+        segment = nbytes
+        for level, kind, data in ancillary:
+            if level == socket.IPPROTO_UDP and kind == UDP_GRO:
+                segment = struct.unpack('i', data[:4])[0]
+        if segment >= nbytes:
+            return address, [self.view[:nbytes]]
+        return address, [self.view[offset:min(offset + segment, nbytes)]
+                         for offset in range(0, nbytes, segment)]
@@ -0,0 +1,93 @@
+import argparse
+import multiprocessing
+import resource
+import socket
+import time
+
+from batchio import BatchSender, BatchReceiver
+
+# Microbenchmark for batchio.py: raw datagram rate over loopback, batched vs unbatched
+#   python bench_batchio.py --packets 200000 --size 1032
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def receiver(port_queue, results, batched, expected):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.5)
+    rx = BatchReceiver(sock, batched)
+    port_queue.put(sock.getsockname()[1])
+
+    packets = 0
+    received_bytes = 0
+    start = None
+    cpu_start = cpu_seconds()
+    try:
+        while packets < expected:
+            _, datagrams = rx.receive()
+            if start is None:
+                start = time.perf_counter()
+            packets += len(datagrams)
+            received_bytes += sum(len(d) for d in datagrams)
+    except socket.timeout:
+        pass  # Whatever the socket buffer dropped is not coming
+    elapsed = time.perf_counter() - (start or time.perf_counter())
+    results.put((packets, received_bytes, elapsed, cpu_seconds() - cpu_start, rx.syscalls))
+    sock.close()
+
+def run(batched, packet_count, size, burst):
+    port_queue = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=receiver, args=(port_queue, results, batched, packet_count))
+    process.start()
+    address = ('127.0.0.1', port_queue.get())
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)
+    tx = BatchSender(sock, address, batched)
+    packets = [bytes([i % 256]) * size for i in range(burst)]
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    for _ in range(packet_count // burst):
+        tx.send(packets)
+        time.sleep(0)  # Let the receiver keep up instead of measuring buffer drops
+    send_elapsed = time.perf_counter() - start
+    send_cpu = cpu_seconds() - cpu_start
+    sent = packet_count // burst * burst
+
+    received, received_bytes, recv_elapsed, recv_cpu, recv_syscalls = results.get()
+    process.join()
+    sock.close()
+    gigabytes = sent * size / 1e9
+    return {
+        'send_pps': sent / send_elapsed,
+        'send_cpu_per_gb': send_cpu / gigabytes,
+        'send_syscalls': tx.syscalls,
+        'recv_pps': received / recv_elapsed if recv_elapsed else 0.0,
+        'recv_cpu_per_gb': recv_cpu / (received_bytes / 1e9) if received_bytes else 0.0,
+        'recv_syscalls': recv_syscalls,
+        'loss': 1 - received / sent,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched vs unbatched UDP datagram I/O")
+    parser.add_argument('--packets', type=int, default=200_000)
+    parser.add_argument('--size', type=int, default=1032, help="datagram size in bytes")
+    parser.add_argument('--burst', type=int, default=64, help="datagrams handed to send() at once")
+    args = parser.parse_args()
+
+    print(f"{args.packets} datagrams of {args.size} bytes, bursts of {args.burst}")
+    print(f"{'mode':<10}{'send pps':>12}{'send CPU s/GB':>15}{'syscalls':>10}"
+          f"{'recv pps':>12}{'recv CPU s/GB':>15}{'syscalls':>10}{'loss':>8}")
+    for batched in (False, True):
+        r = run(batched, args.packets, args.size, args.burst)
+        mode = 'batched' if batched else 'plain'
+        print(f"{mode:<10}{r['send_pps']:>12.0f}{r['send_cpu_per_gb']:>15.2f}{r['send_syscalls']:>10}"
+              f"{r['recv_pps']:>12.0f}{r['recv_cpu_per_gb']:>15.2f}{r['recv_syscalls']:>10}"
+              f"{r['loss']:>8.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import re
+
+import benchmark
+from udp_protocol import DEFAULT_WINDOW
+
+# Completion time vs loss rate, with and without FEC, through lossy_proxy.py
+#   python bench_loss.py --size 8 --delay 5 --fec 8
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP transfer completion time vs datagram loss")
+    parser.add_argument('--size', type=int, default=4, help="file size in MB")
+    parser.add_argument('--delay', type=float, default=2.0, help="one-way delay in ms")
+    parser.add_argument('--fec', type=int, default=8, metavar='N', help="parity block per N blocks")
+    parser.add_argument('--loss', type=float, nargs='+', default=[0.0, 0.005, 0.01, 0.02, 0.05])
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+
+    print(f"{args.size} MB through the proxy, {args.delay} ms one-way delay")
+    print(f"{'loss':>6}{'no FEC (s)':>12}{'retransmits':>13}{f'FEC {args.fec} (s)':>12}"
+          f"{'retransmits':>13}{'rebuilt':>9}")
+    for loss in args.loss:
+        row = f"{loss:>6.1%}"
+        for fec_group in (0, args.fec):
+            # The proxy only runs when there is loss or delay to inject
+            results, elapsed, intact = benchmark.run(args.size, DEFAULT_WINDOW, args.port,
+                                                     fec_group=fec_group, loss=loss,
+                                                     delay=args.delay / 1000)
+            stats = results[0]
+            row += f"{elapsed:>12.2f}{stats['retransmissions']:>13}"
+            if not intact:
+                row += " (corrupt!)"
+        # The server's status line: "Received ..., digest verified, N blocks rebuilt from parity, ..."
+        match = re.search(r'(\d+) blocks rebuilt', stats['status'] or '')
+        rebuilt = match.group(1) if match else '0'
+        print(f"{row}{rebuilt:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import filecmp
+import multiprocessing
+import os
+import tempfile
+import time
+
+import ClientUDP
+import ServerUDP
+from lossy_proxy import run_proxy
+from udp_protocol import BLOCK_SIZE, DEFAULT_WINDOW
+
+# Throughput benchmark: push generated files through ClientUDP/ServerUDP on loopback
+#   python benchmark.py --size 64 --window 512
+#   python benchmark.py --size 16 --clients 8 --workers 4
+#   python benchmark.py --size 16 --loss 0.02 --delay 5 --fec 8
+
+def run_server(address, output_dir, ready, worker=0, reuse_port=False, batched=True):
+    server_socket = ServerUDP.open_socket(address, reuse_port)
+    ready.set()
+    try:
+        ServerUDP.serve(server_socket, output_dir=output_dir, worker=worker, batched=batched,
+                        verbose=False)
+    finally:
+        server_socket.close()
+
+def generate_file(path, size):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            block = os.urandom(min(remaining, 1024 * 1024))
+            f.write(block)
+            remaining -= len(block)
+
+def send_one(job):
+    source, address, window, block_size, batched, fec_group = job
+    return ClientUDP.send_file(source, address, window=window, block_size=block_size,
+                               batched=batched, fec_group=fec_group, verbose=False)
+
+def run(size_mb, window, port, clients=1, workers=1, block_size=BLOCK_SIZE, batched=True,
+        fec_group=0, loss=0.0, delay=0.0):
+    """Transfer one generated file per client; loss/delay route them through lossy_proxy.py"""
+    address = ('127.0.0.1', port)
+    with tempfile.TemporaryDirectory() as workdir:
+        sources = [os.path.join(workdir, f'bench{i}.bin') for i in range(clients)]
+        for source in sources:
+            generate_file(source, size_mb * 1024 * 1024)
+
+        servers = []
+        for worker in range(workers):
+            ready = multiprocessing.Event()
+            server = multiprocessing.Process(target=run_server,
+                                             args=(address, workdir, ready, worker, workers > 1,
+                                                   batched))
+            server.start()
+            ready.wait()
+            servers.append(server)
+        client_address = address
+        if loss or delay:
+            ready = multiprocessing.Event()
+            client_address = ('127.0.0.1', port + 1)
+            proxy = multiprocessing.Process(target=run_proxy,
+                                            args=(client_address, address, loss, delay, 1, ready))
+            proxy.start()
+            ready.wait()
+            servers.append(proxy)
+        try:
+            start = time.time()
+            with multiprocessing.Pool(clients) as pool:
+                jobs = [(source, client_address, window, block_size, batched, fec_group)
+                        for source in sources]
+                results = pool.map(send_one, jobs)
+            elapsed = time.time() - start
+        finally:
+            for server in servers:
+                server.terminate()
+                server.join()
+
+        intact = all(filecmp.cmp(source, os.path.join(workdir, f'received_{os.path.basename(source)}'),
+                                 shallow=False)
+                     for source in sources)
+    return results, elapsed, intact
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP file transfer throughput benchmark")
+    parser.add_argument('--size', type=int, default=32, help="file size in MB, per client")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="max blocks in flight")
+    parser.add_argument('--clients', type=int, default=1, help="concurrent uploads")
+    parser.add_argument('--workers', type=int, default=1, help="SO_REUSEPORT receiver processes")
+    parser.add_argument('--block-size', default=BLOCK_SIZE, help="bytes per datagram or 'auto'")
+    parser.add_argument('--no-batch', action='store_true', help="one syscall per datagram")
+    parser.add_argument('--fec', type=int, default=0, metavar='N', help="parity block per N blocks")
+    parser.add_argument('--loss', type=float, default=0.0, help="datagram loss through a proxy")
+    parser.add_argument('--delay', type=float, default=0.0, help="one-way proxy delay in ms")
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+
+    results, elapsed, intact = run(args.size, args.window, args.port, args.clients, args.workers,
+                                   args.block_size, not args.no_batch, args.fec, args.loss,
+                                   args.delay / 1000)
+    total_bytes = sum(stats['bytes'] for stats in results)
+    samples = [stats['srtt'] for stats in results if stats['srtt']]
+    srtt = f"{sum(samples) / len(samples) * 1000:.2f} ms" if samples else "n/a"
+    print(f"clients:         {args.clients} x {args.size} MB ({results[0]['blocks']} blocks each)")
+    print(f"workers:         {args.workers}")
+    print(f"window:          {args.window} blocks of {results[0]['block_size']} bytes")
+    print(f"send syscalls:   {sum(stats['syscalls'] for stats in results)}")
+    print(f"time:            {elapsed:.2f} s")
+    print(f"throughput:      {total_bytes / elapsed / 1e6:.1f} MB/s aggregate")
+    if args.clients > 1:
+        rates = [stats['bytes'] / stats['seconds'] / 1e6 for stats in results]
+        print(f"per client:      {min(rates):.1f} - {max(rates):.1f} MB/s")
+    print(f"retransmissions: {sum(stats['retransmissions'] for stats in results)}")
+    if args.fec:
+        print(f"parity blocks:   {sum(stats['parity_blocks'] for stats in results)}")
+        print(f"server status:   {results[0]['status']}")
+    print(f"smoothed RTT:    {srtt}")
+    print(f"files intact:    {intact}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+try:
+    import numpy
+except ImportError:  # NumPy is optional, big-int XOR is the fallback
+    numpy = None
+
+# XOR parity forward error correction for the UDP transfer.
+#
+# Blocks are grouped N at a time (group g holds blocks g*N .. g*N+N-1). After
+# the last block of a group the sender emits one parity datagram, the XOR of
+# the group's blocks zero-padded to the block size, under the block id
+# PARITY_FLAG | g. Any single lost block of a group is then rebuilt by the
+# receiver as parity XOR the blocks it did get, with no round trip.
+
+PARITY_FLAG = 1 << 63
+
+def group_of(block_id, group_size):
+    return block_id // group_size
+
+def group_blocks(group, group_size, block_count):
+    first = group * group_size
+    return range(first, min(first + group_size, block_count))
+
+def xor_into(accumulator, data):
+    """accumulator[:len(data)] ^= data, in place"""
+    if numpy is not None:
+        target = numpy.frombuffer(accumulator, dtype=numpy.uint8, count=len(data))
+        numpy.bitwise_xor(target, numpy.frombuffer(data, dtype=numpy.uint8), out=target)
+    else:
+        mixed = int.from_bytes(accumulator[:len(data)], 'little') ^ int.from_bytes(data, 'little')
+        accumulator[:len(data)] = mixed.to_bytes(len(data), 'little')
+
+class ParityEncoder:
+    """Sender side: accumulate blocks sent in order, hand back parity per full group"""
+    def __init__(self, group_size, block_size, block_count):
+        self.group_size = group_size
+        self.block_size = block_size
+        self.block_count = block_count
+        self.group = None
+        self.members = 0
+        self.parity = bytearray(block_size)
+
+    def add(self, block_id, data):
+        """Return (parity block id, parity bytes) when block_id closes a group, else None"""
+        group = group_of(block_id, self.group_size)
+        if group != self.group or block_id != group * self.group_size + self.members:
+            # Not a run from the start of the group (e.g. resuming), no parity for it
+            if block_id != group * self.group_size:
+                self.group = None
+                return None
+            self.group = group
+            self.members = 0
+            self.parity[:] = bytes(self.block_size)
+        xor_into(self.parity, data)
+        self.members += 1
+        if self.members == len(group_blocks(group, self.group_size, self.block_count)):
+            self.group = None
+            return PARITY_FLAG | group, bytes(self.parity)
+        return None
+
+def rebuild(parity, blocks, block_size):
+    """XOR the parity with every surviving block of the group to get the missing one"""
+    missing = bytearray(parity)
+    for data in blocks:
+        xor_into(missing, data)
+    return missing[:block_size]
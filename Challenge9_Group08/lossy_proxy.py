@@ -0,0 +1,82 @@
+import argparse
+import heapq
+import random
+import select
+import socket
+import time
+
+# Local UDP proxy that drops (and optionally delays or corrupts) datagrams
+# in both directions, to test ClientUDP.py / ServerUDP.py on a lossy link:
+#   python ServerUDP.py
+#   python lossy_proxy.py --listen 5002 --target 5000 --loss 0.05 --delay 10
+#   (point ClientUDP.py at port 5002)
+
+def run_proxy(listen_address, target_address, loss, delay=0.0, seed=None, ready=None, corrupt=0.0):
+    rng = random.Random(seed)
+    front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    front.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    front.bind(listen_address)
+    upstreams = {}    # {client_address: socket facing the server}
+    clients = {}      # {upstream socket: client_address}
+    delayed = []      # heap of (release time, sequence, socket, datagram, address)
+    sequence = 0
+    if ready is not None:
+        ready.set()
+
+    def forward(sock, datagram, address):
+        nonlocal sequence
+        if rng.random() < loss:
+            return
+        if corrupt and rng.random() < corrupt:
+            damaged = bytearray(datagram)
+            damaged[rng.randrange(len(damaged))] ^= 1 << rng.randrange(8)
+            datagram = bytes(damaged)
+        if delay:
+            sequence += 1
+            heapq.heappush(delayed, (time.monotonic() + delay, sequence, sock, datagram, address))
+        else:
+            sock.sendto(datagram, address)
+
+    while True:
+        timeout = max(0.0, delayed[0][0] - time.monotonic()) if delayed else None
+        readable, _, _ = select.select([front] + list(clients), [], [], timeout)
+        for sock in readable:
+            datagram, address = sock.recvfrom(65535)
+            if sock is front:
+                upstream = upstreams.get(address)
+                if upstream is None:
+                    # One upstream socket per client so the server still tells them apart
+                    upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    upstream.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+                    upstream.bind(('127.0.0.1', 0))
+                    upstreams[address] = upstream
+                    clients[upstream] = address
+                forward(upstream, datagram, target_address)
+            else:
+                forward(front, datagram, clients[sock])
+
+        now = time.monotonic()
+        while delayed and delayed[0][0] <= now:
+            _, _, sock, datagram, address = heapq.heappop(delayed)
+            sock.sendto(datagram, address)
+
+def main():
+    parser = argparse.ArgumentParser(description="Lossy UDP proxy")
+    parser.add_argument('--listen', type=int, default=5002, help="port clients send to")
+    parser.add_argument('--target', type=int, default=5000, help="port of ServerUDP.py")
+    parser.add_argument('--loss', type=float, default=0.05, help="drop probability per datagram")
+    parser.add_argument('--delay', type=float, default=0.0, help="one-way delay in ms")
+    parser.add_argument('--corrupt', type=float, default=0.0, help="bit-flip probability per datagram")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    print(f"Forwarding 127.0.0.1:{args.listen} -> 127.0.0.1:{args.target}, "
+          f"{args.loss:.1%} loss, {args.delay} ms delay")
+    try:
+        run_proxy(('127.0.0.1', args.listen), ('127.0.0.1', args.target), args.loss,
+                  args.delay / 1000, args.seed, corrupt=args.corrupt)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
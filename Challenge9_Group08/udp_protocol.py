@@ -0,0 +1,160 @@
+import hashlib
+import re
+import struct
+import zlib
+
+# Shared constants and helpers for ClientUDP.py / ServerUDP.py
+
+BLOCK_SIZE = 1024
+BLOCK_HEADER = struct.Struct('!IQI')  # session id, block id and CRC32 of the payload
+
+DIGEST_SIZE = 16
+NO_DIGEST = bytes(DIGEST_SIZE)  # plain "name|size" handshake, never resumed
+
+DEFAULT_WINDOW = 512      # max blocks in flight (flow window)
+MAX_SACK_RANGES = 64      # selective ACK ranges carried per ACK datagram
+MAX_MISSING_RANGES = 2048 # ranges carried per MISSING reply
+ACK_EVERY = 16            # receiver sends a cumulative ACK every N in-order blocks
+ACK_DELAY = 0.01          # ...or after this much idle time
+
+def total_blocks(file_size, block_size=BLOCK_SIZE):
+    return (file_size + block_size - 1) // block_size
+
+def leaf_hash(block):
+    return hashlib.blake2b(block, digest_size=DIGEST_SIZE, person=b'udp-leaf').digest()
+
+class TreeHash:
+    """Whole-file digest over per-block leaf hashes, fed in block order
+
+    Complete subtrees are merged as soon as they exist, so only one node per
+    level is kept. Leaves can be computed in any order (the receiver stores
+    them as blocks arrive) and folded in once the in-order frontier passes.
+    """
+    def __init__(self):
+        self.stack = []   # [(level, digest)], levels strictly decreasing
+        self.leaves = 0
+
+    @staticmethod
+    def parent(left, right):
+        return hashlib.blake2b(left + right, digest_size=DIGEST_SIZE, person=b'udp-node').digest()
+
+    def add_leaf(self, leaf):
+        level, node = 0, bytes(leaf)
+        while self.stack and self.stack[-1][0] == level:
+            node = self.parent(self.stack.pop()[1], node)
+            level += 1
+        self.stack.append((level, node))
+        self.leaves += 1
+
+    def digest(self):
+        if not self.stack:
+            return leaf_hash(b'')
+        node = self.stack[-1][1]
+        for _, left in reversed(self.stack[:-1]):
+            node = self.parent(left, node)
+        return node
+
+def file_digest(path, block_size=BLOCK_SIZE):
+    """Tree hash of a file, identifying a transfer for RESUME and checked at the end"""
+    tree = TreeHash()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            tree.add_leaf(leaf_hash(block))
+    return tree.digest()
+
+def encode_ranges(ranges):
+    """Encode [(first, last), ...] as "a-b,c,d-e" """
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+def decode_ranges(text):
+    """Decode "a-b,c,d-e" back into [(first, last), ...]"""
+    ranges = []
+    if not text:
+        return ranges
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            ranges.append((int(first), int(last)))
+        else:
+            ranges.append((int(part), int(part)))
+    return ranges
+
+def ids_to_ranges(ids, limit=None):
+    """Collapse sorted block ids into (first, last) ranges"""
+    ranges = []
+    for block_id in ids:
+        if ranges and ranges[-1][1] == block_id - 1:
+            ranges[-1] = (ranges[-1][0], block_id)
+        else:
+            if limit is not None and len(ranges) >= limit:
+                break
+            ranges.append((block_id, block_id))
+    return ranges
+
+def seal(message):
+    """Append |<crc32> so a damaged control message is dropped, not misread"""
+    return f"{message}|{zlib.crc32(message.encode()):08x}".encode()
+
+def unseal(datagram):
+    """Return the message without its checksum, raise ValueError if damaged"""
+    message, _, checksum = bytes(datagram).rpartition(b"|")
+    if not message or checksum != b"%08x" % zlib.crc32(message):
+        raise ValueError("damaged control message")
+    return message.decode()
+
+def encode_ack(cumulative, ranges):
+    """ACK|<next expected block>|<selective ranges above it>"""
+    return seal(f"ACK|{cumulative}|{encode_ranges(ranges)}")
+
+def parse_ack(message):
+    _, cumulative, ranges = unseal(message).split("|", 2)
+    return int(cumulative), decode_ranges(ranges)
+
+_ANY_CLEAR = re.compile(rb'[^\xff]')
+_ANY_SET = re.compile(rb'[^\x00]')
+
+class Bitmap:
+    """One bit per block on top of a writable buffer (bytearray or mmap)"""
+    def __init__(self, size, buffer=None):
+        self.size = size
+        self.bits = buffer if buffer is not None else bytearray((size + 7) // 8)
+
+    def test(self, index):
+        return self.bits[index >> 3] >> (index & 7) & 1
+
+    def set(self, index):
+        self.bits[index >> 3] |= 1 << (index & 7)
+
+    def count(self):
+        return int.from_bytes(self.bits[:(self.size + 7) // 8], 'little').bit_count()
+
+    def _next(self, start, stop, want, skip_bytes):
+        index = start
+        while index < stop:
+            if index & 7 == 0:
+                # Whole bytes without the bit we want are skipped at C speed
+                match = skip_bytes.search(self.bits, index >> 3, (stop + 7) >> 3)
+                if match is None:
+                    return stop
+                index = max(index, match.start() * 8)
+            if self.test(index) == want:
+                return min(index, stop)
+            index += 1
+        return stop
+
+    def next_clear(self, start, stop=None):
+        return self._next(start, self.size if stop is None else stop, 0, _ANY_CLEAR)
+
+    def next_set(self, start, stop=None):
+        return self._next(start, self.size if stop is None else stop, 1, _ANY_SET)
+
+    def ranges(self, start, stop, want_set, limit=None):
+        """(first, last) runs of set (or clear) bits in [start, stop)"""
+        ranges = []
+        find, skip = (self.next_set, self.next_clear) if want_set else (self.next_clear, self.next_set)
+        index = find(start, stop)
+        while index < stop and (limit is None or len(ranges) < limit):
+            end = skip(index, stop)
+            ranges.append((index, end - 1))
+            index = find(end, stop)
+        return ranges